@@ -0,0 +1,149 @@
+"""Show how a burst of logins affects the latency of other requests.
+
+Serves the app with waitress on a local port, keeps ``--stormers``
+clients logging in as fast as they can, and meanwhile times ``GET
+/api/v1`` from a single probe client. Runs once with hashing inline on
+the request threads and once on the worker pool::
+
+    $ python benchmarks/login_storm.py --seconds 10
+"""
+import argparse
+from datetime import datetime
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import transaction
+from waitress import serve
+
+from pyramid_todo import main as make_app
+from pyramid_todo.models import Profile, get_tm_session
+from pyramid_todo.models.meta import Base
+from pyramid_todo.security import hasher
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_app(settings, port, threads):
+    logging.getLogger('waitress').setLevel(logging.ERROR)
+    app = make_app({}, **settings)
+    session_factory = app.registry['dbsession_factory']
+    Base.metadata.create_all(session_factory.kw['bind'])
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        if not dbsession.query(Profile).count():
+            dbsession.add(Profile(
+                username='stormy', email='stormy@example.com',
+                password=hasher.hash('potato'), date_joined=datetime.now()
+            ))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        serve(app, host='127.0.0.1', port=port, threads=threads)
+    finally:
+        app.registry['password_hasher'].shutdown()
+
+
+def wait_until_up(base):
+    for _ in range(100):
+        try:
+            return urlopen(base + '/api/v1').read()
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def run(settings, args):
+    port = free_port()
+    server = multiprocessing.Process(
+        target=serve_app, args=(settings, port, args.threads)
+    )
+    server.start()
+    base = 'http://127.0.0.1:{}'.format(port)
+    wait_until_up(base)
+    login = urlencode({'username': 'stormy', 'password': 'potato'}).encode()
+
+    stop = time.time() + args.seconds
+    counts = {'ok': 0, 'busy': 0}
+
+    def storm():
+        while time.time() < stop:
+            try:
+                urlopen(base + '/api/v1/accounts/login', login).read()
+                counts['ok'] += 1
+            except HTTPError as error:
+                counts['busy' if error.code == 503 else 'ok'] += 1
+
+    stormers = [threading.Thread(target=storm) for _ in range(args.stormers)]
+    for thread in stormers:
+        thread.start()
+    latencies = []
+    while time.time() < stop:
+        start = time.time()
+        urlopen(base + '/api/v1').read()
+        latencies.append(time.time() - start)
+        time.sleep(0.01)
+    for thread in stormers:
+        thread.join()
+    server.terminate()
+    server.join()
+    return latencies, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--stormers', type=int, default=16,
+                        help='concurrent clients logging in')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='waitress worker threads')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='hashing processes in pool mode')
+    parser.add_argument('--max-pending', type=int, default=2)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    os.environ['DATABASE_URL'] = 'sqlite:///{}'.format(path)
+    modes = [
+        ('inline', {'pyramid_todo.hash_workers': '0'}),
+        ('pool', {
+            'pyramid_todo.hash_workers': str(args.workers),
+            'pyramid_todo.hash_max_pending': str(args.max_pending),
+        }),
+    ]
+    print('{:<8}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+        'hashing', 'p50 ms', 'p95 ms', 'p99 ms', 'logins', 'shed'))
+    try:
+        for name, settings in modes:
+            latencies, counts = run(settings, args)
+            print('{:<8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10}{:>10}'.format(
+                name,
+                percentile(latencies, 0.50) * 1000,
+                percentile(latencies, 0.95) * 1000,
+                percentile(latencies, 0.99) * 1000,
+                counts['ok'], counts['busy'],
+            ))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Time the hot lookup queries before and after ``migratedb`` adds indexes.
+
+Seeds a throwaway SQLite database without any secondary indexes, times
+the profile and task lookups every request makes, then runs the
+migration and times them again::
+
+    $ python benchmarks/lookups.py --profiles 2000 --tasks 50
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+import tempfile
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from pyramid_todo.models import Profile, Task, task_page
+from pyramid_todo.models.meta import Base
+from pyramid_todo.scripts.migratedb import upgrade
+
+
+def seed(engine, profiles, tasks_per_profile):
+    """Fill an index-free schema with ``profiles`` x ``tasks_per_profile`` rows."""
+    Base.metadata.create_all(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(engine)
+
+    start = datetime(2018, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(Profile.__table__.insert(), [{
+            'id': i + 1,
+            'username': 'user{}'.format(i),
+            'email': 'user{}@example.com'.format(i),
+            'password': 'x',
+            'date_joined': start,
+        } for i in range(profiles)])
+        for i in range(profiles):
+            connection.execute(Task.__table__.insert(), [{
+                'name': 'task {}'.format(j),
+                'note': '',
+                'creation_date': start + timedelta(minutes=j),
+                'due_date': start + timedelta(days=random.randint(0, 365)),
+                'completed': j % 3 == 0,
+                'profile_id': i + 1,
+            } for j in range(tasks_per_profile)])
+
+
+def lookups(session, profiles):
+    """The queries behind login, get_profile and the task listing."""
+    def profile_by_username():
+        username = 'user{}'.format(random.randrange(profiles))
+        session.query(Profile).filter(Profile.username == username).first()
+
+    def task_listing():
+        task_page(session, random.randint(1, profiles), 50)
+
+    def open_tasks_due_soon():
+        task_page(
+            session, random.randint(1, profiles), 50, sort='due_date',
+            completed=False, due_before=datetime(2018, 2, 1)
+        )
+
+    return [
+        ('profile by username', profile_by_username),
+        ('task listing', task_listing),
+        ('open tasks due soon', open_tasks_due_soon),
+    ]
+
+
+def measure(engine, profiles, repeat):
+    session = sessionmaker(bind=engine)()
+    try:
+        return [
+            (name, min(timeit.repeat(query, number=1, repeat=repeat)))
+            for name, query in lookups(session, profiles)
+        ]
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=1000)
+    parser.add_argument('--tasks', type=int, default=50,
+                        help='tasks per profile')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    try:
+        engine = create_engine('sqlite:///{}'.format(path))
+        seed(engine, args.profiles, args.tasks)
+        before = measure(engine, args.profiles, args.repeat)
+        upgrade(engine)
+        after = measure(engine, args.profiles, args.repeat)
+    finally:
+        os.remove(path)
+
+    print('{} profiles x {} tasks, best of {}'.format(
+        args.profiles, args.tasks, args.repeat))
+    print('{:<24}{:>14}{:>14}{:>10}'.format(
+        'query', 'no index (ms)', 'indexed (ms)', 'speedup'))
+    for (name, slow), (_, fast) in zip(before, after):
+        print('{:<24}{:>14.3f}{:>14.3f}{:>9.1f}x'.format(
+            name, slow * 1000, fast * 1000, slow / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""Drive every route in process and report throughput and latency.
+
+Builds the static assets, then the app with ``pyramid_todo.main`` on a
+throwaway SQLite database seeded with ``--profiles`` x ``--tasks`` rows,
+then sends each route ``--requests`` requests through WebTest, one at a
+time. Results can be saved as JSON and compared with an earlier run to
+flag regressions::
+
+    $ python benchmarks/routes.py --output before.json
+    $ git checkout some-branch
+    $ python benchmarks/routes.py --compare before.json
+
+With ``--compare``, the exit status is 1 if any route's p50 or p95
+latency got worse by more than ``--threshold``.
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import select
+from webtest import AppError, TestApp
+
+from pyramid_todo import main as make_app
+from pyramid_todo.assets import build_assets
+from pyramid_todo.models import Profile, Task
+from pyramid_todo.models.meta import Base
+from pyramid_todo.security import hasher
+
+
+PASSWORD = 'potato'
+ROUTES = (
+    'info', 'status', 'metrics', 'register', 'login', 'logout',
+    'tasks_list', 'task_create', 'task_batch', 'task_export', 'task_summary',
+    'task_search', 'task_detail', 'task_update', 'task_delete',
+    'profile_detail', 'profile_update', 'profile_delete', 'static_asset',
+)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def seed(engine, profiles, tasks_per_profile, spare):
+    """Create ``profiles`` x ``tasks_per_profile`` rows, plus rows to delete.
+
+    ``user0`` is the profile the read and update routes use. ``user1``
+    gets ``spare`` extra tasks for ``task_delete`` to remove, and
+    ``spare{n}`` profiles are made for ``profile_delete``. All share one
+    password hash, since hashing thousands of passwords would take minutes.
+    Returns the ids of the spare tasks.
+    """
+    Base.metadata.create_all(engine)
+    password = hasher.hash(PASSWORD)
+    start = datetime(2018, 1, 1)
+    usernames = ['user{}'.format(i) for i in range(profiles)]
+    usernames += ['spare{}'.format(i) for i in range(spare)]
+    with engine.begin() as connection:
+        connection.execute(Profile.__table__.insert(), [{
+            'id': i + 1,
+            'username': username,
+            'email': '{}@example.com'.format(username),
+            'password': password,
+            'date_joined': start,
+            'modified': start,
+        } for i, username in enumerate(usernames)])
+        for i in range(profiles):
+            connection.execute(Task.__table__.insert(), [{
+                'name': 'task {}'.format(j),
+                'note': 'a note about task {}'.format(j),
+                'creation_date': start + timedelta(minutes=j),
+                'due_date': start + timedelta(days=j % 365) if j % 2 else None,
+                'completed': j % 3 == 0,
+                'profile_id': i + 1,
+            } for j in range(tasks_per_profile)])
+        connection.execute(Task.__table__.insert(), [{
+            'name': 'spare task {}'.format(j),
+            'creation_date': start,
+            'completed': False,
+            'profile_id': 2,
+        } for j in range(spare)])
+        return [row[0] for row in connection.execute(
+            select([Task.id]).where(Task.name.like('spare task %'))
+        )]
+
+
+def logged_in(app, username):
+    client = TestApp(app)
+    client.post('/api/v1/accounts/login', {'username': username, 'password': PASSWORD})
+    return client
+
+
+def scenarios(app, count, spare_task_ids, manifest):
+    """Map each route to a list of ``(prepare, send)`` pairs, one per request.
+
+    ``prepare`` runs untimed before ``send`` and may be ``None``. Both
+    are called without arguments. ``manifest`` maps static files to the
+    built names they are served under.
+    """
+    user = logged_in(app, 'user0')
+    url = '/api/v1/accounts/user0'
+    task_ids = [task['id'] for task in user.get(url + '/tasks', {'limit': 50}).json['tasks']]
+    guest = TestApp(app)
+    visitor = TestApp(app)
+    deleter = logged_in(app, 'user1')
+    leaver = TestApp(app)
+    counter = iter(range(sys.maxsize))
+
+    def each(send, prepare=None):
+        return [(prepare, send) for _ in range(count)]
+
+    def register():
+        name = 'newcomer{}'.format(next(counter))
+        return guest.post('/api/v1/accounts', {
+            'username': name, 'email': name + '@example.com',
+            'password': PASSWORD, 'password2': PASSWORD,
+        })
+
+    def task_url(i):
+        return '{}/tasks/{}'.format(url, task_ids[i % len(task_ids)])
+
+    batch = {'operations': [
+        {'op': 'create', 'name': 'batched {}'.format(i)} for i in range(10)
+    ]}
+    return {
+        'info': each(lambda: guest.get('/api/v1')),
+        'status': each(lambda: guest.get('/api/v1/status')),
+        'metrics': each(lambda: guest.get('/metrics')),
+        'register': each(register),
+        'login': each(lambda: guest.post(
+            '/api/v1/accounts/login', {'username': 'user0', 'password': PASSWORD}
+        )),
+        'logout': each(lambda: visitor.get('/api/v1/accounts/logout'),
+                       prepare=lambda: visitor.post('/api/v1/accounts/login', {
+                           'username': 'user0', 'password': PASSWORD})),
+        'tasks_list': each(lambda: user.get(url + '/tasks')),
+        'task_create': each(lambda: user.post(url + '/tasks', {
+            'name': 'New task', 'note': 'made by the benchmark',
+            'due_date': '01/02/2018 00:00:00', 'completed': 'false',
+        })),
+        'task_batch': each(lambda: user.post_json(url + '/tasks/batch', batch)),
+        'task_export': each(lambda: user.get(url + '/tasks/export')),
+        'task_summary': each(lambda: user.get(url + '/tasks/summary')),
+        'task_search': each(lambda: user.get(url + '/tasks/search', {'q': 'note about task'})),
+        'task_detail': [
+            (None, lambda i=i: user.get(task_url(i))) for i in range(count)
+        ],
+        'task_update': [
+            (None, lambda i=i: user.put(task_url(i), {'name': 'Renamed {}'.format(i)}))
+            for i in range(count)
+        ],
+        'task_delete': [
+            (None, lambda task_id=task_id: deleter.delete(
+                '/api/v1/accounts/user1/tasks/{}'.format(task_id)
+            )) for task_id in spare_task_ids[:count]
+        ],
+        'profile_detail': each(lambda: user.get(url)),
+        'profile_update': each(lambda: user.put(url, {'email': 'user0@example.org'})),
+        'profile_delete': [
+            (lambda name=name: leaver.post('/api/v1/accounts/login', {
+                'username': name, 'password': PASSWORD}),
+             lambda name=name: leaver.delete('/api/v1/accounts/' + name))
+            for name in ('spare{}'.format(i) for i in range(count))
+        ],
+        'static_asset': each(lambda: guest.get(
+            '/static/' + manifest['theme.css'], headers={'Accept-Encoding': 'gzip'}
+        )),
+    }
+
+
+def run(requests):
+    """Send the requests in order and summarise their timings."""
+    latencies = []
+    errors = 0
+    for prepare, send in requests:
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        try:
+            send()
+        except AppError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / sum(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(args):
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    os.environ['DATABASE_URL'] = 'sqlite:///{}'.format(path)
+    try:
+        # as the run script does, so the built assets are served
+        manifest = build_assets()
+        app = make_app({}, **{
+            'pyramid_todo.hash_workers': '0', 'pyramid_todo.status_from': '*',
+        })
+        engine = app.registry['dbsession_factory'].kw['bind']
+        per_route = args.requests + args.warmup
+        spare_ids = seed(engine, args.profiles, args.tasks, per_route)
+        routes = scenarios(app, per_route, spare_ids, manifest)
+        results = {}
+        for route in args.routes:
+            if args.warmup:
+                run(routes[route][:args.warmup])
+            results[route] = run(routes[route][args.warmup:])
+    finally:
+        os.remove(path)
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'profiles': args.profiles,
+            'tasks': args.tasks,
+            'requests': args.requests,
+        },
+        'routes': results,
+    }
+
+
+def print_results(results):
+    print('{:<16}{:>10}{:>10}{:>10}{:>10}{:>8}'.format(
+        'route', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for route, stats in results['routes'].items():
+        print('{:<16}{:>10.0f}{:>10.2f}{:>10.2f}{:>10.2f}{:>8}'.format(
+            route, stats['throughput'], stats['p50_ms'], stats['p95_ms'],
+            stats['p99_ms'], stats['errors']))
+
+
+def compare(baseline, results, threshold):
+    """Print how each route moved since the baseline; return the regressions."""
+    regressions = []
+    print('{:<16}{:>12}{:>12}{:>14}'.format(
+        'route', 'p50 change', 'p95 change', 'req/s change'))
+    for route, stats in results['routes'].items():
+        before = baseline['routes'].get(route)
+        if before is None:
+            print('{:<16}{:>12}'.format(route, 'new'))
+            continue
+        changes = [
+            stats[key] / before[key] - 1 for key in ('p50_ms', 'p95_ms', 'throughput')
+        ]
+        worse = changes[0] > threshold or changes[1] > threshold
+        if worse:
+            regressions.append(route)
+        print('{:<16}{:>+12.1%}{:>+12.1%}{:>+14.1%}  {}'.format(
+            route, changes[0], changes[1], changes[2], 'REGRESSION' if worse else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', type=int, default=100)
+    parser.add_argument('--tasks', type=int, default=100,
+                        help='tasks per profile')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='untimed requests per route first')
+    parser.add_argument('--routes', nargs='+', choices=ROUTES, default=ROUTES,
+                        metavar='ROUTE', help='routes to run (default: all)')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with results saved by --output')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='latency increase flagged as a regression')
+    args = parser.parse_args()
+    if args.profiles < 2:
+        parser.error('--profiles must be at least 2')
+
+    results = benchmark(args)
+    meta = results['meta']
+    print('{} profiles x {} tasks, {} requests per route, revision {}'.format(
+        meta['profiles'], meta['tasks'], meta['requests'], meta['revision']))
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print('\ncompared with revision {}:'.format(baseline['meta']['revision']))
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Compare the task serialization paths on an in-memory task list.
+
+Times ``json.dumps([task.to_dict() ...])``, the path list responses used
+to take, against the field-plan serializers with each available encoder,
+both on ORM objects and on the plain column rows the list views now
+query for::
+
+    $ python benchmarks/serializers.py --tasks 10000
+"""
+import argparse
+from collections import namedtuple
+from datetime import datetime, timedelta
+import json
+import timeit
+
+from pyramid_todo.models import Task
+from pyramid_todo.serializers import get_dumps, orjson, serialize_task
+
+
+def make_tasks(count):
+    start = datetime(2018, 1, 1, 8, 30, 15)
+    return [Task(
+        id=i,
+        name='task number {}'.format(i),
+        note='remember to do the thing' if i % 2 else None,
+        creation_date=start + timedelta(minutes=i),
+        due_date=start + timedelta(days=i % 90) if i % 3 else None,
+        completed=i % 4 == 0,
+        profile_id=1,
+    ) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tasks = make_tasks(args.tasks)
+    Row = namedtuple('Row', serialize_task.keys)
+    rows = [Row(**task.to_dict()) for task in tasks]
+    rows = [row._replace(
+        creation_date=task.creation_date, due_date=task.due_date
+    ) for row, task in zip(rows, tasks)]
+    cases = [
+        ('to_dict + json.dumps',
+         lambda: json.dumps([task.to_dict() for task in tasks])),
+    ]
+    encoders = ['stdlib'] + (['orjson'] if orjson is not None else [])
+    for name in encoders:
+        dumps = get_dumps(name)
+        cases.append((
+            'serialize_task + {}'.format(name),
+            lambda dumps=dumps: dumps([serialize_task(task) for task in tasks])
+        ))
+        cases.append((
+            'rows + {}'.format(name),
+            lambda dumps=dumps: dumps([serialize_task(row) for row in rows])
+        ))
+
+    assert cases[0][1]() == cases[1][1]()
+    baseline = None
+    print('{} tasks, best of {}'.format(args.tasks, args.repeat))
+    for name, case in cases:
+        best = min(timeit.repeat(case, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print('{:<28}{:>10.2f} ms{:>8.1f}x'.format(
+            name, best * 1000, baseline / best))
+
+
+if __name__ == '__main__':
+    main()
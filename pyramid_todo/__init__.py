@@ -6,11 +6,18 @@ def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
     """
     settings['sqlalchemy.url'] = os.environ.get('DATABASE_URL', '')
+    if 'DATABASE_REPLICA_URLS' in os.environ:
+        settings['pyramid_todo.replica_urls'] = os.environ['DATABASE_REPLICA_URLS']
     config = Configurator(settings=settings)
     config.include('pyramid_jinja2')
+    config.include('pyramid_todo.admission')
     config.include('pyramid_todo.models')
+    config.include('pyramid_todo.metrics')
+    config.include('pyramid_todo.compression')
+    config.include('pyramid_todo.renderers')
+    config.include('pyramid_todo.reminders')
     config.include('pyramid_todo.routes')
     config.include('pyramid_todo.security')
-    config.include('pyramid_todo.utils')
+    config.include('pyramid_todo.cors')
     config.scan()
     return config.make_wsgi_app()
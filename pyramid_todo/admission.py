@@ -0,0 +1,199 @@
+"""Admission control: cap how many requests of each kind run at once.
+
+A tween gives every route class (a route name, or ``*`` for the routes
+not named) a budget of concurrent requests. A request over its class's
+budget is turned away at once with a 503 and ``Retry-After`` instead of
+waiting for a thread and doing its database work anyway. This keeps a
+flood of logins from using up every worker thread, for example.
+"""
+import threading
+import time
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.settings import aslist
+from pyramid.tweens import EXCVIEW
+
+
+class Overloaded(Exception):
+    """A request was turned away because the server has too much to do."""
+
+
+class RouteBudget(object):
+    """How many requests of one route class may run at once.
+
+    A request waits up to ``wait`` seconds for a free slot before it is
+    shed. ``in_flight``, ``waiting`` and ``shed`` count the requests
+    running, queued for a slot and turned away.
+    """
+
+    def __init__(self, limit, wait=0):
+        self.limit = limit
+        self.wait = wait
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+        self._slots = threading.BoundedSemaphore(limit) if limit else None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a slot, returning ``False`` if none came free in time."""
+        with self._lock:
+            self.waiting += 1
+        if self._slots is None:
+            acquired = False
+        elif self.wait:
+            acquired = self._slots.acquire(timeout=self.wait)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.in_flight += 1
+            else:
+                self.shed += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'shed': self.shed,
+        }
+
+
+class AdmissionControl(object):
+    """The budgets for each route class, kept in ``registry['admission']``.
+
+    ``limits`` maps route names to their budgets; ``*`` is shared by the
+    routes that are not named, and those routes are not limited at all
+    without it. Requests that were queued for longer than
+    ``max_queue_age`` seconds before reaching the app, going by the
+    ``X-Request-Start`` header a proxy in front may add, are shed as well,
+    since their client has most likely given up on them.
+    """
+
+    def __init__(self, limits, wait=0, max_queue_age=None):
+        self.budgets = {
+            name: RouteBudget(limit, wait) for name, limit in limits.items()
+        }
+        self.max_queue_age = max_queue_age
+        self.expired = 0
+
+    def budget_for(self, route_name):
+        return self.budgets.get(route_name, self.budgets.get('*'))
+
+    def has_expired(self, request):
+        """Check whether the request sat in a queue for too long already."""
+        if self.max_queue_age is None:
+            return False
+        started = request_start(request)
+        if started is None or time.time() - started <= self.max_queue_age:
+            return False
+        self.expired += 1
+        return True
+
+    def stats(self):
+        stats = {name: budget.stats() for name, budget in self.budgets.items()}
+        return {'routes': stats, 'expired': self.expired}
+
+
+def request_start(request):
+    """When a proxy received the request, from ``X-Request-Start``.
+
+    Accepts seconds (``t=1513795230.123``), milliseconds or microseconds
+    since the epoch, with or without the ``t=`` prefix. Returns ``None``
+    if the header is missing or unreadable.
+    """
+    value = request.headers.get('X-Request-Start', '')
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    if started > 1e14:
+        return started / 1e6
+    if started > 1e11:
+        return started / 1e3
+    return started
+
+
+def parse_limits(value):
+    """Read ``route=limit`` pairs separated by whitespace into a dict."""
+    limits = {}
+    for item in aslist(value or ''):
+        name, _, limit = item.partition('=')
+        try:
+            limits[name] = int(limit)
+        except ValueError:
+            raise ValueError('Bad admission limit: {!r}'.format(item))
+    return limits
+
+
+class _ReleasingIterable(object):
+    """Hold a budget slot until a streamed response body has been sent."""
+
+    def __init__(self, app_iter, release):
+        self.app_iter = app_iter
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.release()
+
+
+def admission_tween_factory(handler, registry):
+    control = registry['admission']
+    mapper = registry.queryUtility(IRoutesMapper)
+
+    def admission_tween(request):
+        if control.has_expired(request):
+            raise Overloaded()
+        route = mapper(request)['route'] if mapper is not None else None
+        budget = control.budget_for(route.name if route is not None else None)
+        if budget is None:
+            return handler(request)
+        if not budget.acquire():
+            raise Overloaded()
+        try:
+            response = handler(request)
+        except BaseException:
+            budget.release()
+            raise
+        content_length = response.content_length
+        response.app_iter = _ReleasingIterable(response.app_iter, budget.release)
+        response.content_length = content_length
+        return response
+
+    return admission_tween
+
+
+def includeme(config):
+    """Install the admission tween if any limits are configured.
+
+    It sits under the exception view tween, which renders ``Overloaded``.
+    """
+    settings = config.get_settings()
+    limits = parse_limits(settings.get('pyramid_todo.admission_limits'))
+    max_queue_age = settings.get('pyramid_todo.admission_max_queue_age')
+    config.registry['admission'] = AdmissionControl(
+        limits,
+        wait=float(settings.get('pyramid_todo.admission_wait', 0)),
+        max_queue_age=float(max_queue_age) if max_queue_age else None,
+    )
+    if limits or max_queue_age:
+        config.add_tween(
+            'pyramid_todo.admission.admission_tween_factory', under=EXCVIEW
+        )
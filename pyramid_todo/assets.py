@@ -0,0 +1,162 @@
+"""Static assets under fingerprinted, precompressed, never-changing URLs.
+
+``buildassets`` copies each file of ``static/`` into ``static/build/``,
+with a hash of its content in its name, and writes gzip (and, when the
+``brotli`` package is installed, brotli) copies of the compressible ones
+beside it, at the highest levels, since that work is done only once. A
+``manifest.json`` maps each source name to its built one.
+
+When the manifest is there, ``request.static_url`` hands out the built
+names through Pyramid's ``ManifestCacheBuster``. Those URLs are served
+by ``AssetView``. It picks the precompressed copy that the client's
+``Accept-Encoding`` allows, and marks the response cacheable for a year
+and immutable, since a changed file gets a new URL. Without a build, the
+static files are served as they are with an hour's caching.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import zlib
+
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.response import FileResponse
+from pyramid.security import NO_PERMISSION_REQUIRED
+from pyramid.static import ManifestCacheBuster
+
+from pyramid_todo.compression import (
+    COMPRESSIBLE_TYPES,
+    add_vary,
+    brotli,
+    choose_encoding,
+)
+
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
+BUILD_DIR = os.path.join(STATIC_DIR, 'build')
+MANIFEST = 'manifest.json'
+# hex digits of the content hash put into built names
+HASH_LENGTH = 12
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# cache lifetime of static files served without a build
+UNBUILT_MAX_AGE = 3600
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=11)
+
+
+# (coding, file suffix, compress) in order of preference
+PRECOMPRESSED = (('br', '.br', _brotli), ('gzip', '.gz', _gzip))
+if brotli is None:  # pragma: no cover
+    PRECOMPRESSED = PRECOMPRESSED[1:]
+
+
+def is_compressible(name):
+    content_type = mimetypes.guess_type(name)[0] or ''
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+def fingerprinted(name, data):
+    """``name`` with a hash of ``data`` before its extension."""
+    root, ext = posixpath.splitext(name)
+    return '{}.{}{}'.format(root, hashlib.sha256(data).hexdigest()[:HASH_LENGTH], ext)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as output:
+        output.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def build_assets(source=STATIC_DIR, output=BUILD_DIR):
+    """Build the assets of ``source`` into ``output``; return the manifest.
+
+    Copies are only compressed where it makes them smaller. Earlier builds
+    are left in place, so pages rendered before a deploy can still load
+    the assets they name. The manifest is written last.
+    """
+    manifest = {}
+    prefix = posixpath.relpath(output, source).replace(os.sep, '/')
+    for directory, subdirectories, filenames in os.walk(source):
+        subdirectories[:] = sorted(
+            name for name in subdirectories
+            if os.path.abspath(os.path.join(directory, name)) != os.path.abspath(output)
+        )
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, source).replace(os.sep, '/')
+            with open(path, 'rb') as asset:
+                data = asset.read()
+            built = fingerprinted(name, data)
+            _write(os.path.join(output, built), data)
+            if is_compressible(name):
+                for _, suffix, compress in PRECOMPRESSED:
+                    packed = compress(data)
+                    if len(packed) < len(data):
+                        _write(os.path.join(output, built + suffix), packed)
+            manifest[name] = posixpath.join(prefix, built)
+    _write(os.path.join(output, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+class AssetView(object):
+    """Serve the built assets of ``directory``, precompressed where possible.
+
+    The files are listed once, at startup, so a request is answered from
+    a dict lookup without searching the disk, and names that were not
+    built, including any containing "..", are simply not found.
+    """
+
+    def __init__(self, directory):
+        self.assets = {}
+        suffixes = tuple(suffix for _, suffix, _ in PRECOMPRESSED)
+        for parent, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(parent, filename)
+                name = os.path.relpath(path, directory).replace(os.sep, '/')
+                if name == MANIFEST or filename.endswith(suffixes + ('.tmp',)):
+                    continue
+                variants = {
+                    coding: path + suffix for coding, suffix, _ in PRECOMPRESSED
+                    if os.path.exists(path + suffix)
+                }
+                self.assets[name] = (path, mimetypes.guess_type(name)[0], variants)
+
+    def __call__(self, request):
+        asset = self.assets.get('/'.join(request.matchdict['subpath']))
+        if asset is None:
+            raise HTTPNotFound()
+        path, content_type, variants = asset
+        coding = choose_encoding(
+            request.headers.get('Accept-Encoding'),
+            tuple(coding for coding, _, _ in PRECOMPRESSED if coding in variants)
+        )
+        response = FileResponse(
+            variants.get(coding, path), request,
+            content_type=content_type or 'application/octet-stream', content_encoding=coding
+        )
+        if variants:
+            add_vary(response, 'Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+
+def includeme(config):
+    """Serve ``static/``, and its build if there is one, at ``/static``."""
+    config.add_route('built_asset', '/static/build/*subpath')
+    config.add_view(
+        AssetView(BUILD_DIR), route_name='built_asset', permission=NO_PERMISSION_REQUIRED
+    )
+    config.add_static_view('static', 'static', cache_max_age=UNBUILT_MAX_AGE)
+    if os.path.exists(os.path.join(BUILD_DIR, MANIFEST)):
+        config.add_cache_buster(
+            'static/', ManifestCacheBuster(os.path.join(BUILD_DIR, MANIFEST))
+        )
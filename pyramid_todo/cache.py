@@ -0,0 +1,67 @@
+"""Small in-process caches."""
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    """A thread-safe mapping holding at most ``maxsize`` entries.
+
+    The least recently used entry is dropped to make room for a new one,
+    and entries older than ``ttl`` seconds (or their own ``ttl``, if given
+    to ``set``) are treated as missing. A ``maxsize`` of 0 turns the cache
+    off. ``hits`` and ``misses`` count lookups.
+    """
+
+    def __init__(self, maxsize, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        if not self.maxsize:
+            return
+        ttl = ttl if ttl is not None else self.ttl
+        expires = self.clock() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
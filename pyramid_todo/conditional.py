@@ -0,0 +1,58 @@
+"""Conditional GET support keyed on each profile's change version."""
+from datetime import datetime, timedelta, timezone
+import hashlib
+
+
+def etag_for(request, profile):
+    """A strong ETag for this URL's representation of the profile's data.
+
+    Every write bumps ``profile.version``, and the same URL at the same
+    version always renders the same bytes, so the pair identifies the body.
+    """
+    digest = hashlib.sha1(request.path_qs.encode('utf-8')).hexdigest()[:12]
+    return '{}-{}-{}'.format(profile.id, profile.version, digest)
+
+
+def last_modified(profile, now=None):
+    """The profile's ``modified`` stamp as a ``Last-Modified`` date.
+
+    HTTP dates are in whole seconds, so the stamp is rounded up, never
+    down. It is ``None`` until that second has passed, as a write still
+    to come within it would get the same date and look unchanged to
+    ``If-Modified-Since``.
+    """
+    if profile.modified is None:
+        return None
+    modified = profile.modified.replace(microsecond=0)
+    if profile.modified.microsecond:
+        modified += timedelta(seconds=1)
+    if modified >= (now or datetime.utcnow()):
+        return None
+    return modified.replace(tzinfo=timezone.utc)
+
+
+def not_modified(request, profile):
+    """Set the validators on the response and check the client's copy.
+
+    Adds ``ETag`` and, see ``last_modified``, ``Last-Modified`` headers
+    derived from the profile's version. Returns ``True`` when ``If-None-Match`` or, failing that,
+    ``If-Modified-Since`` shows the client already has the current data;
+    the response is then an empty 304 that the view can return as it is,
+    without loading anything else.
+    """
+    response = request.response
+    response.etag = etag_for(request, profile)
+    modified = last_modified(profile)
+    if modified is not None:
+        response.last_modified = modified
+
+    if request.if_none_match:
+        fresh = response.etag in request.if_none_match
+    elif request.if_modified_since and modified is not None:
+        fresh = modified <= request.if_modified_since
+    else:
+        fresh = False
+
+    if fresh:
+        response.status_code = 304
+    return fresh
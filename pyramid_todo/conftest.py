@@ -1,14 +1,16 @@
 """Test Configuration of the Pyramid To Do List."""
+from contextlib import contextmanager
 from datetime import datetime
 from faker import Faker
 import os
 from pyramid import testing
 import pytest
 import random
+from sqlalchemy import event
 import transaction
 
 from pyramid_todo.models import (
-    Task, Profile, get_tm_session
+    Task, Profile, adjust_task_counts, get_tm_session, task_state
 )
 from pyramid_todo.models.meta import Base
 from pyramid_todo.security import hasher
@@ -80,7 +82,7 @@ def several_profiles():
     profiles = []
     for i in range(20):
         profiles.append(Profile(
-            username=FAKE.first_name(),
+            username='{}{}'.format(FAKE.first_name(), i),
             email=FAKE.email(),
             password=hasher.hash('potato'),
             date_joined=datetime.strptime('01/01/2010', '%m/%d/%Y')
@@ -98,12 +100,18 @@ def main(global_config, **settings):
     """Set up configuration for the test application."""
     from pyramid.config import Configurator
     settings['sqlalchemy.url'] = os.environ.get('TEST_DB', '')
+    settings.setdefault('pyramid_todo.status_from', '127.0.0.1')
     config = Configurator(settings=settings)
     config.include('pyramid_jinja2')
+    config.include('pyramid_todo.admission')
     config.include('pyramid_todo.routes')
     config.include('pyramid_todo.models')
+    config.include('pyramid_todo.metrics')
+    config.include('pyramid_todo.compression')
+    config.include('pyramid_todo.renderers')
+    config.include('pyramid_todo.reminders')
     config.include('pyramid_todo.security')
-    config.include('pyramid_todo.utils')
+    config.include('pyramid_todo.cors')
     config.scan()
     return config.make_wsgi_app()
 
@@ -168,3 +176,71 @@ def empty_db(testapp):
     engine = SessionFactory().bind
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def task_owner(testapp):
+    """Register a fresh profile through the API and give it 25 tasks.
+
+    Every other task has no due date and every third one is completed. The
+    test app is left logged in as the new profile, whose username is
+    returned.
+    """
+    username = 'owner_{}'.format(FAKE.uuid4()[:8])
+    testapp.post('/api/v1/accounts', {
+        'username': username,
+        'email': FAKE.email(),
+        'password': 'potato',
+        'password2': 'potato',
+    })
+    SessionFactory = testapp.app.registry["dbsession_factory"]
+    with transaction.manager:
+        dbsession = get_tm_session(SessionFactory, transaction.manager)
+        profile = dbsession.query(Profile).filter(
+            Profile.username == username
+        ).one()
+        tasks = [Task(
+            name='task {}'.format(i),
+            note=FAKE.sentence(),
+            creation_date=datetime(2017, 1, 1, i % 5),
+            due_date=datetime(2018, 1, 1 + i % 4) if i % 2 else None,
+            completed=i % 3 == 0,
+            profile_id=profile.id,
+        ) for i in range(25)]
+        dbsession.add_all(tasks)
+        adjust_task_counts(dbsession, profile.id, added=[task_state(task) for task in tasks])
+    return username
+
+
+@pytest.fixture
+def statements(testapp):
+    """Collect every SQL statement the test app runs during a test.
+
+    Clear the list just before the request under test to get its count.
+    """
+    engine = testapp.app.registry["dbsession_factory"].kw['bind']
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+@pytest.fixture
+def query_budget(statements):
+    """Assert that the requests made in a block stay within a statement budget.
+
+        with query_budget(2):
+            testapp.get(url)
+    """
+    @contextmanager
+    def budget(limit):
+        del statements[:]
+        yield statements
+        assert len(statements) <= limit, '{} statements over a budget of {}:\n{}'.format(
+            len(statements), limit, '\n'.join(statements)
+        )
+    return budget
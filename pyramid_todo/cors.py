@@ -0,0 +1,119 @@
+"""Cross-origin resource sharing for browser clients on other origins.
+
+A tween answers CORS preflight requests itself, before routing, security
+or the database see them, and tells the browser through
+``Access-Control-Max-Age`` to reuse the answer for
+``pyramid_todo.cors_max_age`` seconds, so later cross-origin calls cost
+one request instead of two. Other responses to an allowed origin get the
+``Access-Control-Allow-*`` headers added on the way out.
+
+``pyramid_todo.cors_origins`` lists the origins allowed, or ``*`` for
+any. Cookies, and with them logins, are only sent cross-origin with
+``pyramid_todo.cors_credentials`` on, which needs the origins listed.
+Every header set is built once, at startup, as a tuple.
+"""
+from pyramid.exceptions import ConfigurationError
+from pyramid.response import Response
+from pyramid.settings import asbool, aslist
+from pyramid.tweens import INGRESS, MAIN
+
+from pyramid_todo.compression import add_vary
+
+
+ALLOWED_METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+ALLOWED_HEADERS = (
+    'Content-Type', 'X-Requested-With', 'If-None-Match', 'If-Modified-Since',
+)
+EXPOSED_HEADERS = ('ETag', 'Last-Modified', 'Retry-After', 'Server-Timing')
+
+
+class Cors(object):
+    """The origins allowed and the headers each of them is sent."""
+
+    def __init__(self, origins=('*',), max_age=7200, credentials=False):
+        self.any_origin = '*' in origins
+        if self.any_origin and credentials:
+            raise ConfigurationError(
+                'pyramid_todo.cors_credentials needs the allowed origins listed, not "*"'
+            )
+        shared = (('Access-Control-Expose-Headers', ', '.join(EXPOSED_HEADERS)),)
+        if credentials:
+            shared += (('Access-Control-Allow-Credentials', 'true'),)
+        self.preflight_headers = (
+            ('Access-Control-Allow-Methods', ', '.join(ALLOWED_METHODS)),
+            ('Access-Control-Allow-Headers', ', '.join(ALLOWED_HEADERS)),
+            ('Access-Control-Max-Age', str(int(max_age))),
+        )
+        if self.any_origin:
+            self.any_headers = (('Access-Control-Allow-Origin', '*'),) + shared
+            self.origin_headers = {}
+        else:
+            self.any_headers = None
+            self.origin_headers = {
+                origin.rstrip('/'): (('Access-Control-Allow-Origin', origin.rstrip('/')),) + shared
+                for origin in origins
+            }
+
+    def headers_for(self, origin):
+        """The headers to send a request from ``origin``; ``None`` if it isn't allowed."""
+        if self.any_origin:
+            return self.any_headers
+        return self.origin_headers.get(origin)
+
+    def preflight(self, origin):
+        """The answer to a preflight request from ``origin``."""
+        headers = self.headers_for(origin)
+        if headers is None:
+            response = Response(status=403, headerlist=[('Content-Length', '0')])
+        else:
+            response = Response(
+                status=204, headerlist=list(headers + self.preflight_headers)
+            )
+        if not self.any_origin:
+            add_vary(response, 'Origin')
+        return response
+
+    def add_headers(self, origin, response):
+        headers = self.headers_for(origin) if origin else None
+        if headers is not None:
+            response.headerlist.extend(headers)
+        if not self.any_origin:
+            add_vary(response, 'Origin')
+        return response
+
+
+def cors_tween_factory(handler, registry):
+    cors = registry['cors']
+
+    def cors_tween(request):
+        origin = request.headers.get('Origin')
+        if (origin and request.method == 'OPTIONS' and
+                'Access-Control-Request-Method' in request.headers):
+            return cors.preflight(origin)
+        return cors.add_headers(origin, handler(request))
+
+    return cors_tween
+
+
+def includeme(config):
+    """Handle CORS from just under the metrics tween, over compression.
+
+    Preflights are counted by the metrics, but never reach the transaction
+    manager, and error pages get the CORS headers too, so browsers can read
+    them. An empty ``pyramid_todo.cors_origins`` turns CORS off.
+    """
+    settings = config.get_settings()
+    origins = aslist(settings.get('pyramid_todo.cors_origins', '*'))
+    if not origins:
+        config.registry['cors'] = None
+        return
+    config.registry['cors'] = Cors(
+        origins,
+        max_age=int(settings.get('pyramid_todo.cors_max_age', 7200)),
+        credentials=asbool(settings.get('pyramid_todo.cors_credentials', False)),
+    )
+    config.add_tween(
+        'pyramid_todo.cors.cors_tween_factory',
+        under=('pyramid_todo.metrics.metrics_tween_factory', INGRESS),
+        over=('pyramid_todo.compression.compression_tween_factory', MAIN),
+    )
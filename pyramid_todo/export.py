@@ -0,0 +1,75 @@
+"""Streaming exports of a profile's tasks as NDJSON or CSV.
+
+Tasks are read in keyset pages over the ``(profile_id, id)`` index, each
+page in a session of its own that is closed straight away. Memory use
+stays at one page however many tasks there are, and no transaction (or,
+on SQLite, read lock) outlives the page it reads. Each page is encoded
+and handed on as one chunk.
+"""
+import csv
+import io
+
+from pyramid_todo.models import Task
+from pyramid_todo.serializers import TASK_COLUMNS, serialize_task
+
+
+EXPORT_BATCH_SIZE = 1000
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def task_pages(session_factory, profile_id, batch_size=EXPORT_BATCH_SIZE):
+    """Yield lists of up to ``batch_size`` task rows, in id order."""
+    last_id = 0
+    while True:
+        session = session_factory()
+        try:
+            rows = session.query(*TASK_COLUMNS).filter(
+                Task.profile_id == profile_id,
+                Task.id > last_id
+            ).order_by(Task.id).limit(batch_size).all()
+        finally:
+            session.close()
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
+
+
+def ndjson_chunks(pages, dumps):
+    for rows in pages:
+        yield ''.join(dumps(serialize_task(row)) + '\n' for row in rows).encode('utf-8')
+
+
+def _csv_value(key, value):
+    if value is None:
+        return ''
+    if key == 'completed':
+        return 'true' if value else 'false'
+    return value
+
+
+def csv_chunks(pages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(serialize_task.keys)
+    for rows in pages:
+        for row in rows:
+            task = serialize_task(row)
+            writer.writerow([_csv_value(key, task[key]) for key in serialize_task.keys])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def export_chunks(fmt, session_factory, profile_id, dumps, batch_size=EXPORT_BATCH_SIZE):
+    """The encoded export, as an iterable of byte strings."""
+    pages = task_pages(session_factory, profile_id, batch_size)
+    if fmt == 'csv':
+        return csv_chunks(pages)
+    return ndjson_chunks(pages, dumps)
@@ -0,0 +1,231 @@
+"""Request latency and SQL statistics per route, in Prometheus text format.
+
+A tween times every request and engine event hooks count the statements
+it runs and the time they take. The totals are kept in process, in
+``registry['metrics']``, and served by the ``metrics`` route. With
+``pyramid_todo.server_timing`` on, each response also carries a
+``Server-Timing`` header with its own numbers.
+"""
+from collections import defaultdict
+import threading
+import time
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.settings import asbool
+from pyramid.tweens import INGRESS
+from sqlalchemy import event
+
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = threading.local()
+
+
+class RequestTimer(object):
+    """The statement count and database time of the request in progress."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+
+
+class Metrics(object):
+    """The totals for every route and method seen so far."""
+
+    def __init__(self):
+        self.latency = defaultdict(Histogram)
+        self.responses = defaultdict(int)
+        self.statements = defaultdict(int)
+        self.db_time = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record(self, route, method, status, timer):
+        key = (route, method)
+        with self._lock:
+            self.latency[key].observe(timer.elapsed())
+            self.responses[key + (status,)] += 1
+            self.statements[key] += timer.statements
+            self.db_time[key] += timer.db_time
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'latency': {
+                    key: (list(histogram.counts), histogram.sum)
+                    for key, histogram in self.latency.items()
+                },
+                'responses': dict(self.responses),
+                'statements': dict(self.statements),
+                'db_time': dict(self.db_time),
+            }
+
+
+def _labels(**labels):
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in sorted(labels.items())
+    ))
+
+
+def render_prometheus(metrics, extra=()):
+    """The metrics as Prometheus text exposition format.
+
+    ``extra`` is a sequence of ``(name, type, help, samples)`` for other
+    values to include, where ``samples`` is a list of ``(labels, value)``.
+    """
+    snapshot = metrics.snapshot()
+    lines = [
+        '# HELP pyramid_todo_request_duration_seconds Time taken to answer requests.',
+        '# TYPE pyramid_todo_request_duration_seconds histogram',
+    ]
+    for (route, method), (counts, total) in sorted(snapshot['latency'].items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append('pyramid_todo_request_duration_seconds_bucket{} {}'.format(
+                _labels(route=route, method=method, le=bound), cumulative
+            ))
+        labels = _labels(route=route, method=method)
+        lines.append('pyramid_todo_request_duration_seconds_sum{} {!r}'.format(labels, total))
+        lines.append('pyramid_todo_request_duration_seconds_count{} {}'.format(labels, cumulative))
+
+    extra = [
+        ('pyramid_todo_responses_total', 'counter', 'Responses sent, by status code.', [
+            ({'route': route, 'method': method, 'status': status}, count)
+            for (route, method, status), count in snapshot['responses'].items()
+        ]),
+        ('pyramid_todo_db_statements_total', 'counter', 'SQL statements executed.', [
+            ({'route': route, 'method': method}, count)
+            for (route, method), count in snapshot['statements'].items()
+        ]),
+        ('pyramid_todo_db_duration_seconds_total', 'counter', 'Time spent executing SQL.', [
+            ({'route': route, 'method': method}, seconds)
+            for (route, method), seconds in snapshot['db_time'].items()
+        ]),
+    ] + list(extra)
+    for name, kind, help_text, samples in extra:
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in sorted(samples, key=lambda sample: sorted(sample[0].items())):
+            lines.append('{}{} {!r}'.format(name, _labels(**labels) if labels else '', value))
+    return '\n'.join(lines) + '\n'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('pyramid_todo.query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['pyramid_todo.query_start'].pop()
+    timer = getattr(_current, 'timer', None)
+    if timer is not None:
+        timer.statements += 1
+        timer.db_time += time.perf_counter() - started
+
+
+def _handle_error(context):
+    starts = context.connection.info.get('pyramid_todo.query_start') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    """Count the statements run on the engine against the current request."""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+class _RecordingIterable(object):
+    """Keep counting statements while a streamed body is sent, then record."""
+
+    def __init__(self, app_iter, timer, finish):
+        self.app_iter = app_iter
+        self.timer = timer
+        self.finish = finish
+
+    def __iter__(self):
+        _current.timer = self.timer
+        try:
+            for chunk in self.app_iter:
+                yield chunk
+        finally:
+            _current.timer = None
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.finish()
+
+
+def server_timing(timer):
+    return 'app;dur={:.1f}, db;dur={:.1f};desc="{} statements"'.format(
+        timer.elapsed() * 1000, timer.db_time * 1000, timer.statements
+    )
+
+
+def metrics_tween_factory(handler, registry):
+    metrics = registry['metrics']
+    mapper = registry.queryUtility(IRoutesMapper)
+    add_server_timing = asbool(registry.settings.get('pyramid_todo.server_timing', False))
+
+    def route_name(request):
+        route = getattr(request, 'matched_route', None)
+        if route is None and mapper is not None:
+            route = mapper(request)['route']
+        return route.name if route is not None else 'unmatched'
+
+    def metrics_tween(request):
+        timer = _current.timer = RequestTimer()
+        try:
+            response = handler(request)
+        except BaseException:
+            metrics.record(route_name(request), request.method, 500, timer)
+            raise
+        finally:
+            _current.timer = None
+        status = response.status_int
+        if add_server_timing:
+            response.headers['Server-Timing'] = server_timing(timer)
+        content_length = response.content_length
+        response.app_iter = _RecordingIterable(
+            response.app_iter, timer,
+            lambda: metrics.record(route_name(request), request.method, status, timer)
+        )
+        response.content_length = content_length
+        return response
+
+    return metrics_tween
+
+
+def includeme(config):
+    """Collect metrics for every request, timing from the top of the chain.
+
+    Include this after ``pyramid_todo.models``, whose engine it hooks.
+    """
+    config.registry['metrics'] = Metrics()
+    instrument_engine(config.registry['dbsession_factory'].kw['bind'])
+    for session_factory in config.registry['replica_session_factories']:
+        instrument_engine(session_factory.kw['bind'])
+    config.add_tween('pyramid_todo.metrics.metrics_tween_factory', under=INGRESS)
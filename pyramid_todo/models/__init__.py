@@ -1,11 +1,50 @@
+from pyramid.settings import aslist
 from sqlalchemy import engine_from_config
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import QueuePool
 import zope.sqlalchemy
 
 # import or define all models here to ensure they are attached to the
 # Base.metadata prior to any initialization routines
-from pyramid_todo.models.model_defs import Task, Profile  # flake8: noqa
+from pyramid_todo.models.model_defs import (  # flake8: noqa
+    Task,
+    TaskCounter,
+    TaskDueCounter,
+    Profile,
+)
+from pyramid_todo.models.pool import (  # flake8: noqa
+    QUEUE_POOL_OPTIONS,
+    TimedQueuePool,
+    pool_stats,
+    warm_pool,
+)
+from pyramid_todo.models.replicas import (  # flake8: noqa
+    STICKY_COOKIE,
+    get_request_session_factory,
+    reads_from_replica,
+)
+from pyramid_todo.models.search import (  # flake8: noqa
+    install_search,
+    search_query,
+)
+from pyramid_todo.models.queries import (  # flake8: noqa
+    adjust_task_counts,
+    bump_version,
+    delete_task_counts,
+    delete_tasks,
+    get_owned_task,
+    insert_tasks,
+    next_page_cursor,
+    owned_task_states,
+    task_counts,
+    task_page,
+    task_page_query,
+    task_state,
+    task_total,
+    update_tasks,
+)
 
 # run configure_mappers after defining all of the models to ensure
 # all relationships can be setup
@@ -13,6 +52,20 @@ configure_mappers()
 
 
 def get_engine(settings, prefix='sqlalchemy.'):
+    """Create the engine, along with its pool, from the settings.
+
+    Pool options such as ``sqlalchemy.pool_size``, ``max_overflow``,
+    ``pool_timeout``, ``pool_recycle`` and ``pool_pre_ping`` are passed on
+    to SQLAlchemy. Databases that are pooled in a queue get a
+    ``TimedQueuePool``. For the others, such as SQLite files, the options
+    that only a queue pool accepts are dropped.
+    """
+    settings = dict(settings)
+    url = make_url(settings[prefix + 'url'])
+    if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        return engine_from_config(settings, prefix, poolclass=TimedQueuePool)
+    for option in QUEUE_POOL_OPTIONS:
+        settings.pop(prefix + option, None)
     return engine_from_config(settings, prefix)
 
 
@@ -65,13 +118,27 @@ def includeme(config):
     # use pyramid_retry to retry a request when transient exceptions occur
     config.include('pyramid_retry')
 
-    session_factory = get_session_factory(get_engine(settings))
-    config.registry['dbsession_factory'] = session_factory
+    warm = int(settings.get('pyramid_todo.pool_warm', 0))
+    engine = get_engine(settings)
+    warm_pool(engine, warm)
+    config.registry['dbsession_factory'] = get_session_factory(engine)
+
+    # read-only requests go to these, when there are any
+    replicas = []
+    for url in aslist(settings.get('pyramid_todo.replica_urls', '')):
+        replica = get_engine(dict(settings, **{'sqlalchemy.url': url}))
+        warm_pool(replica, warm)
+        replicas.append(get_session_factory(replica))
+    config.registry['replica_session_factories'] = replicas
+
+    config.add_request_method(
+        get_request_session_factory, 'dbsession_factory', reify=True
+    )
 
     # make request.dbsession available for use in Pyramid
     config.add_request_method(
         # r.tm is the transaction manager used by pyramid_tm
-        lambda r: get_tm_session(session_factory, r.tm),
+        lambda r: get_tm_session(r.dbsession_factory, r.tm),
         'dbsession',
         reify=True
     )
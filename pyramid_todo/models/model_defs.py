@@ -2,8 +2,10 @@ from pyramid_todo.models.meta import Base
 from sqlalchemy import (
     Boolean,
     Column,
+    Date,
     DateTime,
     Integer,
+    Index,
     Unicode,
     ForeignKey
 )
@@ -16,22 +18,29 @@ DATE_FMT = '%d/%m/%Y %H:%M:%S'
 class Profile(Base):
     __tablename__ = 'profiles'
     id = Column(Integer, primary_key=True)
-    username = Column(Unicode, nullable=False)
+    username = Column(Unicode, nullable=False, unique=True, index=True)
     email = Column(Unicode, nullable=False)
     password = Column(Unicode, nullable=False)
     date_joined = Column(DateTime, nullable=False)
+    # bumped on every write to the profile or its tasks; see
+    # queries.bump_version
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    # indexed for remindtasks, which looks for recently written profiles
+    modified = Column(DateTime, index=True)
     tasks = relationship("Task", back_populates='profile')
 
-    def to_dict(self):
+    def to_dict(self, include_tasks=True):
         """Get the object's properties as a dictionary."""
 
-        return {
+        as_dict = {
             "id": self.id,
             "username": self.username,
             "email": self.email,
             "date_joined": self.date_joined.strftime(DATE_FMT),
-            "tasks": [task.to_dict() for task in self.tasks]
         }
+        if include_tasks:
+            as_dict["tasks"] = [task.to_dict() for task in self.tasks]
+        return as_dict
 
     def __repr__(self):
         return "<Profile: {} | tasks: {}>".format(self.username, len(self.tasks))
@@ -39,6 +48,17 @@ class Profile(Base):
 
 class Task(Base):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # owner-scoped lookups and the default listing order
+        Index(None, 'profile_id', 'id'),
+        # listings filtered by completion and due window
+        Index(None, 'profile_id', 'completed', 'due_date'),
+        # listings sorted by due or creation date
+        Index(None, 'profile_id', 'due_date', 'id'),
+        Index(None, 'profile_id', 'creation_date', 'id'),
+        # every profile's open tasks due within a window, for reminders
+        Index(None, 'due_date', 'completed'),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(Unicode, nullable=False)
     note = Column(Unicode)
@@ -61,3 +81,24 @@ class Task(Base):
 
     def __repr__(self):
         return "<Task: {} | owner: {}>".format(self.name, self.profile.username)
+
+
+class TaskCounter(Base):
+    """Running totals of a profile's open and completed tasks.
+
+    Kept up to date by every write to the profile's tasks, in the same
+    transaction; see ``queries.adjust_task_counts``. Tasks whose
+    ``completed`` is NULL count as open.
+    """
+    __tablename__ = 'task_counters'
+    profile_id = Column(Integer, ForeignKey('profiles.id'), primary_key=True)
+    open = Column(Integer, nullable=False, default=0, server_default='0')
+    completed = Column(Integer, nullable=False, default=0, server_default='0')
+
+
+class TaskDueCounter(Base):
+    """How many of a profile's open tasks fall due on each day."""
+    __tablename__ = 'task_due_counters'
+    profile_id = Column(Integer, ForeignKey('profiles.id'), primary_key=True)
+    due_day = Column(Date, primary_key=True)
+    open = Column(Integer, nullable=False, default=0, server_default='0')
@@ -0,0 +1,86 @@
+"""Connection pool timing, warming and statistics."""
+import logging
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+log = logging.getLogger(__name__)
+
+# create_engine options that only make sense for a QueuePool
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+class TimedQueuePool(QueuePool):
+    """A ``QueuePool`` that keeps track of how long checkouts take.
+
+    ``wait_time`` is the total time spent getting connections out of the
+    pool, including opening new ones, and ``max_wait`` the longest single
+    checkout. ``timeouts`` counts checkouts that gave up because the pool
+    was exhausted, which are logged as warnings too.
+    """
+
+    def __init__(self, *args, **kw):
+        super(TimedQueuePool, self).__init__(*args, **kw)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            log.warning('Connection pool exhausted: %s', self.status())
+            raise
+        finally:
+            waited = time.monotonic() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+
+
+def warm_pool(engine, count):
+    """Open up to ``count`` pooled connections now, ahead of the first requests.
+
+    Does nothing for pools that do not keep connections around. Returns
+    the number of connections opened.
+    """
+    if not isinstance(engine.pool, QueuePool) or count <= 0:
+        return 0
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+def pool_stats(engine):
+    """A dict describing the engine's connection pool at this moment."""
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(
+            checkouts=pool.checkouts,
+            timeouts=pool.timeouts,
+            wait_seconds=round(pool.wait_time, 6),
+            max_wait_seconds=round(pool.max_wait, 6),
+        )
+    return stats
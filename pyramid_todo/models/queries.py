@@ -0,0 +1,383 @@
+"""Reusable queries against the task and profile tables."""
+import base64
+from collections import Counter
+from datetime import datetime
+import json
+
+from sqlalchemy import and_, bindparam, case, func, or_, select
+from sqlalchemy.dialects import postgresql
+
+from pyramid_todo.models.model_defs import Profile, Task, TaskCounter, TaskDueCounter
+
+
+CURSOR_DATE_FMT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# sort key -> (column, nullable)
+SORT_COLUMNS = {
+    'id': (Task.id, False),
+    'creation_date': (Task.creation_date, False),
+    'due_date': (Task.due_date, True),
+}
+
+
+def get_owned_task(dbsession, task_id, profile_id):
+    """Fetch a task by id, but only if it belongs to the given profile.
+
+    Ownership is checked in the same indexed query, so the owner's task
+    collection is never loaded. Returns ``None`` for missing tasks and for
+    tasks owned by someone else alike.
+    """
+    return dbsession.query(Task).filter(
+        Task.id == task_id,
+        Task.profile_id == profile_id
+    ).first()
+
+
+def bump_version(dbsession, profile_id):
+    """Record that the profile or one of its tasks has changed.
+
+    Moves the profile's ``version`` on and stamps ``modified`` with the
+    current UTC time, which invalidates ETags handed out for its data.
+    """
+    dbsession.query(Profile).filter(Profile.id == profile_id).update({
+        Profile.version: Profile.version + 1,
+        Profile.modified: datetime.utcnow(),
+    }, synchronize_session=False)
+
+
+def owned_task_states(dbsession, profile_id, task_ids):
+    """Map those of ``task_ids`` that belong to the profile to their ``task_state``."""
+    if not task_ids:
+        return {}
+    return {row.id: task_state(row) for row in dbsession.query(
+        Task.id, Task.completed, Task.due_date
+    ).filter(
+        Task.profile_id == profile_id,
+        Task.id.in_(task_ids)
+    )}
+
+
+# values of the optional task columns, for rows that leave them out
+TASK_DEFAULTS = {'note': None, 'due_date': None, 'completed': False}
+
+
+def task_insert_statement(rows):
+    """A multi-row ``INSERT .. RETURNING`` of ``rows``, for PostgreSQL.
+
+    A multi-row ``VALUES`` needs every row to name the same columns, so
+    each is filled out with ``TASK_DEFAULTS`` first.
+    """
+    return Task.__table__.insert().values(
+        [dict(TASK_DEFAULTS, **row) for row in rows]
+    ).returning(Task.id)
+
+
+def insert_tasks(dbsession, rows):
+    """Insert many task rows at once and return their new ids, in order.
+
+    PostgreSQL gets a single multi-row ``INSERT .. RETURNING``. Other
+    backends fall back to ``bulk_insert_mappings``, which still skips the
+    unit of work but needs one statement per row to learn each new id.
+    """
+    if not rows:
+        return []
+    if dbsession.bind.dialect.name == 'postgresql':
+        result = dbsession.execute(task_insert_statement(rows))
+        return [row[0] for row in result]
+    dbsession.bulk_insert_mappings(Task, rows, return_defaults=True)
+    return [row['id'] for row in rows]
+
+
+def update_tasks(dbsession, rows):
+    """Apply many partial task updates, each a dict holding the task's ``id``.
+
+    Rows changing the same set of columns share one executemany statement.
+    """
+    if rows:
+        dbsession.bulk_update_mappings(Task, rows)
+
+
+def delete_tasks(dbsession, task_ids):
+    """Delete every task in ``task_ids`` with a single statement."""
+    if task_ids:
+        dbsession.query(Task).filter(
+            Task.id.in_(task_ids)
+        ).delete(synchronize_session=False)
+
+
+def task_state(task):
+    """The parts of a task that its profile's counts depend on."""
+    return bool(task.completed), task.due_date
+
+
+def _insert_counts(executor, dialect, table, keys, amounts, rows, update, params):
+    """Insert the counter ``rows`` found missing, which another transaction may
+    have inserted meanwhile.
+
+    PostgreSQL adds to a conflicting row in the INSERT itself. SQLite
+    inserts zeroed rows, skipping the ones that exist by then, and adds
+    the amounts with ``update``, run again over ``params``. Other backends
+    insert the rows as they are.
+    """
+    if dialect.name == 'postgresql':
+        insert = postgresql.insert(table)
+        executor.execute(insert.on_conflict_do_update(
+            index_elements=[table.c[key] for key in keys],
+            set_={name: table.c[name] + insert.excluded[name] for name in amounts},
+        ), rows)
+    elif dialect.name == 'sqlite':
+        executor.execute(table.insert().prefix_with('OR IGNORE'), [
+            dict(row, **{name: 0 for name in amounts}) for row in rows
+        ])
+        executor.execute(update, params if len(params) > 1 else params[0])
+    else:
+        executor.execute(table.insert(), rows)
+
+
+def _add_counts(executor, table, keys, rows):
+    """Add amounts to counter rows, creating the rows that are missing.
+
+    Each of ``rows`` is a dict of the ``keys`` columns' values and of the
+    amounts to add to the other columns. One UPDATE covers every row. If
+    it matched fewer rows than it was given, or the driver cannot say, the
+    rows that exist are looked up and the rest inserted; see
+    ``_insert_counts`` for two first writes to the same row at once.
+    """
+    amounts = [name for name in rows[0] if name not in keys]
+    update = table.update().where(and_(*[
+        table.c[key] == bindparam('key_' + key) for key in keys
+    ])).values({
+        table.c[name]: table.c[name] + bindparam('add_' + name) for name in amounts
+    })
+
+    def update_params(rows):
+        return [dict(
+            {'key_' + key: row[key] for key in keys},
+            **{'add_' + name: row[name] for name in amounts}
+        ) for row in rows]
+
+    params = update_params(rows)
+    updated = executor.execute(update, params if len(params) > 1 else params[0]).rowcount
+    dialect = executor.bind.dialect if hasattr(executor, 'bind') else executor.dialect
+    if updated == len(rows) and (len(rows) == 1 or dialect.supports_sane_multi_rowcount):
+        return
+    if len(rows) == 1 and updated == 0:
+        missing = rows
+    else:
+        existing = {tuple(row) for row in executor.execute(
+            select([table.c[key] for key in keys]).where(or_(*[
+                and_(*[table.c[key] == row[key] for key in keys]) for row in rows
+            ]))
+        )}
+        missing = [row for row in rows if tuple(row[key] for key in keys) not in existing]
+    if missing:
+        _insert_counts(
+            executor, dialect, table, keys, amounts, missing, update, update_params(missing)
+        )
+
+
+def adjust_task_counts(executor, profile_id, removed=(), added=()):
+    """Move a profile's task counts on by a change to its tasks.
+
+    ``removed`` and ``added`` hold the ``task_state`` of the changed tasks
+    before and after the change: a new task is only added, a deleted one
+    only removed and an updated one both. ``executor`` is the session or
+    connection whose transaction makes the change, so the counts commit
+    or roll back with it.
+    """
+    totals, days = Counter(), Counter()
+    for sign, states in ((-1, removed), (1, added)):
+        for completed, due_date in states:
+            if completed:
+                totals['completed'] += sign
+            else:
+                totals['open'] += sign
+                if due_date is not None:
+                    days[due_date.date()] += sign
+    totals = {name: delta for name, delta in totals.items() if delta}
+    if totals:
+        _add_counts(executor, TaskCounter.__table__, ['profile_id'],
+                    [dict({'open': 0, 'completed': 0, 'profile_id': profile_id}, **totals)])
+    days = [
+        {'profile_id': profile_id, 'due_day': day, 'open': delta}
+        for day, delta in sorted(days.items()) if delta
+    ]
+    if days:
+        _add_counts(executor, TaskDueCounter.__table__, ['profile_id', 'due_day'], days)
+
+
+def delete_task_counts(dbsession, profile_id):
+    """Drop a profile's task counts, as when the profile is deleted."""
+    for model in (TaskCounter, TaskDueCounter):
+        dbsession.query(model).filter(
+            model.profile_id == profile_id
+        ).delete(synchronize_session=False)
+
+
+def task_counts(dbsession, profile_id, now):
+    """A profile's open, completed and overdue task counts, as a dict.
+
+    Open and completed are read from its ``TaskCounter`` row. Overdue
+    adds up the ``TaskDueCounter`` rows for the days before today, plus
+    the open tasks due earlier today, which are counted through the
+    ``(profile_id, completed, due_date)`` index. All in one statement.
+    """
+    def scalar(column, *criteria):
+        return select([column]).where(and_(*criteria)).as_scalar()
+
+    midnight = datetime(now.year, now.month, now.day)
+    row = dbsession.query(
+        scalar(TaskCounter.open, TaskCounter.profile_id == profile_id),
+        scalar(TaskCounter.completed, TaskCounter.profile_id == profile_id),
+        scalar(func.sum(TaskDueCounter.open),
+               TaskDueCounter.profile_id == profile_id,
+               TaskDueCounter.due_day < now.date()),
+        scalar(func.count(Task.id),
+               Task.profile_id == profile_id,
+               or_(Task.completed == False, Task.completed.is_(None)),  # noqa: E712
+               Task.due_date >= midnight,
+               Task.due_date < now),
+    ).one()
+    open_count, completed, overdue_before, overdue_today = (value or 0 for value in row)
+    return {
+        'open': open_count,
+        'completed': completed,
+        'overdue': overdue_before + overdue_today,
+    }
+
+
+def task_total(dbsession, profile_id):
+    """How many tasks a profile has, read from its ``TaskCounter`` row."""
+    row = dbsession.query(TaskCounter.open + TaskCounter.completed).filter(
+        TaskCounter.profile_id == profile_id
+    ).first()
+    return row[0] if row else 0
+
+
+def encode_cursor(sort, value, task_id):
+    """Build an opaque cursor pointing just past the given sort position."""
+    if isinstance(value, datetime):
+        value = value.strftime(CURSOR_DATE_FMT)
+    payload = json.dumps([sort, value, task_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(sort, cursor):
+    """Turn a cursor back into a ``(value, task_id)`` pair.
+
+    Raises ``ValueError`` if the cursor is malformed or was issued for a
+    different sort order.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        cursor_sort, value, task_id = json.loads(payload.decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort or not isinstance(task_id, int) or isinstance(task_id, bool):
+        raise ValueError('Invalid cursor')
+    if value is None:
+        return value, task_id
+    if sort.lstrip('-') == 'id':
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError('Invalid cursor')
+        return value, task_id
+    if not isinstance(value, str):
+        raise ValueError('Invalid cursor')
+    try:
+        value = datetime.strptime(value, CURSOR_DATE_FMT)
+    except ValueError:
+        raise ValueError('Invalid cursor')
+    return value, task_id
+
+
+def _ordering(column, nullable, descending):
+    """Order by the sort column then id.
+
+    NULLs sort after every value ascending and, since descending reverses
+    the whole order, before them descending; ``_after`` relies on both.
+    """
+    columns = []
+    if nullable:
+        columns.append(case([(column.is_(None), 1)], else_=0))
+    if column is not Task.id:
+        columns.append(column)
+    columns.append(Task.id)
+    if descending:
+        return [col.desc() for col in columns]
+    return columns
+
+
+def _after(column, nullable, descending, value, last_id):
+    """Filter for the rows that sort strictly after ``(value, last_id)``."""
+    if column is Task.id:
+        return Task.id < last_id if descending else Task.id > last_id
+    if value is None:
+        if descending:
+            return or_(
+                and_(column.is_(None), Task.id < last_id),
+                column.isnot(None)
+            )
+        return and_(column.is_(None), Task.id > last_id)
+    if descending:
+        return or_(column < value, and_(column == value, Task.id < last_id))
+    clauses = [column > value, and_(column == value, Task.id > last_id)]
+    if nullable:
+        clauses.append(column.is_(None))
+    return or_(*clauses)
+
+
+def task_page_query(dbsession, profile_id, limit, sort='id', cursor=None,
+                    completed=None, due_before=None, due_after=None):
+    """Build the query for one keyset-paginated page of a profile's tasks.
+
+    The query yields up to ``limit + 1`` tasks; the extra one only signals
+    that another page follows. ``sort`` is one of the keys of
+    ``SORT_COLUMNS``, optionally prefixed with ``-`` for descending order.
+    A malformed ``cursor`` raises ``ValueError`` right away.
+    """
+    descending = sort.startswith('-')
+    column, nullable = SORT_COLUMNS[sort.lstrip('-')]
+
+    query = dbsession.query(Task).filter(Task.profile_id == profile_id)
+    if completed is True:
+        query = query.filter(Task.completed == True)  # noqa: E712
+    elif completed is False:
+        query = query.filter(
+            or_(Task.completed == False, Task.completed.is_(None))  # noqa: E712
+        )
+    if due_before is not None:
+        query = query.filter(Task.due_date < due_before)
+    if due_after is not None:
+        query = query.filter(Task.due_date > due_after)
+    if cursor is not None:
+        value, last_id = decode_cursor(sort, cursor)
+        query = query.filter(
+            _after(column, nullable, descending, value, last_id)
+        )
+    return query.order_by(
+        *_ordering(column, nullable, descending)
+    ).limit(limit + 1)
+
+
+def next_page_cursor(sort, last_task):
+    """The cursor for the page that follows ``last_task``."""
+    return encode_cursor(
+        sort, getattr(last_task, sort.lstrip('-')), last_task.id
+    )
+
+
+def task_page(dbsession, profile_id, limit, sort='id', **filters):
+    """Fetch one keyset-paginated page of a profile's tasks.
+
+    Takes the same arguments as ``task_page_query`` and returns a
+    ``(tasks, next_cursor)`` tuple, where ``next_cursor`` is ``None`` once
+    the last page has been reached.
+    """
+    tasks = task_page_query(
+        dbsession, profile_id, limit, sort=sort, **filters
+    ).all()
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = next_page_cursor(sort, tasks[-1])
+    return tasks, next_cursor
@@ -0,0 +1,52 @@
+"""Sending reads to replicas of the primary database.
+
+With ``pyramid_todo.replica_urls`` set, GET and HEAD requests read from
+one of the replicas, picked at random, and every other request goes to
+the primary. Replicas lag behind, so a request that wrote something sets
+a cookie that keeps the same client on the primary for the next
+``pyramid_todo.replica_sticky_seconds``, long enough for its own writes
+to have been replicated.
+"""
+import math
+import random
+import time
+
+
+STICKY_COOKIE = 'todo_primary_until'
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def reads_from_replica(request):
+    """Whether the request can be answered from a replica."""
+    if request.method not in SAFE_METHODS or not request.registry['replica_session_factories']:
+        return False
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) < time.time()
+    except ValueError:
+        return True
+
+
+def stick_to_primary(request, response):
+    """Response callback: keep a client that has just written on the primary."""
+    if response.status_int >= 400:
+        return
+    seconds = float(request.registry.settings.get('pyramid_todo.replica_sticky_seconds', 5))
+    response.set_cookie(
+        STICKY_COOKIE, str(math.ceil(time.time() + seconds)),
+        max_age=math.ceil(seconds), httponly=True
+    )
+
+
+def get_request_session_factory(request):
+    """The session factory for the database this request uses.
+
+    Reified as ``request.dbsession_factory``. Sessions opened outside the
+    request's transaction, such as those of streamed responses, should
+    come from here too so that they read from the same database.
+    """
+    registry = request.registry
+    if reads_from_replica(request):
+        return random.choice(registry['replica_session_factories'])
+    if request.method not in SAFE_METHODS and registry['replica_session_factories']:
+        request.add_response_callback(stick_to_primary)
+    return registry['dbsession_factory']
@@ -0,0 +1,158 @@
+"""Ranked full-text search over task names and notes.
+
+Each backend indexes tasks its own way, kept in sync by the database on
+every write, behind the one ``search_query`` function:
+
+- SQLite gets an FTS5 table, ``tasks_fts``, filled by triggers on
+  ``tasks`` and ranked with bm25.
+- PostgreSQL gets a GIN index over a weighted ``tsvector`` expression,
+  ranked with ``ts_rank``.
+
+Both index the owner alongside the words, in a column (SQLite) or under
+a weight (PostgreSQL) of its own, so a search only walks the postings of
+its owner's tasks. The words searched for are held to the name and note,
+so they never match the owner. Names weigh more than notes. Other
+backends fall back to an unranked ``LIKE`` scan.
+
+The index is created along with the ``tasks`` table; ``migratedb`` adds
+it to existing databases with ``install_search``.
+"""
+from sqlalchemy import DDL, and_, column, event, or_, table, text
+
+from pyramid_todo.models.model_defs import Task
+
+
+SQLITE_CREATE = (
+    # the rows FTS5 reads back when rebuilding or for column values
+    """CREATE VIEW IF NOT EXISTS tasks_search_source AS
+    SELECT id, name, coalesce(note, '') AS note, 'p' || profile_id AS owner FROM tasks""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+        name, note, owner,
+        content='tasks_search_source', content_rowid='id',
+        tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_search_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts (rowid, name, note, owner)
+        VALUES (new.id, new.name, coalesce(new.note, ''), 'p' || new.profile_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_search_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, name, note, owner)
+        VALUES ('delete', old.id, old.name, coalesce(old.note, ''), 'p' || old.profile_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tasks_search_update
+    AFTER UPDATE OF name, note, profile_id ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, name, note, owner)
+        VALUES ('delete', old.id, old.name, coalesce(old.note, ''), 'p' || old.profile_id);
+        INSERT INTO tasks_fts (rowid, name, note, owner)
+        VALUES (new.id, new.name, coalesce(new.note, ''), 'p' || new.profile_id);
+    END""",
+)
+SQLITE_DROP = (
+    'DROP TABLE IF EXISTS tasks_fts',
+    'DROP VIEW IF EXISTS tasks_search_source',
+)
+# bm25 weights of the name, note and owner columns
+SQLITE_RANK = 'bm25(tasks_fts, 10.0, 1.0, 0.0)'
+
+# queries must spell the expression exactly like this to use the index;
+# profile_id is cast to text itself, since text || integer goes through
+# anytextcat, which isn't IMMUTABLE and so can't be indexed
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', name), 'A') || "
+    "setweight(to_tsvector('english', coalesce(note, '')), 'B') || "
+    "setweight(to_tsvector('simple', 'owner' || profile_id::text), 'D')"
+)
+PG_CREATE = (
+    'CREATE INDEX IF NOT EXISTS ix_tasks_search ON tasks USING gin (({}))'.format(PG_DOCUMENT),
+)
+PG_DROP = ('DROP INDEX IF EXISTS ix_tasks_search',)
+PG_QUERY = "(to_tsquery('simple', :owner) && plainto_tsquery('english', :terms))"
+# the words alone, held against the name and note weights only, so they
+# can't match the owner
+PG_TERMS_ONLY = "ts_filter({}, '{{a,b}}') @@ plainto_tsquery('english', :terms)".format(PG_DOCUMENT)
+
+tasks_fts = table('tasks_fts', column('rowid'))
+
+
+def _statements(dialect_name, create=True):
+    if dialect_name == 'sqlite':
+        return SQLITE_CREATE if create else SQLITE_DROP
+    if dialect_name == 'postgresql':
+        return PG_CREATE if create else PG_DROP
+    return ()
+
+
+def install_search(connection):
+    """Create the search index if it is missing; return True if it was.
+
+    A new SQLite index is filled from the existing tasks; PostgreSQL
+    builds its index as it creates it.
+    """
+    name = connection.dialect.name
+    if name == 'sqlite':
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'"
+        )).first()
+    elif name == 'postgresql':
+        exists = connection.execute(text(
+            "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_tasks_search'"
+        )).first()
+    else:
+        return False
+    for statement in _statements(name):
+        connection.execute(DDL(statement))
+    if exists:
+        return False
+    if name == 'sqlite':
+        connection.execute(text("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')"))
+    return True
+
+
+def _create(target, connection, **kw):
+    for statement in _statements(connection.dialect.name):
+        connection.execute(DDL(statement))
+
+
+def _drop(target, connection, **kw):
+    for statement in _statements(connection.dialect.name, create=False):
+        connection.execute(DDL(statement))
+
+
+event.listen(Task.__table__, 'after_create', _create)
+event.listen(Task.__table__, 'before_drop', _drop)
+
+
+def search_terms(query):
+    """The words of a search, or ``ValueError`` if there are none."""
+    terms = query.split()
+    if not terms:
+        raise ValueError('q must contain at least one word')
+    return terms
+
+
+def search_query(dbsession, columns, profile_id, query, limit):
+    """Query ``columns`` of the profile's tasks that match ``query``, best first.
+
+    Every word has to match, in the name or the note; words are stemmed,
+    so "plants" finds "plant". Raises ``ValueError`` if ``query`` holds
+    no words.
+    """
+    terms = search_terms(query)
+    base = dbsession.query(*columns).filter(Task.profile_id == profile_id)
+    dialect_name = dbsession.bind.dialect.name
+    if dialect_name == 'sqlite':
+        match = 'owner : "p{}" AND {{name note}} : ({})'.format(profile_id, ' '.join(
+            '"{}"'.format(term.replace('"', '""')) for term in terms
+        ))
+        return base.join(tasks_fts, tasks_fts.c.rowid == Task.id).filter(
+            text('tasks_fts MATCH :match')
+        ).order_by(text(SQLITE_RANK), Task.id).params(match=match).limit(limit)
+    if dialect_name == 'postgresql':
+        return base.filter(text('({}) @@ {}'.format(PG_DOCUMENT, PG_QUERY))).filter(
+            text(PG_TERMS_ONLY)
+        ).order_by(
+            text('ts_rank({}, {}) DESC'.format(PG_DOCUMENT, PG_QUERY)), Task.id
+        ).params(owner='owner{}:D'.format(profile_id), terms=' '.join(terms)).limit(limit)
+    return base.filter(and_(*[
+        or_(Task.name.contains(term), Task.note.contains(term)) for term in terms
+    ])).order_by(Task.id).limit(limit)
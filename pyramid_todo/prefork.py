@@ -0,0 +1,244 @@
+"""A pre-forking runner: several waitress processes answering on one port.
+
+Only one thread of a Python process runs at a time, so a single waitress
+process gets about one core however many threads it has. The arbiter
+binds the listening socket and forks ``workers`` processes that all
+accept from it, each serving with ``threads`` threads. Workers load the
+app themselves, after the fork, so each opens its own engine and
+connection pool; none is shared across processes.
+
+The arbiter replaces workers that die. ``SIGHUP`` replaces them one at a
+time, stopping each old worker only once its replacement is ready, so
+the port keeps answering throughout. A replacement that fails to start
+ends the reload and leaves the old workers running. ``SIGTERM`` and
+``SIGINT`` stop every worker gracefully: it stops accepting, finishes
+the requests in hand and exits, or is killed after ``graceful_timeout``
+seconds.
+"""
+import logging
+import math
+import os
+import select
+import signal
+import socket
+import time
+
+from pyramid.paster import get_app
+from waitress import wasyncore
+from waitress.channel import HTTPChannel
+from waitress.server import create_server
+
+
+log = logging.getLogger(__name__)
+
+# exit status of a worker that could not load the app
+BOOT_ERROR = 3
+# seconds a new worker gets to load the app and report ready
+BOOT_TIMEOUT = 60
+# longest a worker's loop waits before checking whether it was told to stop
+LOOP_TIMEOUT = 1
+
+
+def runner_settings(settings, environ=os.environ):
+    """The worker count, thread count and graceful timeout to run with.
+
+    ``WEB_CONCURRENCY`` and ``WEB_THREADS`` in the environment override
+    ``pyramid_todo.workers`` and ``pyramid_todo.threads``. There is one
+    worker per CPU unless either says otherwise.
+    """
+    workers = environ.get('WEB_CONCURRENCY') or settings.get('pyramid_todo.workers')
+    threads = environ.get('WEB_THREADS') or settings.get('pyramid_todo.threads')
+    return (
+        int(workers or os.cpu_count() or 1),
+        int(threads or 4),
+        float(settings.get('pyramid_todo.graceful_timeout', 30)),
+    )
+
+
+def bind_socket(host, port, backlog=1024):
+    family, kind, proto, _, address = socket.getaddrinfo(
+        host, port, 0, socket.SOCK_STREAM, 0, socket.AI_PASSIVE
+    )[0]
+    sock = socket.socket(family, kind, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+
+def serve_worker(config_uri, sock, threads, ready, graceful_timeout, options=None):
+    """Serve the app on ``sock`` until SIGTERM; return the exit status.
+
+    Runs in a freshly forked worker. A byte is written to the ``ready``
+    file descriptor once the app is loaded. On SIGTERM the worker stops
+    accepting, closes its idle connections through waitress's own
+    ``maintenance``, and waits for the requests in progress to finish.
+    The worker owns the socket map it hands waitress, so it can run the
+    loop and see the open connections without going into the server's
+    attributes.
+    """
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(time.monotonic()))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    socket_map = {}
+    try:
+        app = get_app(config_uri, options=options)
+        server = create_server(app, map=socket_map, sockets=[sock], threads=threads)
+    except Exception:
+        log.exception('Worker %d could not load the app', os.getpid())
+        return BOOT_ERROR
+    os.write(ready, b'.')
+    os.close(ready)
+
+    def loop(timeout):
+        wasyncore.loop(timeout=timeout, map=socket_map, count=1)
+
+    while not stopping:
+        loop(LOOP_TIMEOUT)
+
+    # stop listening, but leave the socket open for the other workers
+    server.del_channel()
+    deadline = stopping[0] + graceful_timeout
+    while time.monotonic() < deadline:
+        if not any(isinstance(channel, HTTPChannel) for channel in socket_map.values()):
+            break
+        server.maintenance(math.inf)
+        loop(0.1)
+    return 0
+
+
+class Arbiter(object):
+    """Start, watch and replace the worker processes."""
+
+    def __init__(self, config_uri, sock, workers, threads,
+                 graceful_timeout=30, options=None):
+        self.config_uri = config_uri
+        self.sock = sock
+        self.count = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.options = options
+        # pid -> (ready pipe, start time) of the serving workers
+        self.workers = {}
+        # pid -> deadline of the workers asked to stop
+        self.retiring = {}
+        self.signals = []
+
+    def spawn(self):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(read)
+                for pipe, _ in self.workers.values():
+                    os.close(pipe)
+                status = serve_worker(
+                    self.config_uri, self.sock, self.threads, write,
+                    self.graceful_timeout, self.options
+                )
+            except BaseException:
+                log.exception('Worker %d failed', os.getpid())
+            finally:
+                logging.shutdown()
+                os._exit(status)
+        os.close(write)
+        self.workers[pid] = (read, time.monotonic())
+        log.info('Started worker %d', pid)
+        return pid
+
+    def wait_ready(self, pid):
+        """Wait for the worker to load the app; False if it died first."""
+        pipe = self.workers[pid][0]
+        readable, _, _ = select.select([pipe], [], [], BOOT_TIMEOUT)
+        return bool(readable) and os.read(pipe, 1) == b'.'
+
+    def retire(self, pid):
+        pipe, _ = self.workers.pop(pid)
+        os.close(pipe)
+        self.retiring[pid] = time.monotonic() + self.graceful_timeout + 5
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        """Collect the workers that exited; return those that were serving."""
+        died = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                break
+            if self.retiring.pop(pid, None) is not None:
+                continue
+            worker = self.workers.pop(pid, None)
+            if worker is not None:
+                os.close(worker[0])
+                if os.WIFSIGNALED(status):
+                    log.warning('Worker %d was killed by signal %d', pid, os.WTERMSIG(status))
+                else:
+                    log.warning('Worker %d exited with status %d', pid, os.WEXITSTATUS(status))
+                died.append(worker)
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                log.warning('Worker %d did not stop in time; killing it', pid)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.retiring[pid] = now + 5
+        return died
+
+    def reload(self):
+        log.info('Reloading %d workers', len(self.workers))
+        for pid in list(self.workers):
+            if pid not in self.workers:
+                continue
+            replacement = self.spawn()
+            if not self.wait_ready(replacement):
+                log.error('A new worker failed to start; keeping the old ones')
+                self.retire(replacement)
+                return
+            self.retire(pid)
+
+    def stop(self):
+        for pid in list(self.workers):
+            self.retire(pid)
+        while self.retiring:
+            self.reap()
+            time.sleep(0.1)
+
+    def handle_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def run(self):
+        """Serve until SIGTERM or SIGINT; return the exit status."""
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.handle_signal)
+        for pid in [self.spawn() for _ in range(self.count)]:
+            if not self.wait_ready(pid):
+                log.error('Worker %d failed to start; shutting down', pid)
+                self.stop()
+                return 1
+        log.info('Serving with %d workers of %d threads', self.count, self.threads)
+        while True:
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reload()
+                else:
+                    log.info('Shutting down')
+                    self.stop()
+                    return 0
+            for _, started in self.reap():
+                if time.monotonic() - started < 1:
+                    # dying straight after starting; don't restart in a tight loop
+                    time.sleep(1)
+            while len(self.workers) < self.count:
+                self.spawn()
+            time.sleep(0.5)
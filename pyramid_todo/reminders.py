@@ -0,0 +1,313 @@
+"""Reminders for tasks that are about to fall due.
+
+A ``ReminderScheduler`` keeps the open tasks falling due over the next
+``window`` seconds in a heap, ordered by when to remind: ``lead`` seconds
+before the due date. Its thread sleeps until the first of them is due or
+the window needs extending. Each extension reads the next stretch of due
+dates with one range query over the ``due_date`` index, so no query ever
+walks every task.
+
+Tasks written later reach the scheduler in one of two ways. In the app,
+with ``pyramid_todo.reminders`` on, the write views hand it new and
+changed due dates once they commit; see ``schedule_after_commit``. The
+``remindtasks`` script runs a scheduler in a process of its own instead,
+and re-reads the window for the profiles whose ``modified`` stamp moved.
+Either way each task is read back just before its reminder goes out, so
+no reminder is sent for a task since completed, deleted or moved.
+
+Reminders are handed to the callable named by
+``pyramid_todo.reminder_notify``: ``log_reminder``, which logs them, by
+default. ``ReminderLog`` keeps them in a list instead.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+import heapq
+import logging
+import threading
+
+from pyramid.path import DottedNameResolver
+from pyramid.settings import asbool
+from sqlalchemy import select
+
+from pyramid_todo.models import Profile, Task
+
+
+log = logging.getLogger(__name__)
+
+Reminder = namedtuple('Reminder', 'task_id profile_id name due_date')
+
+# longest the thread sleeps between checks, in case the wall clock jumps
+MAX_SLEEP = 60
+# seconds to wait after a failed read before trying again
+RETRY_DELAY = 5
+# writes are stamped before they commit; look back this far for late ones
+COMMIT_SLACK = timedelta(seconds=30)
+# task ids per IN clause when reading tasks back
+READ_BATCH_SIZE = 500
+
+
+def log_reminder(reminder):
+    """The default notifier: log the reminder."""
+    log.info('Task %d of profile %d, "%s", is due at %s', reminder.task_id,
+             reminder.profile_id, reminder.name, reminder.due_date)
+
+
+class ReminderLog(list):
+    """A notifier that keeps the reminders it is given, for tests and trials."""
+
+    def __call__(self, reminder):
+        self.append(reminder)
+
+
+def due_tasks(connection, start, end, profile_ids=None):
+    """The ``(id, due_date)`` of open tasks due after ``start`` and by ``end``."""
+    tasks = Task.__table__
+    query = select([tasks.c.id, tasks.c.due_date]).where(
+        (tasks.c.due_date > start) & (tasks.c.due_date <= end) & tasks.c.completed.isnot(True)
+    )
+    if profile_ids is not None:
+        query = query.where(tasks.c.profile_id.in_(profile_ids))
+    return connection.execute(query).fetchall()
+
+
+def changed_profile_ids(connection, since):
+    """The ids of profiles whose data changed after ``since``, in UTC."""
+    profiles = Profile.__table__
+    return [row[0] for row in connection.execute(
+        select([profiles.c.id]).where(profiles.c.modified > since)
+    )]
+
+
+class ReminderScheduler(object):
+    """Sends a reminder ``lead`` seconds before each open task falls due.
+
+    ``clock`` gives the current time, naive and local like the due dates.
+    """
+
+    def __init__(self, engine, notify, lead=900, window=3600, clock=datetime.now):
+        self.engine = engine
+        self.notify = notify
+        self.lead = timedelta(seconds=lead)
+        self.window = timedelta(seconds=window)
+        self.clock = clock
+        self.sent = 0
+        # (remind at, task id, due date), including stale entries; the due
+        # dates still wanted are in _due
+        self._heap = []
+        self._due = {}
+        # the due dates already reminded of, so each is sent once
+        self._sent = {}
+        # tasks due up to here have been read
+        self._horizon = None
+        # ids scheduled during each read in progress, whose rows are stale
+        self._reading = []
+        self._wake = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def _push(self, task_id, due_date):
+        if self._sent.get(task_id) == due_date or self._due.get(task_id) == due_date:
+            return
+        self._due[task_id] = due_date
+        heapq.heappush(self._heap, (due_date - self.lead, task_id, due_date))
+        if self._heap[0][1] == task_id:
+            self._wake.notify()
+
+    def schedule(self, task_id, due_date, completed=False):
+        """Take note of a task's committed due date and completion."""
+        with self._wake:
+            for touched in self._reading:
+                touched.add(task_id)
+            if (completed or due_date is None or self._horizon is None or
+                    due_date > self._horizon or due_date <= self.clock()):
+                # beyond the window, the range query finds it in time
+                self._due.pop(task_id, None)
+            else:
+                self._push(task_id, due_date)
+
+    def cancel(self, task_id):
+        """Forget a deleted task."""
+        self.schedule(task_id, None)
+
+    def _read(self, start, end, profile_ids=None):
+        touched = set()
+        with self._wake:
+            self._reading.append(touched)
+        try:
+            with self.engine.connect() as connection:
+                rows = due_tasks(connection, start, end, profile_ids)
+        finally:
+            with self._wake:
+                self._reading.remove(touched)
+        with self._wake:
+            for task_id, due_date in rows:
+                if task_id not in touched:
+                    self._push(task_id, due_date)
+        return len(rows)
+
+    def extend_at(self):
+        """When the window next needs extending; ``None`` before the first read."""
+        if self._horizon is None:
+            return None
+        return self._horizon - self.lead - self.window / 2
+
+    def extend(self, now=None):
+        """Read the tasks that have come within the window; return how many."""
+        now = now or self.clock()
+        with self._wake:
+            start = self._horizon or now
+            end = now + self.lead + self.window
+            self._sent = {
+                task_id: due_date for task_id, due_date in self._sent.items() if due_date > now
+            }
+            # move the horizon first, so tasks written meanwhile are scheduled
+            self._horizon = end
+        try:
+            return self._read(start, end)
+        except Exception:
+            with self._wake:
+                if self._horizon == end:
+                    self._horizon = start if start > now else None
+            raise
+
+    def refresh(self, profile_ids):
+        """Re-read the window for profiles written to by another process."""
+        if self._horizon is None or not profile_ids:
+            return 0
+        return sum(
+            self._read(self.clock(), self._horizon, profile_ids[start:start + READ_BATCH_SIZE])
+            for start in range(0, len(profile_ids), READ_BATCH_SIZE)
+        )
+
+    def run_pending(self, now=None):
+        """Send the reminders that are due; return them."""
+        now = now or self.clock()
+        due = {}
+        with self._wake:
+            while self._heap and self._heap[0][0] <= now:
+                _, task_id, due_date = heapq.heappop(self._heap)
+                if self._due.get(task_id) == due_date:
+                    del self._due[task_id]
+                    due[task_id] = due_date
+        if not due:
+            return []
+
+        tasks = Task.__table__
+        ids = sorted(due)
+        rows = []
+        with self.engine.connect() as connection:
+            for start in range(0, len(ids), READ_BATCH_SIZE):
+                rows += connection.execute(select([
+                    tasks.c.id, tasks.c.profile_id, tasks.c.name,
+                    tasks.c.due_date, tasks.c.completed,
+                ]).where(tasks.c.id.in_(ids[start:start + READ_BATCH_SIZE]))).fetchall()
+        reminders = []
+        for row in rows:
+            if row.due_date == due[row.id] and not row.completed:
+                reminders.append(Reminder(row.id, row.profile_id, row.name, row.due_date))
+                with self._wake:
+                    self._sent[row.id] = row.due_date
+            else:
+                # changed without our hearing of it
+                self.schedule(row.id, row.due_date, row.completed)
+        reminders.sort(key=lambda reminder: (reminder.due_date, reminder.task_id))
+        for reminder in reminders:
+            try:
+                self.notify(reminder)
+            except Exception:
+                log.exception('Could not send the reminder for task %d', reminder.task_id)
+            else:
+                self.sent += 1
+        return reminders
+
+    def _sleep_time(self, now):
+        wake_at = [self.extend_at()]
+        if self._heap:
+            wake_at.append(self._heap[0][0])
+        return max(0, min([MAX_SLEEP] + [
+            (moment - now).total_seconds() for moment in wake_at if moment is not None
+        ]))
+
+    def run(self):
+        """Extend the window and send reminders until ``stop`` is called."""
+        while True:
+            delay = None
+            try:
+                now = self.clock()
+                extend_at = self.extend_at()
+                if extend_at is None or extend_at <= now:
+                    self.extend(now)
+                self.run_pending(now)
+            except Exception:
+                log.exception('Reminder scheduler failed; retrying in %d seconds', RETRY_DELAY)
+                delay = RETRY_DELAY
+            with self._wake:
+                if self._stopping:
+                    return
+                self._wake.wait(delay if delay is not None else self._sleep_time(self.clock()))
+                if self._stopping:
+                    return
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='reminders', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._wake:
+            self._stopping = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'scheduled': len(self._due),
+            'sent': self.sent,
+            'horizon': self._horizon.isoformat() if self._horizon else None,
+        }
+
+
+def make_scheduler(engine, settings):
+    """A ``ReminderScheduler`` configured by the ``pyramid_todo.reminder_*`` settings."""
+    notify = DottedNameResolver().maybe_resolve(
+        settings.get('pyramid_todo.reminder_notify') or log_reminder
+    )
+    return ReminderScheduler(
+        engine, notify,
+        lead=float(settings.get('pyramid_todo.reminder_lead', 900)),
+        window=float(settings.get('pyramid_todo.reminder_window', 3600)),
+    )
+
+
+def schedule_after_commit(request, states):
+    """Pass the tasks a request wrote to the app's scheduler, once they commit.
+
+    ``states`` maps task ids to their new ``task_state``, or to ``None``
+    for tasks that were deleted.
+    """
+    scheduler = request.registry.get('reminders')
+    if scheduler is None or not states:
+        return
+
+    def hook(committed):
+        if committed:
+            for task_id, state in states.items():
+                if state is None:
+                    scheduler.cancel(task_id)
+                else:
+                    scheduler.schedule(task_id, state[1], state[0])
+
+    request.tm.get().addAfterCommitHook(hook)
+
+
+def includeme(config):
+    """Start a scheduler in this process if ``pyramid_todo.reminders`` is on.
+
+    It is kept in ``registry['reminders']``, which is ``None`` otherwise.
+    """
+    settings = config.get_settings()
+    scheduler = None
+    if asbool(settings.get('pyramid_todo.reminders', False)):
+        scheduler = make_scheduler(config.registry['dbsession_factory'].kw['bind'], settings)
+        scheduler.start()
+    config.registry['reminders'] = scheduler
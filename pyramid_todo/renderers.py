@@ -0,0 +1,123 @@
+"""JSON renderers for API responses."""
+from pyramid.renderers import JSON
+
+from pyramid_todo import serializers
+
+
+class Stream(object):
+    """A JSON array whose items are read from the database as it is sent.
+
+    pyramid_tm ends the request's transaction before the WSGI server starts
+    reading the response body, so the query is re-bound to a fresh session
+    of its own at that point, read ``batch_size`` rows at a time through a
+    server-side cursor where the backend has one, and closed when the body
+    has been sent or the client goes away. Each row is passed through
+    ``serialize``.
+
+    With ``limit`` set, at most that many rows are sent; ``truncated`` and
+    ``last`` then tell whether the query had more and which row was sent
+    last, for building a cursor to the next page.
+    """
+
+    def __init__(self, query, serialize, limit=None, batch_size=500):
+        self.query = query
+        self.serialize = serialize
+        self.limit = limit
+        self.batch_size = batch_size
+        self.last = None
+        self.truncated = False
+
+    def rows(self, session_factory):
+        session = session_factory()
+        try:
+            query = self.query.with_session(session).yield_per(self.batch_size)
+            for count, row in enumerate(query):
+                if self.limit is not None and count == self.limit:
+                    self.truncated = True
+                    break
+                self.last = row
+                yield self.serialize(row)
+        finally:
+            session.close()
+
+
+class StreamingJSON(object):
+    """Renderer factory for view results holding ``Stream`` values.
+
+    The result is encoded piece by piece into the response's ``app_iter``
+    instead of into one string, so only ``buffer_size`` bytes of output and
+    one batch of rows are held at a time, and the first bytes go out before
+    the last rows have been read. Callables in the result are called, and
+    their return value encoded, only once the encoder reaches them; that
+    lets a value depend on a ``Stream`` that comes before it.
+    """
+
+    def __init__(self, dumps=serializers.get_dumps('stdlib'),
+                 buffer_size=64 * 1024):
+        self.encode = dumps
+        self.buffer_size = buffer_size
+
+    def __call__(self, info):
+        def _render(value, system):
+            request = system.get('request')
+            response = request.response
+            if response.content_type == response.default_content_type:
+                response.content_type = 'application/json'
+            session_factory = request.dbsession_factory
+            return self.chunks(value, session_factory)
+        return _render
+
+    def chunks(self, value, session_factory):
+        """Group the encoded pieces into ``buffer_size`` byte chunks."""
+        buffer, size = [], 0
+        for piece in self.pieces(value, session_factory):
+            buffer.append(piece)
+            size += len(piece)
+            if size >= self.buffer_size:
+                yield ''.join(buffer).encode('utf-8')
+                buffer, size = [], 0
+        if buffer:
+            yield ''.join(buffer).encode('utf-8')
+
+    def pieces(self, value, session_factory):
+        if callable(value):
+            value = value()
+        if isinstance(value, Stream):
+            yield '['
+            for count, item in enumerate(value.rows(session_factory)):
+                yield ', ' + self.encode(item) if count else self.encode(item)
+            yield ']'
+        elif isinstance(value, dict):
+            yield '{'
+            for count, (key, item) in enumerate(value.items()):
+                yield '{}{}: '.format(', ' if count else '', self.encode(key))
+                for piece in self.pieces(item, session_factory):
+                    yield piece
+            yield '}'
+        elif isinstance(value, (list, tuple)):
+            yield '['
+            for count, item in enumerate(value):
+                if count:
+                    yield ', '
+                for piece in self.pieces(item, session_factory):
+                    yield piece
+            yield ']'
+        else:
+            yield self.encode(value)
+
+
+def includeme(config):
+    """Register the ``json`` and ``json_stream`` renderers.
+
+    Both encode with the function picked by the
+    ``pyramid_todo.json_encoder`` setting; see ``serializers.get_dumps``.
+    The ``json`` renderer also accepts ``Task`` and ``Profile`` objects.
+    """
+    settings = config.get_settings()
+    dumps = serializers.get_dumps(
+        settings.get('pyramid_todo.json_encoder', 'stdlib')
+    )
+    config.add_renderer(
+        'json', JSON(serializer=dumps, adapters=serializers.adapters())
+    )
+    config.add_renderer('json_stream', StreamingJSON(dumps))
@@ -2,11 +2,18 @@ username = '{username:[\w\-\.]+}'
 
 
 def includeme(config):
-    config.add_static_view('static', 'static', cache_max_age=3600)
+    config.include('pyramid_todo.assets')
     config.add_route('info', '/api/v1')
+    config.add_route('status', '/api/v1/status')
+    config.add_route('metrics', '/metrics')
+    config.include('pyramid_todo.views.status')
     config.add_route('register', '/api/v1/accounts')
     config.add_route('login', '/api/v1/accounts/login')
     config.add_route('logout', '/api/v1/accounts/logout')
     config.add_route('one_profile', '/api/v1/accounts/{username}')
     config.add_route('tasks', '/api/v1/accounts/{username}/tasks')
+    config.add_route('task_batch', '/api/v1/accounts/{username}/tasks/batch')
+    config.add_route('task_export', '/api/v1/accounts/{username}/tasks/export')
+    config.add_route('task_summary', '/api/v1/accounts/{username}/tasks/summary')
+    config.add_route('task_search', '/api/v1/accounts/{username}/tasks/search')
     config.add_route('one_task', '/api/v1/accounts/{username}/tasks/{id:\d+}')
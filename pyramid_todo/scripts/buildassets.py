@@ -0,0 +1,26 @@
+"""Build the fingerprinted, precompressed copies of the static assets.
+
+Run after every change to ``pyramid_todo/static`` and before the app
+starts; the app reads the manifest and the list of built files once, at
+startup.
+"""
+import argparse
+import os
+import sys
+
+from pyramid_todo.assets import BUILD_DIR, STATIC_DIR, build_assets
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Build the static assets into content-hashed, precompressed files.',
+    )
+    parser.add_argument('--source', default=STATIC_DIR, help='directory of the assets')
+    parser.add_argument('--output', default=BUILD_DIR, help='directory to build them into')
+    args = parser.parse_args(argv[1:])
+
+    manifest = build_assets(args.source, args.output)
+    for name, built in sorted(manifest.items()):
+        print('%s -> %s' % (name, built))
+    print('done: built %d assets' % len(manifest))
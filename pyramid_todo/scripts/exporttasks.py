@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+from pyramid.scripts.common import parse_vars
+
+from pyramid_todo.export import CONTENT_TYPES, export_chunks
+from pyramid_todo.models import get_engine, get_session_factory, Profile
+from pyramid_todo.serializers import get_dumps
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Export all of a profile's tasks as NDJSON or CSV.",
+        epilog='example: "%(prog)s production.ini alice --format csv -o alice.csv"',
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('username')
+    parser.add_argument('vars', nargs='*', metavar='var=value')
+    parser.add_argument('--format', choices=sorted(CONTENT_TYPES), default='ndjson')
+    parser.add_argument('-o', '--output', help='file to write (default: stdout)')
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=parse_vars(args.vars))
+    settings['sqlalchemy.url'] = os.environ.get('DATABASE_URL', '')
+    session_factory = get_session_factory(get_engine(settings))
+
+    session = session_factory()
+    try:
+        profile_id = session.query(Profile.id).filter(
+            Profile.username == args.username
+        ).scalar()
+    finally:
+        session.close()
+    if profile_id is None:
+        print('no profile named %r' % args.username, file=sys.stderr)
+        sys.exit(1)
+
+    dumps = get_dumps(settings.get('pyramid_todo.json_encoder', 'stdlib'))
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_chunks(args.format, session_factory, profile_id, dumps):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
@@ -0,0 +1,289 @@
+"""Bulk import of tasks from JSON or NDJSON dumps.
+
+Records are read one at a time, so the input is never loaded whole, and
+are inserted in batches of ``--batch-size``, each in its own transaction.
+PostgreSQL gets the rows through ``COPY``, other databases through a
+single ``executemany`` insert per batch. After each batch the number of
+records done so far is saved to a state file, from which ``--resume``
+carries on after a failure.
+"""
+import argparse
+import csv
+from datetime import datetime
+import io
+import json
+import os
+import sys
+import time
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+from pyramid.scripts.common import parse_vars
+from sqlalchemy import bindparam
+
+from pyramid_todo.models import adjust_task_counts, get_engine, Profile, Task
+
+
+LEGACY_DATE_FMT = '%m/%d/%Y %I:%M:%S %p'
+COLUMNS = ('name', 'note', 'creation_date', 'due_date', 'completed', 'profile_id')
+READ_SIZE = 64 * 1024
+# characters one record may take; a malformed one is given up on after this
+MAX_RECORD_SIZE = 1024 * 1024
+
+
+class BadRecord(Exception):
+    """A record that cannot be imported; the message says which and why."""
+
+
+def iter_records(stream, read_size=READ_SIZE, max_record_size=MAX_RECORD_SIZE):
+    """Yield the objects of a JSON array or an NDJSON stream, one at a time.
+
+    The format is told apart by the first character. Only ``read_size``
+    characters beyond the current record are held in memory. A record that
+    is not valid JSON, or is still incomplete after ``max_record_size``
+    characters, raises ``BadRecord`` with its number.
+    """
+    decoder = json.JSONDecoder()
+    buffer = stream.read(read_size)
+    position = 0
+    number = 0
+    array = buffer.lstrip().startswith('[')
+    if array:
+        position = buffer.index('[') + 1
+    while True:
+        # skip the separators between records
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer):
+                break
+            buffer, position = stream.read(read_size), 0
+            if not buffer:
+                return
+        if array and buffer[position] == ']':
+            return
+        number += 1
+        while True:
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+                break
+            except ValueError as error:
+                if len(buffer) - position >= max_record_size:
+                    raise BadRecord('record {}: not valid JSON within {} characters'.format(
+                        number, max_record_size
+                    ))
+                more = stream.read(read_size)
+                if not more:
+                    raise BadRecord('record {}: {}'.format(number, getattr(error, 'msg', error)))
+                buffer, position = buffer[position:] + more, 0
+        yield record
+        position = end
+
+
+def parse_date(value, date_format):
+    return datetime.strptime(value, date_format) if value else None
+
+
+def to_row(record, profile_id, date_format, now):
+    """Turn one input record into a row for the tasks table."""
+    name = record.get('name', record.get('title'))
+    if not isinstance(name, str) or not name:
+        raise ValueError('name or title must be a non-empty string')
+    completed = record.get('completed', False)
+    if not isinstance(completed, bool):
+        raise ValueError('completed must be true or false')
+    return {
+        'name': name,
+        'note': record.get('note') or '',
+        'creation_date': parse_date(record.get('creation_date'), date_format) or now,
+        'due_date': parse_date(record.get('due_date'), date_format),
+        'completed': completed,
+        'profile_id': profile_id,
+    }
+
+
+class ProfileIds(object):
+    """Look each username up once, along with the rest of its batch."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def load(self, connection, usernames):
+        missing = set(usernames) - set(self.ids) - {None}
+        if missing:
+            table = Profile.__table__
+            self.ids.update(connection.execute(
+                table.select().with_only_columns([table.c.username, table.c.id]).where(
+                    table.c.username.in_(missing)
+                )
+            ).fetchall())
+            for username in missing - set(self.ids):
+                self.ids[username] = None
+
+    def __getitem__(self, username):
+        return self.ids[username]
+
+
+def copy_rows(connection, rows):
+    """Send rows to PostgreSQL with COPY, through an in-memory CSV buffer."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            '\\N' if row[column] is None else row[column] for column in COLUMNS
+        ])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            "COPY tasks ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(', '.join(COLUMNS)),
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def insert_rows(connection, rows):
+    if connection.dialect.name == 'postgresql':
+        copy_rows(connection, rows)
+    else:
+        connection.execute(Task.__table__.insert(), rows)
+
+
+def bump_versions(connection, profile_ids):
+    """Invalidate the ETags of the profiles that got new tasks."""
+    table = Profile.__table__
+    connection.execute(
+        table.update().where(table.c.id == bindparam('profile')).values(
+            version=table.c.version + 1, modified=datetime.utcnow()
+        ),
+        [{'profile': profile_id} for profile_id in profile_ids]
+    )
+
+
+def import_tasks(engine, records, username=None, batch_size=1000,
+                 date_format=LEGACY_DATE_FMT, skip=0, progress=None):
+    """Insert tasks from ``records``, committing every ``batch_size``.
+
+    Each record belongs to the profile named by its ``username`` key, or
+    else to ``username``. The first ``skip`` records are passed over, as
+    when resuming. ``progress`` is called with the number of records done,
+    including skipped ones, after every committed batch.
+
+    Raises ``BadRecord`` for a record that cannot be imported; the
+    batches before it stay committed.
+    """
+    now = datetime.now()
+    done = skip
+    batch = []
+    profiles = ProfileIds()
+
+    def flush():
+        with engine.begin() as connection:
+            profiles.load(connection, (record.get('username', username) for _, record in batch))
+            rows = []
+            for number, record in batch:
+                owner = record.get('username', username)
+                if owner is None:
+                    raise BadRecord('record {}: no username, and no default owner'.format(number))
+                if profiles[owner] is None:
+                    raise BadRecord('record {}: no profile named {!r}'.format(number, owner))
+                try:
+                    rows.append(to_row(record, profiles[owner], date_format, now))
+                except (AttributeError, TypeError, ValueError) as error:
+                    raise BadRecord('record {}: {}'.format(number, error))
+            insert_rows(connection, rows)
+            bump_versions(connection, {row['profile_id'] for row in rows})
+            states = {}
+            for row in rows:
+                states.setdefault(row['profile_id'], []).append((row['completed'], row['due_date']))
+            for profile_id, added in states.items():
+                adjust_task_counts(connection, profile_id, added=added)
+
+    for number, record in enumerate(records, 1):
+        if number <= skip:
+            continue
+        if not isinstance(record, dict):
+            raise BadRecord('record {}: expected an object'.format(number))
+        batch.append((number, record))
+        if len(batch) == batch_size:
+            flush()
+            done += len(batch)
+            batch = []
+            if progress is not None:
+                progress(done)
+    if batch:
+        flush()
+        done += len(batch)
+        if progress is not None:
+            progress(done)
+    return done
+
+
+def read_state(path):
+    try:
+        with open(path) as state:
+            return json.load(state)['done']
+    except FileNotFoundError:
+        return 0
+
+
+def write_state(path, done):
+    with open(path + '.tmp', 'w') as state:
+        json.dump({'done': done}, state)
+    os.replace(path + '.tmp', path)
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Import tasks from a JSON array or NDJSON file.',
+        epilog='example: "%(prog)s development.ini tasks.ndjson --username alice"',
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('path', help='the file to import, or - for stdin')
+    parser.add_argument('vars', nargs='*', metavar='var=value')
+    parser.add_argument('--username',
+                        help='owner of records without a username of their own')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--date-format', default=LEGACY_DATE_FMT)
+    parser.add_argument('--state', help='where to keep progress (default: PATH.import-state)')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the records a previous run already imported')
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=parse_vars(args.vars))
+    settings['sqlalchemy.url'] = os.environ.get('DATABASE_URL', '')
+    engine = get_engine(settings)
+
+    state = args.state or (args.path + '.import-state' if args.path != '-' else None)
+    skip = read_state(state) if args.resume and state else 0
+    started = time.time()
+
+    def progress(done):
+        if state:
+            write_state(state, done)
+        elapsed = time.time() - started
+        print('imported %d records (%.0f records/s)' % (
+            done, (done - skip) / elapsed if elapsed else 0
+        ), file=sys.stderr)
+
+    stream = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8')
+    try:
+        done = import_tasks(
+            engine, iter_records(stream), username=args.username,
+            batch_size=args.batch_size, date_format=args.date_format,
+            skip=skip, progress=progress,
+        )
+    except BadRecord as error:
+        print('import stopped: %s' % error, file=sys.stderr)
+        if state:
+            print('fix the record and rerun with --resume to carry on', file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    print('done: %d records' % done)
@@ -1,5 +1,4 @@
 from datetime import datetime
-import json
 import os
 import sys
 import transaction
@@ -18,8 +17,8 @@ from pyramid_todo.models import (
     get_session_factory,
     get_tm_session,
     Profile,
-    Task
 )
+from pyramid_todo.scripts.importtasks import import_tasks, iter_records
 
 
 def usage(argv):
@@ -55,20 +54,6 @@ def main(argv=sys.argv):
         )
         dbsession.add(person)
 
-    with transaction.manager:
-        dbsession = get_tm_session(session_factory, transaction.manager)
-
-        file_path = os.path.join(os.path.dirname(__file__), 'tasks.json')
-        fmt = '%m/%d/%Y %H:%M:%S %p'
-
-        for task in json.loads(open(file_path).read()):
-            task = Task(
-                name=task['title'],
-                note=task['note'],
-                creation_date=datetime.strptime(task['creation_date'], fmt) if task['creation_date'] else None,
-                due_date=datetime.strptime(task['due_date'], fmt) if task['due_date'] else None,
-                completed=task['completed'],
-                profile_id=dbsession.query(Profile).first().id,
-                profile=dbsession.query(Profile).first(),
-            )
-            dbsession.add(task)
+    file_path = os.path.join(os.path.dirname(__file__), 'tasks.json')
+    with open(file_path) as tasks:
+        import_tasks(engine, iter_records(tasks), username='nhuntwalker')
@@ -0,0 +1,127 @@
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+from pyramid.scripts.common import parse_vars
+from sqlalchemy import func, inspect, select
+from sqlalchemy.schema import CreateColumn
+
+from pyramid_todo.models.meta import Base
+from pyramid_todo.models import get_engine, install_search
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> [var=value]\n'
+          '(example: "%s production.ini")' % (cmd, cmd))
+    sys.exit(1)
+
+
+class DuplicateValues(Exception):
+    """Existing rows repeat values that a unique index to be added forbids."""
+
+
+def find_duplicates(engine, table, column_names, limit=5):
+    """Up to ``limit`` value tuples that several rows of ``table`` share."""
+    columns = [table.c[name] for name in column_names]
+    return [tuple(row) for row in engine.execute(
+        select(columns).group_by(*columns).having(func.count() > 1).order_by(*columns).limit(limit)
+    )]
+
+
+def check_unique_indexes(engine, existing_tables):
+    """Raise ``DuplicateValues`` if a missing unique index could not be created.
+
+    Checked before anything is changed, so the upgrade does not stop
+    halfway through.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        present = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            names = [column.name for column in index.columns]
+            if not index.unique or index.name in present or not columns.issuperset(names):
+                continue
+            duplicates = find_duplicates(engine, table, names)
+            if duplicates:
+                raise DuplicateValues(
+                    'cannot create the unique index {}: {} has rows sharing the {} {}. '
+                    'Rename or remove the duplicates, then run migratedb again.'.format(
+                        index.name, table.name, '/'.join(names),
+                        ', '.join(repr(values[0] if len(values) == 1 else values)
+                                  for values in duplicates)
+                    )
+                )
+
+
+def upgrade(engine):
+    """Bring an existing database up to the current schema, in place.
+
+    Missing tables are created outright. Missing columns are added to
+    existing tables, which works for columns that are nullable or have a
+    ``server_default``. Missing indexes are created using the names given
+    by ``meta.NAMING_CONVENTION``, and the full-text search index is
+    created and filled if it is missing. Running this repeatedly is safe.
+
+    Returns a list of the names of the tables, columns and indexes that
+    were added; columns are given as ``table.column``. Raises
+    ``DuplicateValues``, before changing anything, if existing rows would
+    break a unique index that is missing.
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    check_unique_indexes(engine, existing_tables)
+    Base.metadata.create_all(engine)
+    added = [
+        table.name for table in Base.metadata.sorted_tables
+        if table.name not in existing_tables
+    ]
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                engine.execute('ALTER TABLE {} ADD COLUMN {}'.format(
+                    table.name, ddl
+                ))
+                added.append('{}.{}'.format(table.name, column.name))
+
+        present = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in present:
+                index.create(engine)
+                added.append(index.name)
+
+    with engine.begin() as connection:
+        if install_search(connection):
+            added.append('tasks search index')
+    return added
+
+
+def main(argv=sys.argv):
+    if len(argv) < 2:
+        usage(argv)
+    config_uri = argv[1]
+    options = parse_vars(argv[2:])
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, options=options)
+    settings['sqlalchemy.url'] = os.environ.get('DATABASE_URL', '')
+
+    try:
+        added = upgrade(get_engine(settings))
+    except DuplicateValues as error:
+        print('migration stopped: %s' % error, file=sys.stderr)
+        sys.exit(1)
+    for name in added:
+        print('created %s' % name)
+    if not added:
+        print('schema is up to date')
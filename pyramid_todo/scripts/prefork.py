@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+from pyramid.scripts.common import parse_vars
+
+from pyramid_todo.prefork import Arbiter, bind_socket, runner_settings
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Serve the app from several pre-forked waitress processes.',
+        epilog='example: "%(prog)s production.ini --port 8080"; '
+               'send SIGHUP to reload the workers one by one',
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('vars', nargs='*', metavar='var=value')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int,
+                        help='processes to fork (default: WEB_CONCURRENCY, '
+                             'pyramid_todo.workers or one per CPU)')
+    parser.add_argument('--threads', type=int,
+                        help='threads per process (default: WEB_THREADS, '
+                             'pyramid_todo.threads or 4)')
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    options = parse_vars(args.vars)
+    workers, threads, graceful_timeout = runner_settings(
+        get_appsettings(args.config_uri, options=options)
+    )
+    arbiter = Arbiter(
+        args.config_uri, bind_socket(args.host, args.port),
+        workers=args.workers or workers, threads=args.threads or threads,
+        graceful_timeout=graceful_timeout, options=options,
+    )
+    sys.exit(arbiter.run())
@@ -0,0 +1,130 @@
+"""Rebuild the per-profile task counts from the tasks themselves.
+
+The counts are normally kept up to date by every write, but tasks changed
+behind the app's back, or a database migrated from before the counts
+existed, leave them wrong. This recounts each profile's tasks and
+replaces the stored counts, reporting the profiles that were off.
+Profiles are done ``--batch-size`` at a time, each batch in its own
+transaction with the profile rows locked, so writes that land meanwhile
+are counted once.
+"""
+import argparse
+import os
+import sys
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+from pyramid.scripts.common import parse_vars
+from sqlalchemy import Date, func, select
+
+from pyramid_todo.models import get_engine, Profile, Task, TaskCounter, TaskDueCounter
+
+
+def _nonzero(counts):
+    return {key: value for key, value in counts.items() if any(value)}
+
+
+def recount(connection, profile_ids):
+    """Replace the stored counts of ``profile_ids``; return the ids that were wrong."""
+    profiles = Profile.__table__
+    tasks = Task.__table__
+    counters = TaskCounter.__table__
+    due_counters = TaskDueCounter.__table__
+    connection.execute(
+        select([profiles.c.id]).where(profiles.c.id.in_(profile_ids)).with_for_update()
+    ).fetchall()
+
+    totals = {}
+    for profile_id, completed, count in connection.execute(
+        select([tasks.c.profile_id, tasks.c.completed, func.count()]).where(
+            tasks.c.profile_id.in_(profile_ids)
+        ).group_by(tasks.c.profile_id, tasks.c.completed)
+    ):
+        open_count, completed_count = totals.get(profile_id, (0, 0))
+        if completed:
+            totals[profile_id] = (open_count, completed_count + count)
+        else:
+            totals[profile_id] = (open_count + count, completed_count)
+    due_day = func.date(tasks.c.due_date, type_=Date)
+    days = {
+        (profile_id, day): (count,) for profile_id, day, count in connection.execute(
+            select([tasks.c.profile_id, due_day, func.count()]).where(
+                tasks.c.profile_id.in_(profile_ids) &
+                (tasks.c.completed.isnot(True)) &
+                tasks.c.due_date.isnot(None)
+            ).group_by(tasks.c.profile_id, due_day)
+        )
+    }
+
+    stored_totals = {
+        row.profile_id: (row.open, row.completed) for row in connection.execute(
+            counters.select().where(counters.c.profile_id.in_(profile_ids))
+        )
+    }
+    stored_days = {
+        (row.profile_id, row.due_day): (row.open,) for row in connection.execute(
+            due_counters.select().where(due_counters.c.profile_id.in_(profile_ids))
+        )
+    }
+    wrong = {
+        profile_id for profile_id, _ in
+        set(_nonzero(totals).items()) ^ set(_nonzero(stored_totals).items())
+    }
+    wrong |= {
+        key[0] for key, _ in set(_nonzero(days).items()) ^ set(_nonzero(stored_days).items())
+    }
+
+    connection.execute(counters.delete().where(counters.c.profile_id.in_(profile_ids)))
+    connection.execute(due_counters.delete().where(due_counters.c.profile_id.in_(profile_ids)))
+    if totals:
+        connection.execute(counters.insert(), [
+            {'profile_id': profile_id, 'open': open_count, 'completed': completed}
+            for profile_id, (open_count, completed) in totals.items()
+        ])
+    if days:
+        connection.execute(due_counters.insert(), [
+            {'profile_id': profile_id, 'due_day': day, 'open': count}
+            for (profile_id, day), (count,) in days.items()
+        ])
+    return wrong
+
+
+def rebuild_task_counts(engine, usernames=None, batch_size=500):
+    """Recount the tasks of every profile, or of those named; return the names that were wrong."""
+    profiles = Profile.__table__
+    query = select([profiles.c.id, profiles.c.username]).order_by(profiles.c.id)
+    if usernames:
+        query = query.where(profiles.c.username.in_(usernames))
+    with engine.connect() as connection:
+        names = dict(connection.execute(query).fetchall())
+    ids = sorted(names)
+    wrong = set()
+    for start in range(0, len(ids), batch_size):
+        with engine.begin() as connection:
+            wrong |= recount(connection, ids[start:start + batch_size])
+    return sorted(names[profile_id] for profile_id in wrong)
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Rebuild the task counts served by the task summary route.',
+        epilog='example: "%(prog)s production.ini --username alice"',
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('vars', nargs='*', metavar='var=value')
+    parser.add_argument('--username', action='append',
+                        help='only recount this profile; may be repeated')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='profiles recounted per transaction')
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=parse_vars(args.vars))
+    settings['sqlalchemy.url'] = os.environ.get('DATABASE_URL', '')
+    wrong = rebuild_task_counts(get_engine(settings), args.username, args.batch_size)
+    for username in wrong:
+        print('fixed the counts of %s' % username)
+    print('done: %d profiles had wrong counts' % len(wrong))
@@ -0,0 +1,76 @@
+"""Send reminders for tasks about to fall due, from a process of its own.
+
+Use this instead of ``pyramid_todo.reminders`` when the app runs in more
+than one process, each of which would otherwise send every reminder. The
+app's writes don't reach this process, so every ``--poll-interval``
+seconds it re-reads the upcoming due dates of the profiles written to
+since the last look.
+"""
+import argparse
+from datetime import datetime
+import logging
+import os
+import signal
+import sys
+import threading
+
+from pyramid.paster import (
+    get_appsettings,
+    setup_logging,
+)
+from pyramid.scripts.common import parse_vars
+
+from pyramid_todo.models import get_engine
+from pyramid_todo.reminders import COMMIT_SLACK, changed_profile_ids, make_scheduler
+
+
+log = logging.getLogger(__name__)
+
+
+def follow_changes(scheduler, engine, poll_interval, stopping):
+    """Pass profiles written to onto the scheduler until ``stopping`` is set."""
+    since = datetime.utcnow()
+    while not stopping.wait(poll_interval):
+        checked = datetime.utcnow()
+        try:
+            with engine.connect() as connection:
+                profile_ids = changed_profile_ids(connection, since - COMMIT_SLACK)
+            scheduler.refresh(profile_ids)
+        except Exception:
+            log.exception('Could not read the written profiles; trying again')
+            continue
+        since = checked
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description='Send reminders for tasks that are about to fall due.',
+        epilog='example: "%(prog)s production.ini --lead 600"',
+    )
+    parser.add_argument('config_uri')
+    parser.add_argument('vars', nargs='*', metavar='var=value')
+    parser.add_argument('--lead', type=float,
+                        help='seconds before the due date to remind '
+                             '(default: pyramid_todo.reminder_lead or 900)')
+    parser.add_argument('--poll-interval', type=float, default=10,
+                        help='seconds between looks for written profiles')
+    args = parser.parse_args(argv[1:])
+
+    setup_logging(args.config_uri)
+    settings = get_appsettings(args.config_uri, options=parse_vars(args.vars))
+    settings['sqlalchemy.url'] = os.environ.get('DATABASE_URL', '')
+    if args.lead is not None:
+        settings['pyramid_todo.reminder_lead'] = args.lead
+    engine = get_engine(settings)
+    scheduler = make_scheduler(engine, settings)
+
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+    scheduler.start()
+    try:
+        follow_changes(scheduler, engine, args.poll_interval, stopping)
+    finally:
+        scheduler.stop()
+    print('done: sent %d reminders' % scheduler.sent)
@@ -1,11 +1,189 @@
+import multiprocessing
 import os
+import threading
+import time
+
 from passlib.hash import pbkdf2_sha256 as hasher
 from pyramid.authentication import AuthTktAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
 from pyramid.security import Authenticated, Allow
+from pyramid_todo.cache import LRUCache
 from pyramid_todo.models import Profile
 
 
+class HasherBusy(Exception):
+    """The password hashing pool is full or too slow to answer in time."""
+
+
+def _hash(password):
+    return hasher.hash(password)
+
+
+def _verify(password, hashed):
+    return hasher.verify(password, hashed)
+
+
+class PasswordHasher(object):
+    """Runs pbkdf2 hashing and verification on a pool of worker processes.
+
+    Keeps the CPU-heavy hashing off the request threads, so a burst of
+    logins cannot hold up every other request. At most ``max_pending``
+    jobs are running or queued at once; beyond that, and when a job takes
+    longer than ``timeout`` seconds, ``HasherBusy`` is raised straight away
+    rather than tying up yet another request thread. With ``workers`` set
+    to 0 the hashing is done inline, as before.
+
+    The pool is only started on first use, so that it is created in each
+    process after any pre-forking. Its processes come from a fork server,
+    not from forking this process: by then request threads are running,
+    and a fork taken while one of them holds a lock could hang forever on
+    it. ``ProcessPoolExecutor`` only takes a start method from Python 3.7
+    on, so this uses a ``multiprocessing`` pool.
+    """
+
+    def __init__(self, workers=0, max_pending=None, timeout=5):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(
+            max_pending if max_pending is not None else workers * 4 or 1
+        )
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+
+        # the slot is held until the job is done, even if we give up on it
+        def release(result):
+            self._slots.release()
+
+        try:
+            result = self._get_pool().apply_async(
+                func, args, callback=release, error_callback=release
+            )
+        except Exception:
+            self._slots.release()
+            raise
+        try:
+            return result.get(timeout=self.timeout)
+        except multiprocessing.TimeoutError:
+            raise HasherBusy()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.get_context('forkserver').Pool(self.workers)
+            return self._pool
+
+    def hash(self, password):
+        return self._run(_hash, password)
+
+    def verify(self, password, hashed):
+        return self._run(_verify, password, hashed)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+
+def get_hasher(request):
+    """The application's ``PasswordHasher``."""
+    return request.registry['password_hasher']
+
+
+def get_profile_id(request):
+    """The id of the logged-in user's profile, or ``None``.
+
+    Reified as ``request.profile_id``.
+    """
+    profile = request.profile
+    return profile.id if profile is not None else None
+
+
+def get_request_profile(request):
+    """The logged-in user's ``Profile``, or ``None``.
+
+    Reified as ``request.profile``, so the row is loaded at most once per
+    request, by one query on the indexed username. Going by the username
+    every time means a renamed or deleted profile is never handed out for
+    its old name, in this process or any other.
+    """
+    username = request.unauthenticated_userid
+    if username is None:
+        return None
+    return request.dbsession.query(Profile).filter(
+        Profile.username == username
+    ).first()
+
+
+def find_principals(userid, request):
+    """Authentication policy callback: only tickets for existing profiles count.
+
+    Shares ``request.profile`` with the views, so the permission check on
+    ``MyRoot`` loads no row they don't need anyway.
+    """
+    if request.profile is not None:
+        return []
+    return None
+
+
+class CachingAuthTktAuthenticationPolicy(AuthTktAuthenticationPolicy):
+    """An ``AuthTktAuthenticationPolicy`` that remembers the tickets it verified.
+
+    Parsing a ticket and checking its sha512 HMAC on every request adds up,
+    so ticket strings that verified are mapped to their userid in ``cache``
+    (an ``LRUCache``). An entry lives no longer than the cache's ttl, nor
+    past the ticket's expiry under ``timeout`` or its ``reissue_time``, so
+    expired tickets are still turned away and old ones still reissued.
+    Tickets that fail to verify are never cached. ``forget`` drops the
+    request's ticket, as on logout and when a profile is deleted.
+    """
+
+    def __init__(self, secret, cache, **kw):
+        super(CachingAuthTktAuthenticationPolicy, self).__init__(secret, **kw)
+        self.ticket_cache = cache
+
+    def _ticket_key(self, request):
+        ticket = request.cookies.get(self.cookie.cookie_name)
+        if ticket is None or not self.cookie.include_ip:
+            return ticket
+        return (ticket, request.environ['REMOTE_ADDR'])
+
+    def unauthenticated_userid(self, request):
+        key = self._ticket_key(request)
+        if key is None:
+            return None
+        userid = self.ticket_cache.get(key)
+        if userid is not None:
+            return userid
+        identity = self.cookie.identify(request)
+        if identity is None:
+            return None
+        userid = identity['userid']
+        lifetimes = [
+            identity['timestamp'] + limit - time.time()
+            for limit in (self.cookie.timeout, self.cookie.reissue_time) if limit is not None
+        ]
+        if self.ticket_cache.ttl is not None:
+            lifetimes.append(self.ticket_cache.ttl)
+        ttl = min(lifetimes) if lifetimes else None
+        if ttl is None or ttl > 0:
+            self.ticket_cache.set(key, userid, ttl=ttl)
+        return userid
+
+    def forget(self, request):
+        key = self._ticket_key(request)
+        if key is not None:
+            self.ticket_cache.pop(key)
+        return super(CachingAuthTktAuthenticationPolicy, self).forget(request)
+
+
 class MyRoot(object):
 
     def __init__(self, request):
@@ -18,18 +196,35 @@ class MyRoot(object):
 
 def includeme(config):
     """Include this security configuration for the configurator."""
+    settings = config.get_settings()
     auth_secret = os.environ.get('AUTH_SECRET', 's00persekret')
-    authn_policy = AuthTktAuthenticationPolicy(
+    ticket_cache = LRUCache(
+        int(settings.get('pyramid_todo.auth_ticket_cache_size', 10000)),
+        ttl=float(settings.get('pyramid_todo.auth_ticket_cache_ttl', 300)),
+    )
+    authn_policy = CachingAuthTktAuthenticationPolicy(
         secret=auth_secret,
-        hashalg='sha512'
+        cache=ticket_cache,
+        hashalg='sha512',
+        callback=find_principals
     )
     config.set_authentication_policy(authn_policy)
+    config.registry['auth_ticket_cache'] = ticket_cache
 
     authz_policy = ACLAuthorizationPolicy()
     config.set_authorization_policy(authz_policy)
     config.set_default_permission('authorized')
     config.set_root_factory(MyRoot)
 
+    config.registry['password_hasher'] = PasswordHasher(
+        workers=int(settings.get('pyramid_todo.hash_workers', 0)),
+        max_pending=int(settings['pyramid_todo.hash_max_pending'])
+        if 'pyramid_todo.hash_max_pending' in settings else None,
+        timeout=float(settings.get('pyramid_todo.hash_timeout', 5)),
+    )
+    config.add_request_method(get_profile_id, 'profile_id', reify=True)
+    config.add_request_method(get_request_profile, 'profile', reify=True)
+
 
 def authenticate_user(request):
     """Check provided username and password for valid user credentials."""
@@ -38,7 +233,7 @@ def authenticate_user(request):
     profile = request.dbsession.query(Profile).filter(
         Profile.username == username
     ).first()
-    return profile and hasher.verify(passwd, profile.password)
+    return profile and get_hasher(request).verify(passwd, profile.password)
 
 
 def is_user(request):
@@ -0,0 +1,132 @@
+"""Fast serialization of tasks and profiles for API responses.
+
+Produces exactly the dictionaries ``Task.to_dict`` and ``Profile.to_dict``
+do, but through functions compiled once at import time from a field plan.
+Dates skip ``strftime``. The plans read plain attributes, so they serialize
+ORM instances and column-only query rows alike.
+"""
+from functools import lru_cache
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from pyramid_todo.models import Profile, Task
+
+
+def format_datetime(value):
+    """Format a datetime as ``model_defs.DATE_FMT`` does, without strftime.
+
+    The year is not zero-padded, to match glibc's ``%Y``.
+    """
+    return '%02d/%02d/%d %02d:%02d:%02d' % (
+        value.day, value.month, value.year,
+        value.hour, value.minute, value.second
+    )
+
+
+def format_optional_datetime(value):
+    return format_datetime(value) if value is not None else None
+
+
+def compile_plan(fields):
+    """Compile a field plan into a function that turns an object into a dict.
+
+    ``fields`` is a sequence of ``(key, attribute, convert)`` triples, where
+    ``convert`` may be ``None`` for values that are used as they are. The
+    plan becomes the source of a single function returning a dict literal,
+    which runs noticeably faster than looping over the fields per call.
+    The keys are kept on the function as ``keys``.
+    """
+    namespace = {}
+    items = []
+    for index, (key, attr, convert) in enumerate(fields):
+        if not attr.isidentifier():
+            raise ValueError('Not an attribute name: {!r}'.format(attr))
+        value = 'obj.{}'.format(attr)
+        if convert is not None:
+            namespace['convert_{}'.format(index)] = convert
+            value = 'convert_{}({})'.format(index, value)
+        items.append('{!r}: {}'.format(key, value))
+    exec('def serialize(obj):\n    return {{{}}}\n'.format(', '.join(items)), namespace)
+    serialize = namespace['serialize']
+    serialize.keys = tuple(key for key, _, _ in fields)
+    return serialize
+
+
+serialize_task = compile_plan([
+    ('id', 'id', None),
+    ('name', 'name', None),
+    ('note', 'note', None),
+    ('creation_date', 'creation_date', format_datetime),
+    ('due_date', 'due_date', format_optional_datetime),
+    ('completed', 'completed', None),
+    ('profile_id', 'profile_id', None),
+])
+
+_PROFILE_PLAN = (
+    ('id', 'id', None),
+    ('username', 'username', None),
+    ('email', 'email', None),
+    ('date_joined', 'date_joined', format_datetime),
+)
+_serialize_profile_fields = compile_plan(_PROFILE_PLAN)
+PROFILE_FIELDS = _serialize_profile_fields.keys
+
+# the columns serialize_task reads, for queries that skip building
+# ORM objects altogether
+TASK_COLUMNS = tuple(getattr(Task, key) for key in serialize_task.keys)
+
+
+def serialize_profile(profile, include_tasks=True):
+    """The ``Profile.to_dict`` shape, with tasks serialized by plan too."""
+    as_dict = _serialize_profile_fields(profile)
+    if include_tasks:
+        as_dict['tasks'] = [serialize_task(task) for task in profile.tasks]
+    return as_dict
+
+
+@lru_cache(maxsize=None)
+def profile_serializer(fields):
+    """A plan for only ``fields``, a frozenset of ``PROFILE_FIELDS``.
+
+    The keys keep their usual order. Each subset is compiled once.
+    """
+    return compile_plan([field for field in _PROFILE_PLAN if field[0] in fields])
+
+
+def _stdlib_dumps(value, default=None):
+    return json.dumps(value, default=default)
+
+
+def _orjson_dumps(value, default=None):
+    return orjson.dumps(value, default=default).decode('utf-8')
+
+
+def get_dumps(name):
+    """Pick the JSON encoding function named by the ``json_encoder`` setting.
+
+    ``stdlib`` output is byte-for-byte what Pyramid's stock ``json``
+    renderer produces. ``orjson`` is several times faster but writes
+    compact JSON without the spaces after separators. ``auto`` uses orjson
+    when it is installed and the standard library otherwise.
+    """
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'stdlib'
+    if name == 'stdlib':
+        return _stdlib_dumps
+    if name == 'orjson':
+        if orjson is None:
+            raise ValueError('json_encoder = orjson, but orjson is not installed')
+        return _orjson_dumps
+    raise ValueError('Unknown json_encoder: {}'.format(name))
+
+
+def adapters():
+    """Renderer adapters that let views return models directly."""
+    return (
+        (Task, lambda task, request: serialize_task(task)),
+        (Profile, lambda profile, request: serialize_profile(profile, include_tasks=False)),
+    )
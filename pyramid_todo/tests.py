@@ -1,6 +1,11 @@
 """Tests of the Pyramid To Do List."""
+import base64
 from datetime import datetime
 from faker import Faker
+import ipaddress
+import json
+import pytest
+from pyramid import testing
 from pyramid.httpexceptions import (
     HTTPNotFound
 )
@@ -11,6 +16,8 @@ from pyramid_todo.models import (
 
 DATE_FMT = '%d/%m/%Y %H:%M:%S'
 FAKE = Faker()
+# the client address conftest lets read the status routes
+LOCAL = {'REMOTE_ADDR': '127.0.0.1'}
 def parse_cookies(cookies_list):
     """Parse response cookies into individual key-value pairs."""
     return dict(map(lambda x: x.split('='), cookies_list.split('; ')))    
@@ -97,8 +104,9 @@ def test_info_view_returns_dict_of_routes_and_methods(dummy_request):
     response = info_view(dummy_request)
     assert response == {
         'info': 'GET /api/v1',
+        'pool and load statistics': 'GET /api/v1/status',
         'register': 'POST /api/v1/accounts',
-        'single profile detail': 'GET /api/v1/accounts/<username>',
+        'single profile detail': 'GET /api/v1/accounts/<username>?fields=<names>&include=tasks',
         'edit profile': 'PUT /api/v1/accounts/<username>',
         'delete profile': 'DELETE /api/v1/accounts/<username>',
         'login': 'POST /api/v1/accounts/login',
@@ -107,7 +115,11 @@ def test_info_view_returns_dict_of_routes_and_methods(dummy_request):
         "create task": 'POST /api/v1/accounts/<username>/tasks',
         "task detail": 'GET /api/v1/accounts/<username>/tasks/<id>',
         "task update": 'PUT /api/v1/accounts/<username>/tasks/<id>',
-        "delete task": 'DELETE /api/v1/accounts/<username>/tasks</id>'
+        "delete task": 'DELETE /api/v1/accounts/<username>/tasks/<id>',
+        "bulk task operations": 'POST /api/v1/accounts/<username>/tasks/batch',
+        "export tasks": 'GET /api/v1/accounts/<username>/tasks/export?format=ndjson|csv',
+        "task counts": 'GET /api/v1/accounts/<username>/tasks/summary',
+        "search tasks": 'GET /api/v1/accounts/<username>/tasks/search?q=<words>'
     }
 
 
@@ -262,7 +274,7 @@ def test_user1_cannot_edit_user2_profile(testapp):
 def test_user_can_view_own_tasks(testapp):
     testapp.post('/api/v1/accounts/login', {'username': 'nhuntwalker', 'password': 'potato'})
     response = testapp.get('/api/v1/accounts/nhuntwalker/tasks')
-    profile = testapp.get('/api/v1/accounts/nhuntwalker')
+    profile = testapp.get('/api/v1/accounts/nhuntwalker', {'include': 'tasks'})
     for task in profile.json['tasks']:
         assert task in response.json['tasks']
     assert len(profile.json['tasks']) == len(response.json['tasks'])
@@ -355,3 +367,1322 @@ def test_users_can_delete_tasks(testapp):
 def test_users_cannot_delete_other_user_tasks(testapp):
     response = testapp.delete('/api/v1/accounts/barfoo/tasks/5000', status=403)
     assert response.json == {'error': 'You do not have permission to access this profile.'}
+
+
+def test_tasks_list_pages_through_every_task_once(testapp, task_owner):
+    """Following the next cursor visits each task exactly once."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    for sort in ['id', '-id', 'due_date', '-due_date', '-creation_date']:
+        seen = []
+        params = {'limit': 4, 'sort': sort}
+        while True:
+            page = testapp.get(url, params).json
+            assert len(page['tasks']) <= 4
+            seen.extend(task['id'] for task in page['tasks'])
+            if page['next'] is None:
+                break
+            params['cursor'] = page['next']
+        assert len(seen) == len(set(seen)) == 25
+
+
+def test_tasks_list_sorts_by_due_date_with_undated_tasks_last(testapp, task_owner):
+    """Sorting by due_date orders dated tasks first, then ties by id."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    tasks = testapp.get(url, {'sort': 'due_date'}).json['tasks']
+    due = [datetime.strptime(task['due_date'], DATE_FMT) for task in tasks if task['due_date']]
+    assert due == sorted(due)
+    assert all(task['due_date'] is None for task in tasks[len(due):])
+
+
+def test_tasks_list_filters_by_completed_and_due_window(testapp, task_owner):
+    """The completed, due_after and due_before parameters narrow the listing."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    done = testapp.get(url, {'completed': 'true'}).json['tasks']
+    assert len(done) == 9 and all(task['completed'] for task in done)
+    response = testapp.get(url, {
+        'due_after': '01/01/2018 00:00:00',
+        'due_before': '04/01/2018 00:00:00',
+    })
+    due_dates = {task['due_date'] for task in response.json['tasks']}
+    assert due_dates == {'02/01/2018 00:00:00'}
+
+
+def test_tasks_list_rejects_bad_paging_parameters(testapp, task_owner):
+    """Malformed limits, sort keys and cursors are a 400, not a 500."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    for params in [{'limit': 0}, {'limit': 'ten'}, {'sort': 'name'},
+                   {'cursor': 'garbage'}, {'completed': 'maybe'},
+                   {'due_before': '2018-01-01'}]:
+        response = testapp.get(url, params, status=400)
+        assert 'error' in response.json
+    cursor = testapp.get(url, {'limit': 1}).json['next']
+    testapp.get(url, {'limit': 1, 'sort': 'due_date', 'cursor': cursor}, status=400)
+    # well-formed cursors holding values of the wrong type
+    for sort, payload in [('due_date', ['due_date', 123, 1]), ('id', ['id', 'one', 1]),
+                          ('due_date', ['due_date', '2018', 1]), ('id', ['id', 1, True])]:
+        forged = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+        response = testapp.get(url, {'sort': sort, 'cursor': forged}, status=400)
+        assert response.json['error'] == 'Invalid cursor'
+
+
+def test_migratedb_adds_missing_indexes_to_existing_database(tmpdir):
+    """upgrade creates indexes missing from an old schema and is idempotent."""
+    from sqlalchemy import create_engine, inspect
+    from pyramid_todo.models.meta import Base
+    from pyramid_todo.scripts.migratedb import upgrade
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('old.sqlite')))
+    Base.metadata.create_all(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(engine)
+    engine.execute('DROP TABLE profiles')
+    engine.execute(
+        'CREATE TABLE profiles (id INTEGER PRIMARY KEY, username VARCHAR NOT NULL, '
+        'email VARCHAR NOT NULL, password VARCHAR NOT NULL, date_joined DATETIME NOT NULL)'
+    )
+    engine.execute(
+        "INSERT INTO profiles VALUES (1, 'nhuntwalker', 'n@h.com', 'x', '2010-01-01 00:00:00')"
+    )
+
+    added = upgrade(engine)
+    assert 'profiles.version' in added and 'profiles.modified' in added
+    assert engine.execute('SELECT version FROM profiles').scalar() == 0
+    assert 'ix_profiles_username' in added
+    assert 'ix_tasks_profile_id_completed_due_date' in added
+    indexes = {
+        index['name']: index for index in inspect(engine).get_indexes('profiles')
+    }
+    assert indexes['ix_profiles_username']['unique']
+    assert upgrade(engine) == []
+
+
+def test_migratedb_refuses_to_start_on_duplicate_usernames(tmpdir):
+    """Duplicates that would break the unique username index stop it before any change."""
+    from sqlalchemy import create_engine, inspect
+    from pyramid_todo.models.meta import Base
+    from pyramid_todo.scripts.migratedb import DuplicateValues, upgrade
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('old.sqlite')))
+    Base.metadata.create_all(engine)
+    engine.execute('DROP TABLE profiles')
+    engine.execute(
+        'CREATE TABLE profiles (id INTEGER PRIMARY KEY, username VARCHAR NOT NULL, '
+        'email VARCHAR NOT NULL, password VARCHAR NOT NULL, date_joined DATETIME NOT NULL)'
+    )
+    for profile_id, username in enumerate(['ann', 'bob', 'ann', 'cy', 'bob'], 1):
+        engine.execute("INSERT INTO profiles VALUES (?, ?, 'a@b.c', 'x', '2010-01-01 00:00:00')",
+                       (profile_id, username))
+
+    with pytest.raises(DuplicateValues, match="ix_profiles_username.*'ann', 'bob'"):
+        upgrade(engine)
+    assert 'version' not in {column['name'] for column in inspect(engine).get_columns('profiles')}
+
+    engine.execute("UPDATE profiles SET username = username || id WHERE id > 2")
+    assert 'ix_profiles_username' in upgrade(engine)
+
+
+def test_single_task_routes_use_at_most_a_few_statements(testapp, task_owner, query_budget):
+    """Detail, update and delete look the task up by id and owner in one query."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    task_id = testapp.get(url, {'limit': 1}).json['tasks'][0]['id']
+    task_url = '{}/{}'.format(url, task_id)
+
+    with query_budget(2):
+        testapp.get(task_url)
+
+    # writes also load the owner's profile by username, bump its
+    # version, see the conditional GET tests, and move the task counts on
+    # when completion or due date change
+    with query_budget(4):
+        response = testapp.put(task_url, {'name': 'Water the plants'})
+    assert response.json['task']['name'] == 'Water the plants'
+
+    with query_budget(6):
+        testapp.delete(task_url)
+    testapp.get(task_url, status=404)
+
+
+def test_single_task_routes_hide_tasks_owned_by_others(testapp, task_owner):
+    """A task id belonging to another profile is a 404 for every method."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    task_id = testapp.get(url, {'limit': 1}).json['tasks'][0]['id']
+    testapp.post('/api/v1/accounts', {
+        'username': 'nosy_neighbour',
+        'email': FAKE.email(),
+        'password': 'potato',
+        'password2': 'potato',
+    })
+    task_url = '/api/v1/accounts/nosy_neighbour/tasks/{}'.format(task_id)
+    testapp.get(task_url, status=404)
+    testapp.put(task_url, {'name': 'Mine now'}, status=404)
+    testapp.delete(task_url)
+    testapp.post('/api/v1/accounts/login', {'username': task_owner, 'password': 'potato'})
+    assert testapp.get('{}/{}'.format(url, task_id)).json['task']['id'] == task_id
+
+
+def test_task_batch_applies_operations_with_a_handful_of_statements(testapp, task_owner, statements):
+    """Updates and deletes in a batch share statements instead of one call each.
+
+    The task counts take two of them, one for the totals and one for all
+    the due days the batch touches, and three more here to add a due day
+    that had no tasks before: a lookup, an insert and the update again.
+    """
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    ids = [task['id'] for task in testapp.get(url).json['tasks']]
+    operations = [{'op': 'update', 'id': task_id, 'completed': True} for task_id in ids[:10]]
+    operations += [{'op': 'delete', 'id': task_id} for task_id in ids[10:15]]
+    operations += [
+        {'op': 'create', 'name': 'Buy milk', 'due_date': '01/02/2018 09:00:00'},
+        {'op': 'create', 'name': 'Buy eggs', 'note': 'a dozen'},
+    ]
+    del statements[:]
+    response = testapp.post_json(url + '/batch', {'operations': operations})
+    assert len(statements) <= 12
+
+    results = response.json['results']
+    assert [result['status'] for result in results] == [200] * 15 + [201, 201]
+    tasks = {task['id']: task for task in testapp.get(url).json['tasks']}
+    assert len(tasks) == 22
+    assert all(tasks[task_id]['completed'] for task_id in ids[:10])
+    assert tasks[results[-2]['id']]['due_date'] == '01/02/2018 09:00:00'
+    assert tasks[results[-1]['id']]['note'] == 'a dozen'
+
+
+def test_task_insert_of_mixed_rows_compiles_for_postgresql():
+    """Rows naming different columns still make one valid multi-row INSERT."""
+    from sqlalchemy.dialects import postgresql
+    from pyramid_todo.models.queries import task_insert_statement
+
+    now = datetime.now()
+    rows = [
+        {'name': 'Buy milk', 'due_date': now, 'completed': False, 'creation_date': now,
+         'profile_id': 1},
+        {'name': 'Buy eggs', 'note': 'a dozen', 'completed': True, 'creation_date': now,
+         'profile_id': 1},
+    ]
+    compiled = task_insert_statement(rows).compile(dialect=postgresql.dialect())
+    assert 'RETURNING tasks.id' in str(compiled)
+    assert compiled.params['note_m0'] is None and compiled.params['due_date_m1'] is None
+
+
+def test_task_batch_reports_bad_operations_individually(testapp, task_owner):
+    """Invalid or foreign operations get their own error without sinking the batch."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    response = testapp.post_json(url + '/batch', {'operations': [
+        {'op': 'create', 'name': ''},
+        {'op': 'update', 'id': 987654321, 'name': 'Not mine'},
+        {'op': 'delete', 'id': 'seven'},
+        {'op': 'archive', 'id': 1},
+        {'op': 'create', 'name': 'Still created', 'completed': 'yes'},
+    ]})
+    statuses = [result['status'] for result in response.json['results']]
+    assert statuses == [400, 404, 400, 400, 201]
+    created = testapp.get('{}/{}'.format(url, response.json['results'][-1]['id']))
+    assert created.json['task']['completed'] is True
+    testapp.post_json(url + '/batch', {'ops': []}, status=400)
+    testapp.post(url + '/batch', 'not json', status=400)
+
+
+def test_task_batch_refuses_to_touch_a_task_twice(testapp, task_owner):
+    """Kinds of operation run together, so a repeated id can't keep its order."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    task_id = testapp.get(url).json['tasks'][0]['id']
+    response = testapp.post_json(url + '/batch', {'operations': [
+        {'op': 'delete', 'id': task_id},
+        {'op': 'update', 'id': task_id, 'name': 'Back from the dead'},
+    ]}, status=400)
+    assert str(task_id) in response.json['error']
+    testapp.get('{}/{}'.format(url, task_id))
+
+
+def test_streaming_renderer_encodes_rows_in_bounded_chunks(testapp, task_owner):
+    """Stream values come out in several small chunks that join into valid JSON."""
+    from pyramid_todo.renderers import Stream, StreamingJSON
+    factory = testapp.app.registry["dbsession_factory"]
+    session = factory()
+    query = session.query(Task).join(Task.profile).filter(
+        Profile.username == task_owner
+    ).order_by(Task.id)
+    tasks = Stream(query, Task.to_dict, limit=20, batch_size=5)
+    value = {'tasks': tasks, 'more': lambda: tasks.truncated, 'owner': [task_owner]}
+
+    chunks = list(StreamingJSON(buffer_size=512).chunks(value, factory))
+    assert len(chunks) > 1
+    assert all(len(chunk) < 2048 for chunk in chunks)
+    assert json.loads(b''.join(chunks).decode('utf-8')) == {
+        'tasks': [task.to_dict() for task in query.limit(20)],
+        'more': True,
+        'owner': [task_owner],
+    }
+    session.close()
+
+
+def test_profile_detail_streams_every_task(testapp, task_owner):
+    """profile_detail returns the profile with all of its tasks when asked to."""
+    response = testapp.get('/api/v1/accounts/{}'.format(task_owner), {'include': 'tasks'})
+    assert response.content_type == 'application/json'
+    assert response.json['username'] == task_owner
+    assert len(response.json['tasks']) == 25
+
+
+def test_profile_routes_send_only_the_fields_asked_for(testapp, task_owner, query_budget):
+    """Profiles come without tasks unless included, and fields can be picked."""
+    url = '/api/v1/accounts/{}'.format(task_owner)
+    testapp.get(url)
+    with query_budget(1):
+        profile = testapp.get(url).json
+    assert sorted(profile) == ['date_joined', 'email', 'id', 'username']
+    with query_budget(2):
+        response = testapp.get(url, {'fields': 'email,task_count'})
+    assert response.json == {'email': profile['email'], 'task_count': 25}
+    assert testapp.get(url, {'fields': 'id', 'include': 'tasks'}).json['tasks'][0]['name'] == 'task 0'
+    testapp.get(url, {'fields': 'password'}, status=400)
+    testapp.get(url, {'include': 'notes'}, status=400)
+
+    response = testapp.put(url + '?fields=email', {'email': 'new@example.com'}, status=202)
+    assert response.json['profile'] == {'email': 'new@example.com'}
+
+
+def test_format_datetime_matches_strftime():
+    """The strftime-free date formatting produces the same strings."""
+    from pyramid_todo.serializers import format_datetime
+    dates = [FAKE.date_time() for _ in range(200)]
+    dates += [datetime(5, 1, 2, 3, 4, 5), datetime(2018, 12, 31, 23, 59, 59, 999999)]
+    for value in dates:
+        assert format_datetime(value) == value.strftime(DATE_FMT)
+
+
+def test_serializers_are_byte_identical_to_to_dict():
+    """Serialized tasks and profiles encode exactly like their to_dict output."""
+    from pyramid_todo.serializers import get_dumps, serialize_profile, serialize_task
+    profile = Profile(
+        id=3, username='nhuntwalker', email='n@example.com', password='x',
+        date_joined=datetime(2010, 1, 1, 9, 30)
+    )
+    for i in range(20):
+        Task(
+            id=i, name=FAKE.sentence(), note=FAKE.text() if i % 2 else None,
+            creation_date=FAKE.date_time(), due_date=FAKE.date_time() if i % 3 else None,
+            completed=bool(i % 4), profile_id=3, profile=profile
+        )
+    dumps = get_dumps('stdlib')
+    for task in profile.tasks:
+        assert dumps(serialize_task(task)) == json.dumps(task.to_dict())
+    assert dumps(serialize_profile(profile)) == json.dumps(profile.to_dict())
+    assert dumps(serialize_profile(profile, include_tasks=False)) == json.dumps(
+        profile.to_dict(include_tasks=False)
+    )
+
+
+def test_shipped_settings_encode_byte_identical_to_to_dict():
+    """Both ini files pick the encoder whose bytes match ``json.dumps``; orjson's don't."""
+    import os
+    from configparser import ConfigParser
+    from pyramid_todo.serializers import get_dumps, orjson, serialize_task
+    task = Task(
+        id=1, name='Café, crème brûlée', note='½ "price"', creation_date=datetime(2018, 1, 2, 3, 4, 5),
+        due_date=None, completed=True, profile_id=3
+    )
+    expected = json.dumps(task.to_dict())
+    here = os.path.dirname(os.path.dirname(__file__))
+    for name in ('development.ini', 'production.ini'):
+        config = ConfigParser()
+        config.read(os.path.join(here, name))
+        dumps = get_dumps(config.get('app:main', 'pyramid_todo.json_encoder'))
+        assert dumps(serialize_task(task)).encode('utf-8') == expected.encode('utf-8')
+    if orjson is not None:
+        compact = get_dumps('orjson')(serialize_task(task))
+        assert compact.encode('utf-8') != expected.encode('utf-8')
+        assert json.loads(compact) == json.loads(expected)
+
+
+def test_get_dumps_rejects_unknown_encoders():
+    """A misspelled json_encoder setting fails loudly at startup."""
+    from pyramid_todo.serializers import get_dumps
+    assert get_dumps('auto')({'a': [1, None]}).replace(' ', '') == '{"a":[1,null]}'
+    with pytest.raises(ValueError):
+        get_dumps('simplejson')
+
+
+def test_task_listing_answers_matching_etag_with_304(testapp, task_owner, statements):
+    """A poll with the current ETag gets a 304 from the profile lookup alone."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    first = testapp.get(url, {'limit': 5})
+    etag = first.headers['ETag']
+
+    del statements[:]
+    response = testapp.get(url, {'limit': 5}, headers={'If-None-Match': etag}, status=304)
+    assert response.body == b''
+    assert len(statements) == 1
+    other_page = testapp.get(url, {'limit': 6}, headers={'If-None-Match': etag})
+    assert other_page.headers['ETag'] != etag
+
+    testapp.post_json(url + '/batch', {'operations': [{'op': 'create', 'name': 'New'}]})
+    response = testapp.get(url, {'limit': 5}, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_task_detail_honours_if_modified_since(testapp, task_owner):
+    """Task detail checks If-Modified-Since against the profile's last write."""
+    from datetime import timedelta
+    engine = testapp.app.registry['dbsession_factory'].kw['bind']
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    task_id = testapp.get(url, {'limit': 1}).json['tasks'][0]['id']
+    task_url = '{}/{}'.format(url, task_id)
+    testapp.put(task_url, {'name': 'Renamed'})
+    # within the second of a write, a later one could carry the same date
+    assert 'Last-Modified' not in testapp.get(task_url).headers
+
+    profiles = Profile.__table__
+    with engine.begin() as connection:
+        connection.execute(profiles.update().where(profiles.c.username == task_owner).values(
+            modified=datetime.utcnow() - timedelta(seconds=2)
+        ))
+    response = testapp.get(task_url)
+    last_modified = response.headers['Last-Modified']
+    testapp.get(task_url, headers={'If-Modified-Since': last_modified}, status=304)
+    testapp.get(task_url, headers={'If-None-Match': response.headers['ETag']}, status=304)
+    testapp.get(task_url, headers={'If-None-Match': '"stale"'}, status=200)
+
+    testapp.put(task_url, {'name': 'Renamed again'})
+    testapp.get(task_url, headers={'If-Modified-Since': last_modified}, status=200)
+
+
+def test_last_modified_is_rounded_up_and_withheld_within_its_second():
+    """Two writes in one second can never share a Last-Modified date."""
+    from pyramid_todo.conditional import last_modified
+    profile = Profile(modified=datetime(2018, 1, 2, 3, 4, 5, 300000))
+    assert last_modified(profile, now=datetime(2018, 1, 2, 3, 4, 5, 700000)) is None
+    assert last_modified(profile, now=datetime(2018, 1, 2, 3, 4, 6)) is None
+    rounded = last_modified(profile, now=datetime(2018, 1, 2, 3, 4, 6, 1))
+    assert rounded.replace(tzinfo=None) == datetime(2018, 1, 2, 3, 4, 6)
+    # a later write lands in a later second
+    later = Profile(modified=datetime(2018, 1, 2, 3, 4, 6, 1))
+    assert last_modified(later, now=datetime(2018, 1, 2, 3, 4, 8)) > rounded
+    assert last_modified(Profile(modified=None)) is None
+
+
+def test_password_hasher_pool_hashes_and_verifies():
+    """Hashes made on the worker pool verify inline and vice versa."""
+    from pyramid_todo.security import PasswordHasher, hasher
+    pool = PasswordHasher(workers=1)
+    try:
+        hashed = pool.hash('potato')
+        assert hasher.verify('potato', hashed)
+        assert pool.verify('potato', hasher.hash('potato'))
+        assert not pool.verify('potahto', hashed)
+    finally:
+        pool.shutdown()
+
+
+def test_password_hasher_sheds_work_beyond_its_queue():
+    """A full queue or a slow job raises HasherBusy instead of waiting."""
+    import threading
+    import time
+    from pyramid_todo.security import HasherBusy, PasswordHasher, hasher
+    pool = PasswordHasher(workers=2, max_pending=1, timeout=0.2)
+    outcome = []
+    gave_up = threading.Event()
+
+    def sleep_in_pool():
+        try:
+            outcome.append(pool._run(time.sleep, 1))
+        except HasherBusy as error:
+            outcome.append(error)
+        finally:
+            gave_up.set()
+
+    try:
+        sleeper = threading.Thread(target=sleep_in_pool)
+        sleeper.start()
+        assert gave_up.wait(10)
+        assert isinstance(outcome[0], HasherBusy)
+        # the sleep still holds the only slot, though a worker is free
+        with pytest.raises(HasherBusy):
+            pool.verify('potato', 'not even a hash')
+        sleeper.join()
+    finally:
+        pool.shutdown()
+    # the slot came back once the sleep was done; a new pool takes a moment to start
+    pool.timeout = 10
+    try:
+        assert pool.verify('potato', hasher.hash('potato'))
+    finally:
+        pool.shutdown()
+
+
+def test_busy_hasher_turns_registration_into_503(testapp):
+    """When hashing times out the client is told to retry later."""
+    from pyramid_todo.security import PasswordHasher
+    registry = testapp.app.registry
+    original = registry['password_hasher']
+    registry['password_hasher'] = PasswordHasher(workers=1, timeout=0.0001)
+    try:
+        response = testapp.post('/api/v1/accounts', {
+            'username': 'impatient',
+            'email': FAKE.email(),
+            'password': 'potato',
+            'password2': 'potato',
+        }, status=503)
+    finally:
+        registry['password_hasher'].shutdown()
+        registry['password_hasher'] = original
+    assert response.headers['Retry-After'] == '1'
+    assert 'error' in response.json
+    testapp.post('/api/v1/accounts/login', {'username': 'impatient', 'password': 'potato'}, status=400)
+
+
+def test_lru_cache_evicts_least_recently_used_and_expired_entries():
+    """The cache stays within its size and forgets entries past their ttl."""
+    from pyramid_todo.cache import LRUCache
+    now = [0]
+    cache = LRUCache(2, ttl=10, clock=lambda: now[0])
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    now[0] = 11
+    assert cache.get('a') is None
+    assert len(cache) == 1
+    disabled = LRUCache(0)
+    disabled.set('a', 1)
+    assert disabled.get('a') is None
+
+
+def test_logged_in_profile_is_loaded_once_by_username(testapp, task_owner, statements):
+    """A request loads the logged-in profile's row once, in a single query."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    testapp.get(url, {'limit': 1})
+    del statements[:]
+    testapp.get(url, {'limit': 1})
+    profile_queries = [sql for sql in statements if 'FROM profiles' in sql]
+    assert len(profile_queries) == 1
+    assert 'WHERE profiles.username = ' in profile_queries[0]
+
+
+def test_renamed_profile_tickets_stop_working(testapp):
+    """A rename or delete ends the tickets issued for the old username."""
+    testapp.post('/api/v1/accounts', {
+        'username': 'shortlived',
+        'email': FAKE.email(),
+        'password': 'potato',
+        'password2': 'potato',
+    })
+    testapp.get('/api/v1/accounts/shortlived')
+    testapp.put('/api/v1/accounts/shortlived', {'username': 'longlived'}, status=202)
+    testapp.get('/api/v1/accounts/shortlived', status=403)
+    testapp.get('/api/v1/accounts/longlived', status=403)
+
+    testapp.post('/api/v1/accounts/login', {'username': 'longlived', 'password': 'potato'})
+    testapp.get('/api/v1/accounts/longlived')
+    testapp.delete('/api/v1/accounts/longlived', status=204)
+    testapp.get('/api/v1/accounts/longlived', status=403)
+
+
+def test_username_taken_over_after_a_rename_elsewhere_gets_no_old_tasks(testapp):
+    """A new account under a renamed profile's old username can't reach its tasks."""
+    from sqlalchemy import select
+    engine = testapp.app.registry['dbsession_factory'].kw['bind']
+    account = {'email': FAKE.email(), 'password': 'potato', 'password2': 'potato'}
+    testapp.post('/api/v1/accounts', dict(account, username='heirloom'))
+    url = '/api/v1/accounts/heirloom/tasks'
+    testapp.post(url, {'name': 'Old secret', 'note': '', 'due_date': '', 'completed': 'false'})
+    task_id = testapp.get(url).json['tasks'][0]['id']
+
+    # renamed by another process
+    with engine.begin() as connection:
+        connection.execute(
+            Profile.__table__.update().where(Profile.username == 'heirloom').values(username='heirless')
+        )
+    testapp.post('/api/v1/accounts', dict(account, username='heirloom', email=FAKE.email()))
+    task_url = '{}/{}'.format(url, task_id)
+    testapp.get(task_url, status=404)
+    testapp.put(task_url, {'name': 'Taken'}, status=404)
+    testapp.delete(task_url)
+    with engine.connect() as connection:
+        assert connection.execute(
+            select([Task.name]).where(Task.id == task_id)
+        ).scalar() == 'Old secret'
+
+
+def test_admission_tween_sheds_requests_over_a_route_budget():
+    """A second concurrent login is turned away; other routes are not limited."""
+    from pyramid.config import Configurator
+    from pyramid.response import Response
+    from pyramid_todo.admission import AdmissionControl, Overloaded, admission_tween_factory
+    config = Configurator()
+    config.include('pyramid_todo.routes')
+    config.commit()
+    control = config.registry['admission'] = AdmissionControl({'login': 1})
+    outcomes = []
+
+    def handler(request):
+        if request.path == '/api/v1/accounts/login' and not outcomes:
+            for path in ('/api/v1/accounts/login', '/api/v1'):
+                try:
+                    tween(testing.DummyRequest(path=path))
+                    outcomes.append('served')
+                except Overloaded:
+                    outcomes.append('shed')
+        return Response('ok')
+
+    tween = admission_tween_factory(handler, config.registry)
+    response = tween(testing.DummyRequest(path='/api/v1/accounts/login'))
+    assert outcomes == ['shed', 'served']
+    assert control.stats()['routes']['login'] == {
+        'limit': 1, 'in_flight': 1, 'waiting': 0, 'shed': 1
+    }
+    response.app_iter.close()
+    assert control.budgets['login'].in_flight == 0
+    assert response.content_length == 2
+
+
+def test_admission_control_sheds_requests_queued_too_long():
+    """An X-Request-Start older than max_queue_age means the client gave up."""
+    import time
+    from pyramid_todo.admission import AdmissionControl, request_start
+    control = AdmissionControl({}, max_queue_age=5)
+    stale = testing.DummyRequest(headers={'X-Request-Start': 't=%d' % ((time.time() - 10) * 1000)})
+    fresh = testing.DummyRequest(headers={'X-Request-Start': 't=%f' % time.time()})
+    assert abs(request_start(stale) - (time.time() - 10)) < 1
+    assert control.has_expired(stale)
+    assert not control.has_expired(fresh)
+    assert not control.has_expired(testing.DummyRequest())
+    assert control.stats()['expired'] == 1
+
+
+def test_get_engine_applies_pool_settings_where_they_fit():
+    """Queue-pooled databases get the pool options; SQLite files drop them."""
+    from pyramid_todo.models import TimedQueuePool, get_engine
+    settings = {
+        'sqlalchemy.pool_size': '3',
+        'sqlalchemy.max_overflow': '1',
+        'sqlalchemy.pool_recycle': '600',
+    }
+    engine = get_engine(dict(settings, **{'sqlalchemy.url': 'postgresql://todo@localhost/todo'}))
+    assert isinstance(engine.pool, TimedQueuePool)
+    assert engine.pool.size() == 3
+    assert engine.pool._recycle == 600
+    engine = get_engine(dict(settings, **{'sqlalchemy.url': 'sqlite:///unused.sqlite'}))
+    assert engine.pool._recycle == 600
+
+
+def test_timed_queue_pool_reports_checkouts_and_exhaustion(tmpdir):
+    """Warming opens connections up front; an exhausted pool is counted."""
+    from sqlalchemy import create_engine, exc
+    from pyramid_todo.models import TimedQueuePool, pool_stats, warm_pool
+    engine = create_engine(
+        'sqlite:///{}'.format(tmpdir.join('pool.sqlite')),
+        poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05
+    )
+    assert warm_pool(engine, 1) == 1
+    assert pool_stats(engine)['checked_in'] == 1
+    connection = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    stats = pool_stats(engine)
+    connection.close()
+    assert stats['checked_out'] == 1
+    assert stats['timeouts'] == 1
+    assert stats['checkouts'] == 3
+    assert stats['max_wait_seconds'] >= 0.05
+
+
+def test_status_route_reports_pool_and_admission_stats(testapp):
+    """The status route shows the live numbers to the clients let in."""
+    status = testapp.get('/api/v1/status', extra_environ=LOCAL).json
+    assert 'pool' in status['pool']
+    assert status['admission'] == {'routes': {}, 'expired': 0}
+
+
+def test_status_routes_are_hidden_from_clients_not_let_in(testapp):
+    """Other addresses, and forwarding headers naming an allowed one, get a 404."""
+    from pyramid_todo.views.status import allowed_networks
+    for url in ('/api/v1/status', '/metrics'):
+        testapp.get(url, extra_environ=LOCAL)
+        testapp.get(url, status=404)
+        testapp.get(url, extra_environ={'REMOTE_ADDR': '10.1.2.3'}, status=404)
+        testapp.get(url, headers={'X-Forwarded-For': '127.0.0.1'},
+                    extra_environ={'REMOTE_ADDR': '10.1.2.3'}, status=404)
+    assert allowed_networks('') == ()
+    assert allowed_networks('127.0.0.1 10.0.0.0/8') == (
+        ipaddress.ip_network('127.0.0.1/32'), ipaddress.ip_network('10.0.0.0/8'),
+    )
+    assert allowed_networks('*') is None
+
+
+def test_read_routes_stay_within_their_query_budgets(testapp, task_owner, query_budget):
+    """Listing and profile reads load the profile once and then stream tasks."""
+    url = '/api/v1/accounts/{}'.format(task_owner)
+    testapp.get(url + '/tasks')
+    # only the logged-in profile
+    with query_budget(1):
+        testapp.get('/api/v1')
+    with query_budget(2):
+        testapp.get(url + '/tasks')
+    with query_budget(1):
+        testapp.get(url)
+    with query_budget(2):
+        testapp.get(url, {'include': 'tasks'})
+
+
+def test_metrics_route_reports_latency_and_statements_per_route(testapp, task_owner):
+    """The Prometheus text has a latency histogram and SQL totals per route."""
+    testapp.get('/api/v1/accounts/{}/tasks'.format(task_owner))
+    testapp.get('/no/such/page', status=404)
+    response = testapp.get('/metrics', extra_environ=LOCAL)
+    assert response.content_type == 'text/plain'
+    samples = dict(
+        line.rsplit(' ', 1) for line in response.text.splitlines()
+        if not line.startswith('#')
+    )
+    labels = '{method="GET",route="tasks"}'
+    assert int(samples['pyramid_todo_request_duration_seconds_count' + labels]) >= 1
+    assert int(samples['pyramid_todo_db_statements_total' + labels]) >= 2
+    assert float(samples['pyramid_todo_db_duration_seconds_total' + labels]) > 0
+    assert int(samples['pyramid_todo_responses_total{method="GET",route="unmatched",status="404"}']) >= 1
+
+
+def test_server_timing_header_reports_statements_and_time():
+    """With server_timing on, responses say how long they took and why."""
+    from pyramid.config import Configurator
+    from pyramid.response import Response
+    from pyramid_todo.metrics import Metrics, metrics_tween_factory
+    config = Configurator(settings={'pyramid_todo.server_timing': 'true'})
+    config.registry['metrics'] = Metrics()
+    tween = metrics_tween_factory(lambda request: Response('ok'), config.registry)
+    response = tween(testing.DummyRequest(method='GET'))
+    assert response.headers['Server-Timing'].startswith('app;dur=')
+    assert 'desc="0 statements"' in response.headers['Server-Timing']
+    response.app_iter.close()
+    assert config.registry['metrics'].snapshot()['responses'] == {('unmatched', 'GET', 200): 1}
+
+
+def test_task_create_rejects_unreadable_completed_flag(testapp, task_owner):
+    """completed is read as a boolean rather than stored as it was sent."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    task = {'name': 'Dust', 'note': '', 'due_date': '', 'completed': 'maybe'}
+    response = testapp.post(url, task, status=400)
+    assert response.json == {'error': 'completed must be true or false'}
+    testapp.post(url, dict(task, completed='False'), status=201)
+
+
+def test_iter_records_streams_json_arrays_and_ndjson_across_reads():
+    """Records split over several small reads still come out whole and in order."""
+    import io
+    from pyramid_todo.scripts.importtasks import iter_records
+    records = [{'title': 'task {}'.format(i), 'note': 'x' * i} for i in range(20)]
+    as_array = json.dumps(records, indent=2)
+    as_lines = '\n'.join(json.dumps(record) for record in records) + '\n'
+    for text in (as_array, as_lines, '  ' + as_array):
+        assert list(iter_records(io.StringIO(text), read_size=7)) == records
+    assert list(iter_records(io.StringIO('[]'))) == []
+
+
+def test_iter_records_gives_up_on_a_malformed_record_with_its_number():
+    """A bad record is reported without reading the rest of the file."""
+    import io
+    from pyramid_todo.scripts.importtasks import BadRecord, iter_records
+    text = '{"title": "fine"}\n{"title": oops}\n' + '{"title": "later"}\n' * 1000
+    stream = io.StringIO(text)
+    records = iter_records(stream, read_size=64, max_record_size=256)
+    assert next(records) == {'title': 'fine'}
+    with pytest.raises(BadRecord, match='record 2: not valid JSON within 256 characters'):
+        next(records)
+    assert stream.tell() < 1024
+    with pytest.raises(BadRecord, match='record 3: '):
+        list(iter_records(io.StringIO('[{"a": 1}, {"b": 2}, {"c": ]')))
+
+
+def test_import_tasks_in_batches_and_resume_after_a_bad_record(tmpdir):
+    """Batches before a bad record stay in; a resumed run adds just the rest."""
+    from sqlalchemy import create_engine
+    from pyramid_todo.models.meta import Base
+    from pyramid_todo.scripts.importtasks import BadRecord, import_tasks
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('import.sqlite')))
+    Base.metadata.create_all(engine)
+    engine.execute(Profile.__table__.insert(), [
+        {'username': name, 'email': name, 'password': 'x', 'date_joined': datetime(2018, 1, 1)}
+        for name in ('ada', 'bob')
+    ])
+    records = [
+        {'title': 'one', 'creation_date': '1/30/2018 1:00:00 pm'},
+        {'title': 'two', 'username': 'bob'},
+        {'title': 'three', 'due_date': 'someday'},
+        {'title': 'four', 'completed': True},
+        {'title': 'five'},
+    ]
+    done = []
+    with pytest.raises(BadRecord) as error:
+        import_tasks(engine, iter(records), username='ada', batch_size=2, progress=done.append)
+    assert 'record 3' in str(error.value)
+    assert done == [2]
+
+    records[2]['due_date'] = '2/3/2018 9:30:00 am'
+    assert import_tasks(engine, iter(records), username='ada', batch_size=2,
+                        skip=done[-1], progress=done.append) == 5
+    assert done == [2, 4, 5]
+    rows = engine.execute('SELECT name, profile_id FROM tasks ORDER BY id').fetchall()
+    assert [tuple(row) for row in rows] == [
+        ('one', 1), ('two', 2), ('three', 1), ('four', 1), ('five', 1)
+    ]
+    assert engine.execute("SELECT creation_date FROM tasks WHERE name = 'one'").scalar().startswith(
+        '2018-01-30 13:00:00'
+    )
+    assert engine.execute('SELECT version FROM profiles WHERE id = 1').scalar() == 3
+
+
+def test_task_export_streams_every_task_as_ndjson_or_csv(testapp, task_owner):
+    """Exports hold all of the user's tasks, in id order, in either format."""
+    import csv
+    import io
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    listed = testapp.get(url, {'limit': 100}).json['tasks']
+
+    response = testapp.get(url + '/export')
+    assert response.content_type == 'application/x-ndjson'
+    assert [json.loads(line) for line in response.text.splitlines()] == listed
+
+    response = testapp.get(url + '/export', {'format': 'csv'})
+    assert response.content_type == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(row['id']) for row in rows] == [task['id'] for task in listed]
+    assert rows[0]['completed'] in ('true', 'false')
+
+    testapp.get(url + '/export', {'format': 'xml'}, status=400)
+    testapp.get('/api/v1/accounts/nobody_at_all/tasks/export', status=404)
+
+
+def test_task_export_reads_a_page_per_session(testapp, task_owner):
+    """Each page of the export is read in its own short-lived session."""
+    from pyramid_todo.export import task_pages
+    session_factory = testapp.app.registry['dbsession_factory']
+    profile_id = session_factory().query(Profile.id).filter(
+        Profile.username == task_owner
+    ).scalar()
+    opened = []
+
+    def counting_factory():
+        session = session_factory()
+        opened.append(session)
+        return session
+
+    pages = list(task_pages(counting_factory, profile_id, batch_size=10))
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert len(opened) == 3
+    ids = [row.id for page in pages for row in page]
+    assert ids == sorted(ids)
+
+
+def test_runner_settings_prefer_the_environment_to_the_ini_file():
+    """WEB_CONCURRENCY and WEB_THREADS override the prefork settings."""
+    from pyramid_todo.prefork import runner_settings
+    settings = {'pyramid_todo.workers': '3', 'pyramid_todo.threads': '6',
+                'pyramid_todo.graceful_timeout': '5'}
+    assert runner_settings(settings, {}) == (3, 6, 5.0)
+    assert runner_settings(settings, {'WEB_CONCURRENCY': '8', 'WEB_THREADS': '2'}) == (8, 2, 5.0)
+    workers, threads, timeout = runner_settings({'pyramid_todo.workers': ''}, {})
+    assert workers >= 1 and threads == 4 and timeout == 30.0
+
+
+def idle_worker(config_uri, sock, threads, ready, graceful_timeout, options=None):
+    """Stand in for serve_worker: report ready, then wait to be stopped."""
+    import os
+    import signal
+    import time
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.write(ready, b'.')
+    os.close(ready)
+    while True:
+        time.sleep(1)
+
+
+def failing_worker(config_uri, sock, threads, ready, graceful_timeout, options=None):
+    """Stand in for serve_worker: fail to load the app."""
+    from pyramid_todo.prefork import BOOT_ERROR
+    return BOOT_ERROR
+
+
+def reap_until(arbiter, done, timeout=10):
+    """Reap the arbiter's workers until ``done()``; return those that died."""
+    import time
+    died = []
+    deadline = time.monotonic() + timeout
+    while not done():
+        assert time.monotonic() < deadline
+        died.extend(arbiter.reap())
+        time.sleep(0.05)
+    return died
+
+
+def test_arbiter_starts_workers_and_reaps_the_ones_that_die(monkeypatch):
+    """Workers report ready; one that dies is reaped and stop() ends the rest."""
+    import os
+    import signal
+    from pyramid_todo import prefork
+    monkeypatch.setattr(prefork, 'serve_worker', idle_worker)
+    arbiter = prefork.Arbiter('unused.ini', None, workers=2, threads=1, graceful_timeout=1)
+    try:
+        pids = [arbiter.spawn() for _ in range(2)]
+        assert all(arbiter.wait_ready(pid) for pid in pids)
+        assert arbiter.reap() == []
+
+        os.kill(pids[0], signal.SIGKILL)
+        died = reap_until(arbiter, lambda: pids[0] not in arbiter.workers)
+        assert len(died) == 1
+        assert list(arbiter.workers) == [pids[1]]
+    finally:
+        arbiter.stop()
+    assert arbiter.workers == {} and arbiter.retiring == {}
+
+
+def test_arbiter_reloads_workers_one_by_one(monkeypatch):
+    """A reload replaces every worker, unless a replacement fails to start."""
+    from pyramid_todo import prefork
+    monkeypatch.setattr(prefork, 'serve_worker', idle_worker)
+    arbiter = prefork.Arbiter('unused.ini', None, workers=2, threads=1, graceful_timeout=1)
+    try:
+        old = [arbiter.spawn() for _ in range(2)]
+        assert all(arbiter.wait_ready(pid) for pid in old)
+
+        arbiter.reload()
+        assert len(arbiter.workers) == 2
+        assert not set(old) & set(arbiter.workers)
+        assert set(arbiter.retiring) == set(old)
+        assert reap_until(arbiter, lambda: not arbiter.retiring) == []
+
+        current = set(arbiter.workers)
+        monkeypatch.setattr(prefork, 'serve_worker', failing_worker)
+        arbiter.reload()
+        assert set(arbiter.workers) == current
+        reap_until(arbiter, lambda: not arbiter.retiring)
+        assert set(arbiter.workers) == current
+    finally:
+        arbiter.stop()
+    assert arbiter.workers == {} and arbiter.retiring == {}
+
+
+def test_prefork_worker_serves_the_app_and_stops_on_sigterm(tmpdir):
+    """A real worker answers on the shared socket and exits 0 when stopped."""
+    import os
+    from urllib.request import urlopen
+    from pyramid_todo.prefork import Arbiter, bind_socket
+    config = tmpdir.join('prefork.ini')
+    config.write('[app:main]\nuse = call:pyramid_todo.conftest:main\n')
+    sock = bind_socket('127.0.0.1', 0)
+    arbiter = Arbiter(str(config), sock, workers=1, threads=2, graceful_timeout=5)
+    try:
+        pid = arbiter.spawn()
+        assert arbiter.wait_ready(pid)
+        url = 'http://127.0.0.1:{}/api/v1'.format(sock.getsockname()[1])
+        with urlopen(url, timeout=10) as response:
+            assert response.status == 200
+            assert b'"info"' in response.read()
+
+        arbiter.retire(pid)
+        _, status = os.waitpid(pid, 0)
+        arbiter.retiring.pop(pid)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    finally:
+        arbiter.stop()
+        sock.close()
+
+
+def test_reads_go_to_a_replica_except_just_after_a_write(testapp, tmpdir):
+    """GETs read from the replica unless the client has just written."""
+    from sqlalchemy import create_engine
+    from webtest import TestApp
+    from pyramid_todo.conftest import main
+    from pyramid_todo.models import STICKY_COOKIE
+    from pyramid_todo.models.meta import Base
+    replica = create_engine('sqlite:///{}'.format(tmpdir.join('replica.sqlite')))
+    Base.metadata.create_all(replica)
+    app = TestApp(main({}, **{'pyramid_todo.replica_urls': str(replica.url)}))
+    username = 'replicated_{}'.format(FAKE.uuid4()[:8])
+    response = app.post('/api/v1/accounts', {
+        'username': username, 'email': FAKE.email(),
+        'password': 'potato', 'password2': 'potato',
+    })
+    assert STICKY_COOKIE in response.headers['Set-Cookie']
+
+    # stand in for replication, with a task that only the replica has
+    primary = app.app.registry['dbsession_factory'].kw['bind']
+    row = primary.execute(
+        Profile.__table__.select().where(Profile.username == username)
+    ).first()
+    replica.execute(Profile.__table__.insert(), dict(row))
+    replica.execute(Task.__table__.insert(), {
+        'name': 'only on the replica', 'creation_date': datetime(2018, 1, 1),
+        'completed': False, 'profile_id': row.id,
+    })
+
+    url = '/api/v1/accounts/{}/tasks'.format(username)
+    assert app.get(url).json['tasks'] == []
+    for cookie in list(app.cookiejar):
+        if cookie.name == STICKY_COOKIE:
+            app.cookiejar.clear(cookie.domain, cookie.path, cookie.name)
+    assert [task['name'] for task in app.get(url).json['tasks']] == ['only on the replica']
+
+    app.post(url, {'name': 'Fresh', 'note': '', 'due_date': '', 'completed': 'false'})
+    assert [task['name'] for task in app.get(url).json['tasks']] == ['Fresh']
+
+
+def test_task_summary_counts_follow_every_kind_of_write(testapp, task_owner):
+    """The counts kept by the write routes match what the tasks say."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    # task_owner has 25 tasks: 9 completed, and 8 open ones due in January 2018
+    assert testapp.get(url + '/summary').json == {
+        'username': task_owner, 'open': 16, 'completed': 9, 'overdue': 8,
+    }
+    testapp.post(url, {'name': 'Later', 'note': '', 'due_date': '01/01/2999 00:00:00',
+                       'completed': 'false'})
+    tasks = testapp.get(url).json['tasks']
+    overdue = [task for task in tasks if task['due_date'] and not task['completed']]
+    testapp.put('{}/{}'.format(url, overdue[0]['id']), {'completed': 'true'})
+    testapp.delete('{}/{}'.format(url, overdue[1]['id']))
+    testapp.post_json(url + '/batch', {'operations': [
+        {'op': 'update', 'id': overdue[2]['id'], 'due_date': ''},
+        {'op': 'delete', 'id': overdue[3]['id']},
+        {'op': 'create', 'name': 'Late', 'due_date': '01/01/2000 00:00:00'},
+    ]})
+    assert testapp.get(url + '/summary').json == {
+        'username': task_owner, 'open': 15, 'completed': 10, 'overdue': 5,
+    }
+    testapp.put('{}/{}'.format(url, overdue[4]['id']), {'completed': 'maybe'}, status=400)
+
+
+def test_first_count_writes_racing_for_one_row_both_count(tmpdir):
+    """A counter row created by someone else after our UPDATE missed it is added to."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.dialects import postgresql
+    from pyramid_todo.models import TaskCounter, TaskDueCounter, adjust_task_counts
+    from pyramid_todo.models.queries import _insert_counts
+
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('counts.sqlite')))
+    TaskCounter.__table__.create(engine)
+    TaskDueCounter.__table__.create(engine)
+    counters = TaskCounter.__table__
+
+    class Racing(object):
+        """A connection whose first UPDATE another writer follows with an INSERT."""
+
+        def __init__(self, connection):
+            self.connection = connection
+            self.dialect = connection.dialect
+            self.raced = False
+
+        def execute(self, statement, *args):
+            result = self.connection.execute(statement, *args)
+            if not self.raced and statement.is_update:
+                self.raced = True
+                self.connection.execute(counters.insert(), {'profile_id': 7, 'open': 1})
+            return result
+
+    with engine.begin() as connection:
+        adjust_task_counts(Racing(connection), 7, added=[(False, None), (True, None)])
+        assert connection.execute(counters.select()).fetchall() == [(7, 2, 1)]
+
+    # PostgreSQL adds to the conflicting row in the INSERT itself
+    captured = []
+
+    class Capturing(object):
+        dialect = postgresql.dialect()
+
+        def execute(self, statement, *args):
+            captured.append(str(statement.compile(dialect=self.dialect)))
+
+    _insert_counts(Capturing(), Capturing.dialect, counters, ['profile_id'], ['open'],
+                   [{'profile_id': 7, 'open': 1}], None, None)
+    assert 'ON CONFLICT (profile_id) DO UPDATE SET open = (task_counters.open + excluded.open)' \
+        in captured[0]
+
+
+def test_recount_tasks_repairs_drifted_counts(testapp, task_owner):
+    """Rebuilding puts back counts that no longer match the tasks."""
+    from pyramid_todo.models import TaskCounter, TaskDueCounter
+    from pyramid_todo.scripts.recounttasks import rebuild_task_counts
+    engine = testapp.app.registry['dbsession_factory'].kw['bind']
+    url = '/api/v1/accounts/{}/tasks/summary'.format(task_owner)
+    expected = testapp.get(url).json
+    assert rebuild_task_counts(engine, [task_owner]) == []
+
+    engine.execute(TaskCounter.__table__.update().values(open=0, completed=100))
+    engine.execute(TaskDueCounter.__table__.delete())
+    assert testapp.get(url).json != expected
+    assert task_owner in rebuild_task_counts(engine)
+    assert testapp.get(url).json == expected
+
+
+def test_task_search_ranks_matches_and_follows_writes(testapp, task_owner, query_budget):
+    """Search is stemmed, ranked by name first, scoped to the owner and kept in sync."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    testapp.post_json(url + '/batch', {'operations': [
+        {'op': 'create', 'name': 'Water the plants', 'note': 'the ferns too'},
+        {'op': 'create', 'name': 'Buy soil', 'note': 'for planting the fern'},
+        {'op': 'create', 'name': 'Call mum'},
+    ]})
+    with query_budget(2):
+        response = testapp.get(url + '/search', {'q': 'ferns plant'})
+    assert [task['name'] for task in response.json['tasks']] == ['Water the plants', 'Buy soil']
+
+    water = response.json['tasks'][0]['id']
+    testapp.put('{}/{}'.format(url, water), {'name': 'Water the lawn', 'note': ''})
+    names = [task['name'] for task in testapp.get(url + '/search', {'q': 'fern'}).json['tasks']]
+    assert names == ['Buy soil']
+    testapp.delete('{}/{}'.format(url, response.json['tasks'][1]['id']))
+    assert testapp.get(url + '/search', {'q': 'fern'}).json['tasks'] == []
+    assert testapp.get(url + '/search', {'q': '"lawn'}).json['tasks'][0]['id'] == water
+    testapp.get(url + '/search', {'q': ' '}, status=400)
+    # the words never match the owner the index files each task under
+    profile_id = testapp.get('/api/v1/accounts/{}'.format(task_owner)).json['id']
+    assert testapp.get(url + '/search', {'q': 'p{}'.format(profile_id)}).json['tasks'] == []
+
+    testapp.post('/api/v1/accounts', {
+        'username': 'searcher_{}'.format(FAKE.uuid4()[:8]), 'email': FAKE.email(),
+        'password': 'potato', 'password2': 'potato',
+    })
+    testapp.get(url + '/search', {'q': 'lawn'}, status=403)
+
+
+def test_migratedb_builds_the_search_index_for_existing_tasks(tmpdir):
+    """An index added to an old database already finds the tasks it had."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from pyramid_todo.models import search_query
+    from pyramid_todo.models.meta import Base
+    from pyramid_todo.scripts.migratedb import upgrade
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('old.sqlite')))
+    Base.metadata.create_all(engine)
+    for statement in ('DROP TABLE tasks_fts', 'DROP VIEW tasks_search_source',
+                      'DROP TRIGGER tasks_search_insert', 'DROP TRIGGER tasks_search_delete',
+                      'DROP TRIGGER tasks_search_update'):
+        engine.execute(statement)
+    engine.execute(Task.__table__.insert(), {
+        'name': 'Sweep the porch', 'creation_date': datetime(2018, 1, 1), 'profile_id': 1,
+    })
+    assert upgrade(engine) == ['tasks search index']
+    session = Session(bind=engine)
+    assert [task.name for task in search_query(session, [Task], 1, 'porch', 10)] == ['Sweep the porch']
+    assert upgrade(engine) == []
+
+
+def test_postgresql_search_uses_the_indexed_expression():
+    """The query spells out the index expression, with the owner cast to text."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from pyramid_todo.models import search_query
+    from pyramid_todo.models.search import PG_CREATE, PG_DOCUMENT
+    engine = create_engine('postgresql://todo@localhost/todo')
+    query = search_query(Session(bind=engine), [Task.id], 1, 'porch', 10)
+    compiled = str(query.statement.compile(dialect=engine.dialect))
+    assert "'owner' || profile_id::text" in PG_DOCUMENT
+    assert '(({}))'.format(PG_DOCUMENT) in PG_CREATE[0]
+    assert '({}) @@'.format(PG_DOCUMENT) in compiled
+
+
+def test_reminders_go_out_once_as_due_dates_are_written(testapp, task_owner):
+    """Each open task in the window gets one reminder, whichever way it was written."""
+    from datetime import timedelta
+    from pyramid_todo.reminders import ReminderLog, ReminderScheduler, changed_profile_ids
+    engine = testapp.app.registry['dbsession_factory'].kw['bind']
+    sent = ReminderLog()
+    scheduler = ReminderScheduler(
+        engine, sent, lead=15 * 60, window=3600, clock=lambda: datetime(2018, 1, 1, 23, 50)
+    )
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    tasks = {task['name']: task for task in testapp.get(url).json['tasks']}
+    owner_id = tasks['task 1']['profile_id']
+
+    def names(reminders):
+        return [reminder.name for reminder in reminders if reminder.profile_id == owner_id]
+
+    # task_owner's open tasks 1, 5, 13 and 17 are due at midnight on January 2nd
+    scheduler.extend()
+    testapp.app.registry['reminders'] = scheduler
+    try:
+        testapp.post(url, {'name': 'Soon', 'note': '', 'due_date': '02/01/2018 00:05:00',
+                           'completed': 'false'})
+        testapp.put('{}/{}'.format(url, tasks['task 1']['id']), {'completed': 'true'})
+        testapp.put('{}/{}'.format(url, tasks['task 5']['id']), {'due_date': '01/03/2018 00:00:00'})
+        testapp.put('{}/{}'.format(url, tasks['task 7']['id']), {'due_date': '02/01/2018 00:10:00'})
+        testapp.delete('{}/{}'.format(url, tasks['task 13']['id']))
+    finally:
+        testapp.app.registry['reminders'] = None
+    # written where the scheduler cannot hear of it, and caught on reading back
+    testapp.put('{}/{}'.format(url, tasks['task 17']['id']), {'completed': 'true'})
+
+    assert names(scheduler.run_pending(datetime(2018, 1, 1, 23, 56))) == ['Soon', 'task 7']
+    assert names(scheduler.run_pending(datetime(2018, 1, 1, 23, 59))) == []
+    assert names(sent) == ['Soon', 'task 7']
+
+    # the remindtasks script picks up writes by the profiles they touched
+    testapp.put('{}/{}'.format(url, tasks['task 11']['id']), {'due_date': '02/01/2018 00:20:00'})
+    with engine.connect() as connection:
+        changed = changed_profile_ids(connection, datetime.utcnow() - timedelta(minutes=1))
+    assert owner_id in changed
+    scheduler.refresh(changed)
+    assert names(scheduler.run_pending(datetime(2018, 1, 2, 0, 6))) == ['task 11']
+    assert names(sent) == ['Soon', 'task 7', 'task 11']
+
+
+def test_choose_encoding_follows_the_clients_q_values():
+    """The best-ranked coding wins, the server's order breaking ties."""
+    from pyramid_todo.compression import choose_encoding
+    assert choose_encoding('gzip, deflate, br', ('br', 'gzip')) == 'br'
+    assert choose_encoding('br;q=0.5, gzip', ('br', 'gzip')) == 'gzip'
+    assert choose_encoding('*', ('br', 'gzip')) == 'br'
+    assert choose_encoding('gzip;q=0, identity', ('br', 'gzip')) is None
+    assert choose_encoding('', ('br', 'gzip')) is None
+
+
+def test_large_responses_are_compressed_for_clients_that_accept_it(testapp, task_owner):
+    """Streamed listings come compressed, small bodies as they are, both cacheable."""
+    import gzip
+    from webob import Request
+    from pyramid_todo.compression import brotli
+
+    def get(path, **headers):
+        # straight to the app, since webtest decodes gzip bodies itself
+        headers['Cookie'] = '; '.join('{}={}'.format(c.name, c.value) for c in testapp.cookiejar)
+        return Request.blank(path, headers=headers).get_response(testapp.app)
+
+    url = '/api/v1/accounts/{}'.format(task_owner)
+    plain = get(url + '/tasks')
+    assert plain.content_encoding is None
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+
+    response = get(url + '/tasks', **{'Accept-Encoding': 'gzip, br;q=0.5'})
+    assert response.content_encoding == 'gzip'
+    assert gzip.decompress(response.body) == plain.body
+    assert response.headers['ETag'] == 'W/' + plain.headers['ETag']
+    not_modified = get(url + '/tasks', **{
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag'],
+    })
+    assert not_modified.status_int == 304
+    assert not_modified.headers['ETag'] == response.headers['ETag']
+    assert not_modified.headers['Vary'] == 'Accept-Encoding'
+    if brotli is not None:
+        response = get(url + '/tasks', **{'Accept-Encoding': 'gzip, br'})
+        assert response.content_encoding == 'br'
+        assert brotli.decompress(response.body) == plain.body
+
+    small = get(url + '?fields=id', **{'Accept-Encoding': 'gzip'})
+    assert small.content_encoding is None and 'Vary' not in small.headers
+    assert small.json['id']
+
+
+def test_built_assets_are_served_precompressed_and_immutable(tmpdir):
+    """Built names carry a content hash; the view picks the coding the client takes."""
+    import gzip
+    from pyramid import testing
+    from pyramid_todo.assets import IMMUTABLE, AssetView, build_assets
+
+    source = tmpdir.mkdir('static')
+    source.join('theme.css').write('body { color: black; }\n' * 100)
+    source.join('logo.png').write_binary(b'\x89PNG' + bytes(range(256)))
+    manifest = build_assets(str(source), str(source.join('build')))
+    assert sorted(manifest) == ['logo.png', 'theme.css']
+    css = manifest['theme.css']
+    assert css.startswith('build/theme.') and css.endswith('.css') and css != 'build/theme.css'
+    assert source.join(css + '.gz').check()
+    assert not source.join(manifest['logo.png'] + '.gz').check()
+    assert build_assets(str(source), str(source.join('build'))) == manifest
+
+    view = AssetView(str(source.join('build')))
+
+    def get(name, **headers):
+        request = testing.DummyRequest(headers=headers)
+        request.matchdict = {'subpath': tuple(name.split('/')[1:])}
+        return view(request)
+
+    response = get(css, **{'Accept-Encoding': 'gzip'})
+    assert response.content_encoding == 'gzip'
+    assert response.headers['Cache-Control'] == IMMUTABLE
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(b''.join(response.app_iter)) == source.join('theme.css').read_binary()
+    plain = get(css)
+    assert plain.content_encoding is None and plain.content_type == 'text/css'
+    image = get(manifest['logo.png'], **{'Accept-Encoding': 'gzip'})
+    assert image.content_encoding is None and 'Vary' not in image.headers
+    with pytest.raises(HTTPNotFound):
+        get('build/theme.css')
+
+
+def test_cors_preflight_is_answered_without_touching_the_database(testapp, task_owner, query_budget):
+    """Preflights get a cacheable answer from the tween; real calls get the allow headers."""
+    url = '/api/v1/accounts/{}/tasks'.format(task_owner)
+    with query_budget(0):
+        response = testapp.options(url, headers={
+            'Origin': 'https://app.example.com',
+            'Access-Control-Request-Method': 'PUT',
+            'Access-Control-Request-Headers': 'content-type',
+        }, status=204)
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    assert 'PUT' in response.headers['Access-Control-Allow-Methods']
+    assert response.headers['Access-Control-Max-Age'] == '7200'
+
+    response = testapp.get(url, headers={'Origin': 'https://app.example.com'})
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    assert 'ETag' in response.headers['Access-Control-Expose-Headers']
+    assert 'Access-Control-Allow-Origin' not in testapp.get(url).headers
+
+
+def test_cors_with_listed_origins_answers_only_those():
+    from pyramid.exceptions import ConfigurationError
+    from pyramid.response import Response
+    from pyramid_todo.cors import Cors
+
+    cors = Cors(['https://app.example.com'], max_age=600, credentials=True)
+    allowed = cors.preflight('https://app.example.com')
+    assert allowed.status_int == 204
+    assert allowed.headers['Access-Control-Allow-Origin'] == 'https://app.example.com'
+    assert allowed.headers['Access-Control-Allow-Credentials'] == 'true'
+    assert allowed.headers['Vary'] == 'Origin'
+    assert cors.preflight('https://evil.example.com').status_int == 403
+
+    response = cors.add_headers('https://evil.example.com', Response(vary=('Accept-Encoding',)))
+    assert 'Access-Control-Allow-Origin' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding, Origin'
+    with pytest.raises(ConfigurationError):
+        Cors(['*'], credentials=True)
+
+
+def test_auth_ticket_cache_skips_verification_until_expiry_or_forget():
+    """Verified tickets are reused; bad ones are not cached, expired ones not reused."""
+    from pyramid import testing
+    from pyramid_todo.cache import LRUCache
+    from pyramid_todo.security import CachingAuthTktAuthenticationPolicy
+
+    now = [0.0]
+    cache = LRUCache(10, ttl=300, clock=lambda: now[0])
+    policy = CachingAuthTktAuthenticationPolicy('secret', cache, hashalg='sha512', timeout=60)
+    cookie = policy.remember(testing.DummyRequest(), 'alice')[0][1]
+    ticket = cookie.split(';')[0].split('=', 1)[1].strip('"')
+
+    def request(value=ticket):
+        return testing.DummyRequest(cookies={'auth_tkt': value})
+
+    assert policy.unauthenticated_userid(request()) == 'alice'
+    assert policy.unauthenticated_userid(request()) == 'alice'
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert policy.unauthenticated_userid(request('x' + ticket[1:])) is None
+    assert len(cache) == 1
+
+    # the entry lasts no longer than the ticket's timeout, then it is verified again
+    now[0] = 61
+    policy.unauthenticated_userid(request())
+    assert cache.misses == 3
+
+    policy.forget(request())
+    assert len(cache) == 0
+
+
+def test_status_route_reports_cache_hits_and_misses(testapp, task_owner):
+    testapp.get('/api/v1/accounts/{}'.format(task_owner))
+    caches = testapp.get('/api/v1/status', extra_environ=LOCAL).json['caches']
+    assert caches['auth_ticket']['hits'] + caches['auth_ticket']['misses'] > 0
+    assert 'pyramid_todo_cache_hits_total{cache="auth_ticket"}' in \
+        testapp.get('/metrics', extra_environ=LOCAL).text
@@ -0,0 +1,12 @@
+from pyramid.view import view_config
+
+from pyramid_todo.admission import Overloaded
+from pyramid_todo.security import HasherBusy
+
+
+@view_config(context=Overloaded, renderer='json')
+@view_config(context=HasherBusy, renderer='json')
+def busy_view(request):
+    request.response.status = 503
+    request.response.headers['Retry-After'] = '1'
+    return {'error': 'The server is busy, please try again shortly.'}
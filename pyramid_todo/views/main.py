@@ -1,14 +1,55 @@
 """View functions."""
+from collections import Counter
 from datetime import datetime
 
-from passlib.hash import pbkdf2_sha256 as hasher
 from pyramid.security import NO_PERMISSION_REQUIRED, remember, forget
 from pyramid.view import view_config
-
-from pyramid_todo.models import Task, Profile
+from zope.sqlalchemy import mark_changed
+
+from pyramid_todo.models import (
+    Task,
+    Profile,
+    adjust_task_counts,
+    bump_version,
+    delete_task_counts,
+    delete_tasks,
+    get_owned_task,
+    insert_tasks,
+    next_page_cursor,
+    owned_task_states,
+    search_query,
+    task_counts,
+    task_page_query,
+    task_state,
+    task_total,
+    update_tasks,
+)
+from pyramid_todo.models.model_defs import DATE_FMT
+from pyramid_todo.models.queries import SORT_COLUMNS
+from pyramid_todo.conditional import not_modified
+from pyramid_todo.export import CONTENT_TYPES, export_chunks
+from pyramid_todo.reminders import schedule_after_commit
+from pyramid_todo.renderers import Stream
+from pyramid_todo.serializers import (
+    PROFILE_FIELDS,
+    TASK_COLUMNS,
+    get_dumps,
+    profile_serializer,
+    serialize_task,
+)
 from pyramid_todo import security
 
 
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_SEARCH_RESULTS = 20
+MAX_PAGE_SIZE = 1000
+MAX_BATCH_SIZE = 500
+# profile fields served from an aggregate rather than the profile row
+COUNT_FIELDS = ('task_count',)
+TRUTHY = ('true', '1', 'yes')
+FALSY = ('false', '0', 'no')
+
+
 def get_profile(request, username):
     """Check if the requested profile exists."""
     return request.dbsession.query(Profile).filter(
@@ -16,6 +57,148 @@ def get_profile(request, username):
     ).first()
 
 
+def parse_bool(value, name):
+    """Read a boolean from JSON or from a query string value."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        if value.lower() in TRUTHY:
+            return True
+        if value.lower() in FALSY:
+            return False
+    raise ValueError('{} must be true or false'.format(name))
+
+
+def parse_task_fields(data, partial=False):
+    """Validate the task fields of one batch operation into column values.
+
+    With ``partial``, only the fields present in ``data`` are returned, as
+    for an update. Raises ``ValueError`` with a client-facing message on
+    bad input.
+    """
+    fields = {}
+    if 'name' in data or not partial:
+        name = data.get('name')
+        if not isinstance(name, str) or not name:
+            raise ValueError('name must be a non-empty string')
+        fields['name'] = name
+    if 'note' in data:
+        if data['note'] is not None and not isinstance(data['note'], str):
+            raise ValueError('note must be a string')
+        fields['note'] = data['note']
+    if 'due_date' in data:
+        due_date = data['due_date']
+        try:
+            fields['due_date'] = datetime.strptime(due_date, DATE_FMT) if due_date else None
+        except (TypeError, ValueError):
+            raise ValueError('due_date must be formatted as {}'.format(DATE_FMT))
+    if 'completed' in data:
+        fields['completed'] = parse_bool(data['completed'], 'completed')
+    elif not partial:
+        fields['completed'] = False
+    return fields
+
+
+def parse_limit(params, default):
+    """Read the ``limit`` query parameter, or ``ValueError``."""
+    try:
+        limit = int(params.get('limit', default))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError('limit must be between 1 and {}'.format(MAX_PAGE_SIZE))
+    return limit
+
+
+def parse_task_filters(params):
+    """Read paging, sorting and filtering options for a task listing.
+
+    Raises ``ValueError`` with a client-facing message on bad input.
+    """
+    limit = parse_limit(params, DEFAULT_PAGE_SIZE)
+
+    sort = params.get('sort', 'id')
+    if sort.lstrip('-') not in SORT_COLUMNS:
+        raise ValueError('sort must be one of: {}'.format(
+            ', '.join(sorted(SORT_COLUMNS))
+        ))
+
+    completed = params.get('completed')
+    if completed is not None:
+        completed = parse_bool(completed, 'completed')
+
+    filters = {
+        'limit': limit,
+        'sort': sort,
+        'cursor': params.get('cursor') or None,
+        'completed': completed,
+    }
+    for key in ('due_before', 'due_after'):
+        value = params.get(key)
+        try:
+            filters[key] = datetime.strptime(value, DATE_FMT) if value else None
+        except ValueError:
+            raise ValueError('{} must be formatted as {}'.format(key, DATE_FMT))
+    return filters
+
+
+def parse_names(params, key):
+    """The names in a parameter given as a comma separated list, or repeated."""
+    return [name for value in params.getall(key) for name in value.split(',') if name]
+
+
+def parse_profile_fields(params):
+    """Read the ``fields`` and ``include`` options of a profile response.
+
+    Returns ``(fields, include_tasks)``, ``fields`` being a frozenset. By
+    default every column of the profile is sent and its tasks are not.
+    Raises ``ValueError`` with a client-facing message on bad input.
+    """
+    fields = frozenset(PROFILE_FIELDS)
+    if 'fields' in params:
+        fields = frozenset(parse_names(params, 'fields'))
+        if not fields or not fields <= set(PROFILE_FIELDS + COUNT_FIELDS):
+            raise ValueError('fields must be a comma separated list of: {}'.format(
+                ', '.join(PROFILE_FIELDS + COUNT_FIELDS)
+            ))
+    include = set(parse_names(params, 'include'))
+    if not include <= {'tasks'}:
+        raise ValueError('include can only be tasks')
+    return fields, 'tasks' in include
+
+
+def profile_body(request, profile, fields, include_tasks):
+    """The profile's ``fields``, followed by its tasks if they are included.
+
+    The task count is read from the profile's counters. The tasks are a
+    ``Stream``, for views with the ``json_stream`` renderer.
+    """
+    body = profile_serializer(fields)(profile)
+    if 'task_count' in fields:
+        body['task_count'] = task_total(request.dbsession, profile.id)
+    if include_tasks:
+        body['tasks'] = Stream(request.dbsession.query(*TASK_COLUMNS).filter(
+            Task.profile_id == profile.id
+        ).order_by(Task.id), serialize_task)
+    return body
+
+
+def get_owner_profile(request):
+    """The profile named in the URL, if it is the logged-in user's own."""
+    if security.is_user(request):
+        return request.profile
+
+
+def forbidden_or_missing(request):
+    """Tell a caller who is not the profile's owner why they were refused."""
+    response = request.response
+    if get_profile(request, request.matchdict['username']):
+        response.status_code = 403
+        return {'error': 'You do not have permission to access this data.'}
+    response.status_code = 404
+    return {'error': 'The profile does not exist'}
+
+
 def get_json_response(request):
     """Retrieve the response object with content_type of json."""
     response = request.response
@@ -30,8 +213,9 @@ def info_view(request):
     """List of routes for this API."""
     return {
         'info': 'GET /api/v1',
+        'pool and load statistics': 'GET /api/v1/status',
         'register': 'POST /api/v1/accounts',
-        'single profile detail': 'GET /api/v1/accounts/<username>',
+        'single profile detail': 'GET /api/v1/accounts/<username>?fields=<names>&include=tasks',
         'edit profile': 'PUT /api/v1/accounts/<username>',
         'delete profile': 'DELETE /api/v1/accounts/<username>',
         'login': 'POST /api/v1/accounts/login',
@@ -40,74 +224,291 @@ def info_view(request):
         "create task": 'POST /api/v1/accounts/<username>/tasks',
         "task detail": 'GET /api/v1/accounts/<username>/tasks/<id>',
         "task update": 'PUT /api/v1/accounts/<username>/tasks/<id>',
-        "delete task": 'DELETE /api/v1/accounts/<username>/tasks/<id>'
+        "delete task": 'DELETE /api/v1/accounts/<username>/tasks/<id>',
+        "bulk task operations": 'POST /api/v1/accounts/<username>/tasks/batch',
+        "export tasks": 'GET /api/v1/accounts/<username>/tasks/export?format=ndjson|csv',
+        "task counts": 'GET /api/v1/accounts/<username>/tasks/summary',
+        "search tasks": 'GET /api/v1/accounts/<username>/tasks/search?q=<words>'
     }
 
 
-@view_config(route_name='tasks', renderer='json', request_method='GET')
+@view_config(route_name='tasks', renderer='json_stream', request_method='GET')
 def tasks_list(request):
-    """List tasks for one user."""
+    """List tasks for one user, one keyset-paginated page at a time.
+
+    Accepts ``limit``, ``sort``, ``cursor``, ``completed``, ``due_before``
+    and ``due_after`` query parameters. The ``next`` cursor in the response
+    fetches the following page, and is null on the last one. The page is
+    streamed out as it is read. Responses carry an ``ETag`` and
+    ``Last-Modified``, and a matching conditional request gets a 304.
+    """
     response = get_json_response(request)
-    profile = get_profile(request, request.matchdict['username'])
+    profile = get_owner_profile(request)
     if profile:
-        if security.is_user(request):
-            username = request.matchdict['username']
-            tasks = request.dbsession.query(Task).filter(
-                Task.profile == profile
-            ).all()
-            return {
-                'username': username,
-                'tasks': [task.to_dict() for task in tasks],
-            }
-        response.status_code = 403
-        return {'error': 'You do not have permission to access this data.'}
+        username = request.matchdict['username']
+        try:
+            filters = parse_task_filters(request.GET)
+            query = task_page_query(request.dbsession, profile.id, **filters)
+        except ValueError as error:
+            response.status_code = 400
+            return {'error': str(error)}
+        if not_modified(request, profile):
+            return response
+        tasks = Stream(
+            query.with_entities(*TASK_COLUMNS), serialize_task,
+            limit=filters['limit']
+        )
+        return {
+            'username': username,
+            'tasks': tasks,
+            'next': lambda: next_page_cursor(filters['sort'], tasks.last) if tasks.truncated else None,
+        }
 
-    response.status_code = 404
-    return {'error': 'The profile does not exist'}
+    return forbidden_or_missing(request)
 
 
 @view_config(route_name='tasks', renderer='json', request_method='POST')
 def task_create(request):
     """Create a new task for this user."""
     response = get_json_response(request)
-    profile = get_profile(request, request.matchdict['username'])
+    profile = get_owner_profile(request)
+    if profile:
+        due_date = request.POST['due_date']
+        try:
+            task = Task(
+                name=request.POST['name'],
+                note=request.POST['note'],
+                creation_date=datetime.now(),
+                due_date=datetime.strptime(due_date, '%d/%m/%Y %H:%M:%S') if due_date else None,
+                completed=parse_bool(request.POST['completed'], 'completed'),
+                profile_id=profile.id,
+                profile=profile
+            )
+            request.dbsession.add(task)
+            request.dbsession.flush()
+            bump_version(request.dbsession, profile.id)
+            adjust_task_counts(request.dbsession, profile.id, added=[task_state(task)])
+            schedule_after_commit(request, {task.id: task_state(task)})
+            response.status_code = 201
+            return {'msg': 'posted'}
+        except KeyError:
+            response.status_code = 400
+            return {'error': 'Some fields are missing'}
+        except ValueError as error:
+            response.status_code = 400
+            return {'error': str(error)}
+
+    return forbidden_or_missing(request)
+
+
+def batch_count_changes(owned, creates, updates, deletes):
+    """The ``(removed, added, final)`` task states of a batch.
+
+    ``removed`` and ``added`` are for the task counts. ``owned`` maps the
+    ids of the batch's own tasks to their states before it; operations on
+    other ids were refused and change nothing. ``final`` maps the same ids
+    to their states after it, or to ``None`` if they were deleted.
+    """
+    current = dict(owned)
+    removed = []
+    added = [(fields['completed'], fields.get('due_date')) for _, fields in creates]
+    for _, fields in updates:
+        old = current.get(fields['id'])
+        if old is not None:
+            new = (
+                fields.get('completed', old[0]),
+                fields['due_date'] if 'due_date' in fields else old[1],
+            )
+            removed.append(old)
+            added.append(new)
+            current[fields['id']] = new
+    final = dict(current)
+    for _, task_id in deletes:
+        if task_id in current:
+            removed.append(current.pop(task_id))
+            final[task_id] = None
+    return removed, added, final
+
+
+@view_config(route_name='task_batch', renderer='json', request_method='POST')
+def task_batch(request):
+    """Apply many task creates, updates and deletes in one transaction.
+
+    Expects a JSON body such as ``{"operations": [{"op": "create",
+    "name": "..."}, {"op": "update", "id": 1, "completed": true},
+    {"op": "delete", "id": 2}]}`` and returns one result per operation, in
+    the same order. Operations that fail validation or name someone else's
+    task are reported individually and do not stop the rest.
+
+    Operations of a kind are applied together, so a batch may touch each
+    task only once; otherwise the whole batch is refused with a 400.
+    """
+    response = get_json_response(request)
+    profile = get_owner_profile(request)
     if profile:
-        if security.is_user(request):
-            due_date = request.POST['due_date']
+        try:
+            operations = request.json_body['operations']
+        except (ValueError, KeyError, TypeError):
+            operations = None
+        if not isinstance(operations, list):
+            response.status_code = 400
+            return {'error': 'Expected a JSON object with a list of operations'}
+        if len(operations) > MAX_BATCH_SIZE:
+            response.status_code = 400
+            return {'error': 'A batch can hold at most {} operations'.format(MAX_BATCH_SIZE)}
+
+        results = [None] * len(operations)
+        creates, updates, deletes = [], [], []
+        now = datetime.now()
+        for index, operation in enumerate(operations):
+            op = operation.get('op') if isinstance(operation, dict) else None
             try:
-                task = Task(
-                    name=request.POST['name'],
-                    note=request.POST['note'],
-                    creation_date=datetime.now(),
-                    due_date=datetime.strptime(due_date, '%d/%m/%Y %H:%M:%S') if due_date else None,
-                    completed=request.POST['completed'],
-                    profile_id=profile.id,
-                    profile=profile
-                )
-                request.dbsession.add(task)
-                response.status_code = 201
-                return {'msg': 'posted'}
-            except KeyError:
-                response.status_code = 400
-                return {'error': 'Some fields are missing'}
+                if op == 'create':
+                    fields = parse_task_fields(operation)
+                    fields.update(creation_date=now, profile_id=profile.id)
+                    creates.append((index, fields))
+                elif op in ('update', 'delete'):
+                    task_id = operation.get('id')
+                    if not isinstance(task_id, int) or isinstance(task_id, bool):
+                        raise ValueError('id must be an integer')
+                    if op == 'update':
+                        fields = parse_task_fields(operation, partial=True)
+                        fields['id'] = task_id
+                        updates.append((index, fields))
+                    else:
+                        deletes.append((index, task_id))
+                else:
+                    raise ValueError('op must be one of create, update or delete')
+            except ValueError as error:
+                results[index] = {'op': op, 'status': 400, 'error': str(error)}
+
+        task_ids = [fields['id'] for _, fields in updates] + [task_id for _, task_id in deletes]
+        repeated = sorted(task_id for task_id, count in Counter(task_ids).items() if count > 1)
+        if repeated:
+            response.status_code = 400
+            return {'error': 'A batch can touch each task only once; repeated: {}'.format(
+                ', '.join(str(task_id) for task_id in repeated)
+            )}
+
+        owned = owned_task_states(request.dbsession, profile.id, task_ids)
+        touched = [('update', index, fields['id']) for index, fields in updates]
+        touched += [('delete', index, task_id) for index, task_id in deletes]
+        for op, index, task_id in touched:
+            results[index] = {'op': op, 'id': task_id, 'status': 200}
+            if task_id not in owned:
+                results[index].update(status=404, error='The task does not exist')
+
+        new_ids = insert_tasks(request.dbsession, [fields for _, fields in creates])
+        for (index, _), task_id in zip(creates, new_ids):
+            results[index] = {'op': 'create', 'id': task_id, 'status': 201}
+        update_tasks(request.dbsession, [
+            fields for _, fields in updates
+            if fields['id'] in owned and len(fields) > 1
+        ])
+        delete_tasks(request.dbsession, [
+            task_id for _, task_id in deletes if task_id in owned
+        ])
+        if creates or owned:
+            removed, added, final = batch_count_changes(owned, creates, updates, deletes)
+            bump_version(request.dbsession, profile.id)
+            adjust_task_counts(request.dbsession, profile.id, removed, added)
+            mark_changed(request.dbsession, request.tm)
+            final.update(
+                (task_id, (fields['completed'], fields.get('due_date')))
+                for (_, fields), task_id in zip(creates, new_ids)
+            )
+            schedule_after_commit(request, final)
+        return {'username': request.matchdict['username'], 'results': results}
+
+    return forbidden_or_missing(request)
+
+
+@view_config(route_name='task_search', renderer='json', request_method='GET')
+def task_search(request):
+    """Find the user's tasks matching the words in ``q``, best match first.
+
+    Every word must appear in the task's name or note. Matches in the name
+    rank higher. ``limit`` caps the number of results.
+    """
+    response = get_json_response(request)
+    profile = get_owner_profile(request)
+    if profile:
+        try:
+            limit = parse_limit(request.GET, DEFAULT_SEARCH_RESULTS)
+            tasks = search_query(
+                request.dbsession, TASK_COLUMNS, profile.id, request.GET.get('q', ''), limit
+            ).all()
+        except ValueError as error:
+            response.status_code = 400
+            return {'error': str(error)}
+        return {
+            'username': profile.username,
+            'tasks': [serialize_task(task) for task in tasks],
+        }
 
-        response.status_code = 403
-        return {'error': 'You do not have permission to access this data.'}
+    return forbidden_or_missing(request)
 
-    response.status_code = 404
-    return {'error': 'The profile does not exist'}
+
+@view_config(route_name='task_summary', renderer='json', request_method='GET')
+def task_summary(request):
+    """Count the user's open, completed and overdue tasks.
+
+    The counts are kept up to date as tasks are written, so this reads a
+    few counter rows rather than the tasks themselves.
+    """
+    profile = get_owner_profile(request)
+    if profile:
+        return dict(
+            {'username': profile.username},
+            **task_counts(request.dbsession, profile.id, datetime.now())
+        )
+
+    return forbidden_or_missing(request)
+
+
+@view_config(route_name='task_export', renderer='json', request_method='GET')
+def task_export(request):
+    """Stream out every one of the user's tasks, as NDJSON or CSV.
+
+    The ``format`` query parameter picks ``ndjson`` (the default) or
+    ``csv``. The body is sent in chunks as the tasks are read, a page at
+    a time, so any number of tasks can be exported.
+    """
+    profile = get_owner_profile(request)
+    if profile:
+        fmt = request.GET.get('format', 'ndjson')
+        if fmt not in CONTENT_TYPES:
+            get_json_response(request).status_code = 400
+            return {'error': 'format must be one of: {}'.format(', '.join(sorted(CONTENT_TYPES)))}
+        response = request.response
+        response.content_type = CONTENT_TYPES[fmt]
+        response.content_disposition = 'attachment; filename="{}-tasks.{}"'.format(
+            profile.username, fmt
+        )
+        response.app_iter = export_chunks(
+            fmt, request.dbsession_factory, profile.id,
+            get_dumps(request.registry.settings.get('pyramid_todo.json_encoder', 'stdlib'))
+        )
+        return response
+
+    return forbidden_or_missing(request)
 
 
 @view_config(route_name='one_task', renderer='json', request_method='GET')
 def task_detail(request):
-    """Get task detail for one user given a task ID."""
+    """Get task detail for one user given a task ID.
+
+    Answers conditional requests from the profile's version alone.
+    """
     response = get_json_response(request)
     if security.is_user(request):
         username = request.matchdict['username']
-        profile = get_profile(request, username)
-        task = request.dbsession.query(Task).get(request.matchdict['id'])
-        if task in profile.tasks:
-            return {'username': username, 'task': task.to_dict()}
+        profile = request.profile
+        if profile and not_modified(request, profile):
+            return response
+        task = get_owned_task(request.dbsession, request.matchdict['id'], request.profile_id)
+        if task:
+            return {'username': username, 'task': serialize_task(task)}
 
         response.status_code = 404
         return {'username': username, 'task': None}
@@ -122,9 +523,16 @@ def task_update(request):
     response = get_json_response(request)
     if security.is_user(request):
         username = request.matchdict['username']
-        profile = get_profile(request, username)
-        task = request.dbsession.query(Task).get(request.matchdict['id'])
-        if task in profile.tasks:
+        task = get_owned_task(request.dbsession, request.matchdict['id'], request.profile_id)
+        if task:
+            before = task_state(task)
+            try:
+                completed = None
+                if 'completed' in request.POST:
+                    completed = parse_bool(request.POST['completed'], 'completed')
+            except ValueError as error:
+                response.status_code = 400
+                return {'error': str(error)}
             if 'name' in request.POST and request.POST['name']:
                 task.name = request.POST['name']
             if 'note' in request.POST:
@@ -132,11 +540,17 @@ def task_update(request):
             if 'due_date' in request.POST:
                 due_date = request.POST['due_date']
                 task.due_date = datetime.strptime(due_date, '%d/%m/%Y %H:%M:%S') if due_date else None
-            if 'completed' in request.POST:
-                task.due_date = request.POST['completed']
+            if completed is not None:
+                task.completed = completed
             request.dbsession.add(task)
             request.dbsession.flush()
-            return {'username': username, 'task': task.to_dict()}
+            bump_version(request.dbsession, task.profile_id)
+            adjust_task_counts(
+                request.dbsession, task.profile_id, removed=[before], added=[task_state(task)]
+            )
+            if task_state(task) != before:
+                schedule_after_commit(request, {task.id: task_state(task)})
+            return {'username': username, 'task': serialize_task(task)}
 
         response.status_code = 404
         return {'username': username, 'task': None}
@@ -151,46 +565,71 @@ def task_delete(request):
     response = get_json_response(request)
     if security.is_user(request):
         username = request.matchdict['username']
-        profile = get_profile(request, username)
-        task = request.dbsession.query(Task).get(request.matchdict['id'])
-        if task in profile.tasks:
+        task = get_owned_task(request.dbsession, request.matchdict['id'], request.profile_id)
+        if task:
             request.dbsession.delete(task)
+            bump_version(request.dbsession, task.profile_id)
+            adjust_task_counts(request.dbsession, task.profile_id, removed=[task_state(task)])
+            schedule_after_commit(request, {task.id: None})
         return {'username': username, 'msg': 'Deleted.'}
 
     response.status_code = 403
     return {'error': 'You do not have permission to access this profile.'}
 
 
-@view_config(route_name='one_profile', renderer='json', request_method='GET')
+@view_config(route_name='one_profile', renderer='json_stream', request_method='GET')
 def profile_detail(request):
-    """Get detail for one profile."""
+    """Get detail for one profile.
+
+    ``?fields=email,task_count`` picks the fields to send and
+    ``?include=tasks`` streams out the profile's tasks as well; without
+    them the tasks table is not read at all. Supports conditional requests
+    like ``tasks_list``.
+    """
     response = get_json_response(request)
     if security.is_user(request):
-        profile = get_profile(request, request.matchdict['username'])
-        return profile.to_dict()
+        try:
+            fields, include_tasks = parse_profile_fields(request.GET)
+        except ValueError as error:
+            response.status_code = 400
+            return {'error': str(error)}
+        profile = request.profile
+        if not_modified(request, profile):
+            return response
+        return profile_body(request, profile, fields, include_tasks)
 
     response.status_code = 403
     return {'error': 'You do not have permission to access this profile.'}
 
 
-@view_config(route_name='one_profile', renderer='json', request_method='PUT')
+@view_config(route_name='one_profile', renderer='json_stream', request_method='PUT')
 def profile_update(request):
-    """Update an existing profile."""
+    """Update an existing profile.
+
+    The updated profile is sent back as ``profile_detail`` would send it,
+    taking the same query parameters.
+    """
     response = get_json_response(request)
     if security.is_user(request):
-        profile = get_profile(request, request.matchdict['username'])
+        try:
+            fields, include_tasks = parse_profile_fields(request.GET)
+        except ValueError as error:
+            response.status_code = 400
+            return {'error': str(error)}
+        profile = request.profile
         if 'username' in request.POST and request.POST['username'] != '':
             profile.username = request.POST['username']
         if 'email' in request.POST and request.POST['email'] != '':
             profile.email = request.POST['email']
         if 'password' in request.POST and 'password2' in request.POST and request.POST['password'] == request.POST['password2'] and request.POST['password'] != '':
-            profile.password = hasher.hash(request.POST['password'])
+            profile.password = security.get_hasher(request).hash(request.POST['password'])
         request.dbsession.add(profile)
         request.dbsession.flush()
+        bump_version(request.dbsession, profile.id)
         response.status_code = 202
         return {
             'msg': 'Profile updated.',
-            'profile': profile.to_dict(),
+            'profile': profile_body(request, profile, fields, include_tasks),
             'username': profile.username
         }
 
@@ -203,7 +642,8 @@ def profile_delete(request):
     """Delete an existing profile."""
     response = get_json_response(request)
     if security.is_user(request):
-        profile = get_profile(request, request.matchdict['username'])
+        profile = request.profile
+        delete_task_counts(request.dbsession, profile.id)
         request.dbsession.delete(profile)
         response.status_code = 204
         response.headers = forget(request)
@@ -260,8 +700,9 @@ def register(request):
                 new_profile = Profile(
                     username=username,
                     email=request.POST['email'],
-                    password=hasher.hash(request.POST['password']),
+                    password=security.get_hasher(request).hash(request.POST['password']),
                     date_joined=datetime.now(),
+                    modified=datetime.utcnow(),
                 )
                 request.dbsession.add(new_profile)
                 headers = remember(request, username)
@@ -0,0 +1,143 @@
+import ipaddress
+
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.response import Response
+from pyramid.security import NO_PERMISSION_REQUIRED
+from pyramid.settings import aslist
+from pyramid.view import view_config
+
+from pyramid_todo.metrics import render_prometheus
+from pyramid_todo.models import pool_stats
+
+
+# (status name, registry key) of the in-process caches
+CACHES = (
+    ('auth_ticket', 'auth_ticket_cache'),
+)
+
+
+def allowed_networks(value):
+    """The networks a ``pyramid_todo.status_from`` setting lets in.
+
+    ``*`` lets in every address and gives ``None``; an empty setting
+    lets in none.
+    """
+    entries = aslist(value)
+    if '*' in entries:
+        return None
+    return tuple(ipaddress.ip_network(entry, strict=False) for entry in entries)
+
+
+def check_status_access(request):
+    """Pretend the status routes aren't there for clients not let in.
+
+    Goes by the address the connection came from, not by any forwarding
+    header a client could set itself.
+    """
+    networks = request.registry['status_networks']
+    if networks is None:
+        return
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        raise HTTPNotFound()
+    if not any(address in network for network in networks):
+        raise HTTPNotFound()
+
+
+def get_status(registry):
+    status = {'pool': pool_stats(registry['dbsession_factory'].kw['bind'])}
+    if registry['replica_session_factories']:
+        status['replica_pools'] = [
+            pool_stats(session_factory.kw['bind'])
+            for session_factory in registry['replica_session_factories']
+        ]
+    if 'admission' in registry:
+        status['admission'] = registry['admission'].stats()
+    if registry.get('reminders') is not None:
+        status['reminders'] = registry['reminders'].stats()
+    status['caches'] = {
+        name: registry[key].stats() for name, key in CACHES if key in registry
+    }
+    return status
+
+
+@view_config(
+    route_name='status', renderer='json', permission=NO_PERMISSION_REQUIRED, request_method='GET'
+)
+def status_view(request):
+    """Live connection pool, admission control and cache statistics."""
+    check_status_access(request)
+    return get_status(request.registry)
+
+
+# (status key, metric type) for the pool, admission and cache numbers in /metrics
+POOL_METRICS = (
+    ('size', 'gauge'),
+    ('checked_in', 'gauge'),
+    ('checked_out', 'gauge'),
+    ('overflow', 'gauge'),
+    ('checkouts', 'counter'),
+    ('timeouts', 'counter'),
+    ('wait_seconds', 'counter'),
+)
+ADMISSION_METRICS = (
+    ('in_flight', 'gauge'),
+    ('waiting', 'gauge'),
+    ('shed', 'counter'),
+)
+CACHE_METRICS = (
+    ('size', 'gauge'),
+    ('hits', 'counter'),
+    ('misses', 'counter'),
+)
+
+
+def _metric_name(prefix, key, kind):
+    return prefix + key + ('_total' if kind == 'counter' else '')
+
+
+@view_config(route_name='metrics', permission=NO_PERMISSION_REQUIRED, request_method='GET')
+def metrics_view(request):
+    """Request, SQL, pool, admission and cache metrics for Prometheus to scrape."""
+    check_status_access(request)
+    status = get_status(request.registry)
+    pools = [('primary', status['pool'])] + [
+        ('replica{}'.format(number), pool)
+        for number, pool in enumerate(status.get('replica_pools', ()))
+    ]
+    extra = [
+        (_metric_name('pyramid_todo_pool_', key, kind), kind,
+         'Connection pool {}.'.format(key.replace('_', ' ')),
+         [({'database': database}, pool[key]) for database, pool in pools if key in pool])
+        for key, kind in POOL_METRICS if any(key in pool for _, pool in pools)
+    ]
+    routes = status.get('admission', {}).get('routes', {})
+    extra += [
+        (_metric_name('pyramid_todo_admission_', key, kind), kind,
+         'Admission control {}.'.format(key.replace('_', ' ')),
+         [({'route': route}, stats[key]) for route, stats in routes.items()])
+        for key, kind in ADMISSION_METRICS
+    ]
+    caches = status['caches']
+    extra += [
+        (_metric_name('pyramid_todo_cache_', key, kind), kind,
+         'In-process cache {}.'.format(key),
+         [({'cache': cache}, stats[key]) for cache, stats in sorted(caches.items())])
+        for key, kind in CACHE_METRICS
+    ]
+    response = Response(render_prometheus(request.registry['metrics'], extra))
+    response.content_type = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+def includeme(config):
+    """Let only the clients ``pyramid_todo.status_from`` lists read the status routes.
+
+    They show internal counters and pool and cache state, so by default
+    nobody can, and they answer 404.
+    """
+    config.registry['status_networks'] = allowed_networks(
+        config.get_settings().get('pyramid_todo.status_from', '')
+    )
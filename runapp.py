@@ -1,10 +1,6 @@
 import os
 
-from paste.deploy import loadapp
-from waitress import serve
+from pyramid_todo.scripts.prefork import main
 
 if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 5000))
-    app = loadapp('config:production.ini', relative_to='.')
-
-    serve(app, host='0.0.0.0', port=port)
\ No newline at end of file
+    main(['prefork', 'production.ini', '--port', os.environ.get("PORT", "5000")])
@@ -23,6 +23,11 @@ tests_require = [
     'Faker'
 ]
 
+speedups_requires = [
+    'orjson',
+    'brotli'
+]
+
 dev_requires = [
     'ipython',
     'pyramid_ipython'
@@ -47,6 +52,7 @@ setup(
     zip_safe=False,
     extras_require={
         'testing': tests_require,
+        'speedups': speedups_requires,
         'dev': dev_requires
     },
     install_requires=requires,
@@ -56,6 +62,13 @@ setup(
         ],
         'console_scripts': [
             'initdb = pyramid_todo.scripts.initializedb:main',
+            'migratedb = pyramid_todo.scripts.migratedb:main',
+            'importtasks = pyramid_todo.scripts.importtasks:main',
+            'exporttasks = pyramid_todo.scripts.exporttasks:main',
+            'prefork = pyramid_todo.scripts.prefork:main',
+            'recounttasks = pyramid_todo.scripts.recounttasks:main',
+            'remindtasks = pyramid_todo.scripts.remindtasks:main',
+            'buildassets = pyramid_todo.scripts.buildassets:main',
         ],
     },
 )